@@ -0,0 +1,129 @@
+"""
+Throughput and per-command latency of every attempt's simulate_coding_framework on seeded traces.
+
+Usage: python bench_attempts.py [--sizes 1000 10000 ...] [--attempts simulation ...] [--seed S]
+                                [--rollback-rate R] [--prefix-skew K] [--budget SECONDS]
+                                [--out results.json] [--baseline old.json]
+
+Each command's latency is the time between the implementation asking for it and asking for the
+next one, so no implementation has to be changed to be measured. simulation.py reads commands
+ahead in batches, so it is timed between the results its stream_coding_framework yields instead
+(the batch compile lands on the first command of each batch). An attempt that raises, or that
+took longer than --budget seconds at one size, is not run at the larger ones.
+Results are written as JSON, one entry per attempt and size, to bench_results/ next to this
+script unless --out says otherwise, so two runs can be diffed or passed back in as --baseline.
+"""
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import os
+import platform
+import time
+
+import numpy
+
+from workload import generate_trace
+
+# default home of the JSON results, kept out of git
+RESULTS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_results")
+ATTEMPTS = ["simulation", "simulation2", "simulation_170825", "simulation_300825"]
+
+class TimedCommands():
+    """
+    Iterates over commands, recording when each one is taken.
+    """
+    def __init__(self, commands: list[list]):
+        self.commands: list[list] = commands
+        self.taken: list[float] = []
+
+    def __iter__(self):
+        for command in self.commands:
+            self.taken.append(time.perf_counter())
+            # some attempts append a default ttl to the command they were given
+            yield list(command)
+        self.taken.append(time.perf_counter())
+
+def run(module, commands: list[list]) -> tuple[float, list[float]]:
+    # returns the total seconds and the latency of each command
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        if hasattr(module, "stream_coding_framework"):
+            marks = [start]
+            for _ in module.stream_coding_framework(commands):
+                marks.append(time.perf_counter())
+        else:
+            timed_commands = TimedCommands(commands)
+            module.simulate_coding_framework(timed_commands)
+            marks = timed_commands.taken
+        elapsed = time.perf_counter() - start
+    return elapsed, numpy.diff(marks).tolist()
+
+def summarize(commands: list[list], elapsed: float, latencies: list[float]) -> dict:
+    by_command = {}
+    for command, latency in zip(commands, latencies):
+        by_command.setdefault(command[0], []).append(latency)
+    return {
+        "commands": len(commands),
+        "seconds": round(elapsed, 6),
+        "commands_per_second": round(len(commands) / elapsed, 1),
+        "latency_us": {
+            command: {"count": len(values), "p50": round(float(numpy.percentile(values, 50)) * 1e6, 2), "p99": round(float(numpy.percentile(values, 99)) * 1e6, 2)}
+            for command, values in sorted(by_command.items())
+        },
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--attempts", nargs="+", default=ATTEMPTS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rollback-rate", type=float, default=0.01)
+    parser.add_argument("--prefix-skew", type=float, default=1.0)
+    parser.add_argument("--budget", type=float, default=60.0)
+    parser.add_argument("--out", default=os.path.join(RESULTS_DIRECTORY, "bench_attempts.json"))
+    parser.add_argument("--baseline")
+    args = parser.parse_args()
+
+    results = {
+        "python": platform.python_version(),
+        "workload": {"seed": args.seed, "rollback_rate": args.rollback_rate, "prefix_skew": args.prefix_skew},
+        "runs": [],
+    }
+    stopped = {}
+    print(f"{'attempt':<20} {'commands':>9} {'commands/s':>11} {'slowest p99 us':>15}")
+    for size in args.sizes:
+        commands = generate_trace(size, seed=args.seed, rollback_rate=args.rollback_rate, prefix_skew=args.prefix_skew)
+        for attempt in args.attempts:
+            if attempt in stopped:
+                continue
+            try:
+                elapsed, latencies = run(importlib.import_module(attempt), commands)
+            except Exception as error:
+                stopped[attempt] = f"{type(error).__name__}: {error}"
+                results["runs"].append({"attempt": attempt, "commands": size, "error": stopped[attempt]})
+                print(f"{attempt:<20} {size:>9} {'error':>11} {stopped[attempt]}")
+                continue
+            run_result = {"attempt": attempt, **summarize(commands, elapsed, latencies)}
+            results["runs"].append(run_result)
+            slowest = max(latency["p99"] for latency in run_result["latency_us"].values())
+            print(f"{attempt:<20} {size:>9} {run_result['commands_per_second']:>11.0f} {slowest:>15.1f}")
+            if elapsed > args.budget:
+                stopped[attempt] = f"over the {args.budget}s budget"
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, "w") as out:
+        json.dump(results, out, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            before = {(run["attempt"], run["commands"]): run for run in json.load(baseline)["runs"] if "error" not in run}
+        print(f"{'attempt':<20} {'commands':>9} {'speedup':>8}")
+        for run_result in results["runs"]:
+            previous = before.get((run_result["attempt"], run_result["commands"]))
+            if previous is not None and "error" not in run_result:
+                print(f"{run_result['attempt']:<20} {run_result['commands']:>9} {run_result['commands_per_second'] / previous['commands_per_second']:>8.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Startup cost of every attempt module: how long a fresh interpreter takes to import it.
+
+Usage: python bench_import.py [--attempts simulation ...] [--repeat N] [--out results.json] [--baseline old.json]
+
+Each import runs in its own `python -X importtime` process, after one untimed warm-up run that
+leaves the bytecode cache written (unless PYTHONDONTWRITEBYTECODE is set, in which case every
+run compiles the module again). The module's own cumulative import time is read from the
+-X importtime report, and the heavy optional modules it pulled in (numpy, sortedcontainers)
+are listed, with the standard library modules only the modules split off simulation.py need
+(LAZY_MODULES), so an accidental eager import shows up. For simulation itself either is an
+error: the run stops once its row is printed. Results are written as JSON, to
+bench_results/ next to this script unless --out says otherwise, so two runs can be diffed or
+passed back in as --baseline.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+
+# default home of the JSON results, kept out of git
+RESULTS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_results")
+ATTEMPTS = ["simulation", "simulation2", "simulation_170825", "simulation_300825"]
+HEAVY_MODULES = ["numpy", "sortedcontainers"]
+# imported by file_cluster, file_snapshot, file_concurrency and write_ahead_log, not by simulation itself
+LAZY_MODULES = ["hashlib", "mmap", "struct", "threading", "json"]
+
+def import_once(module: str) -> tuple[float, list[str]]:
+    # returns the module's cumulative import milliseconds and the heavy or lazy modules loaded with it
+    probe = f"import sys, {module}; print(','.join(name for name in {HEAVY_MODULES + LAZY_MODULES!r} if name in sys.modules))"
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", probe], capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    microseconds = None
+    for line in completed.stderr.splitlines():
+        # "import time: self [us] | cumulative | imported package"
+        fields = line.split("|")
+        if len(fields) == 3 and fields[2].strip() == module:
+            microseconds = int(fields[1])
+    if microseconds is None:
+        raise RuntimeError(f"no import time reported for {module}")
+    return microseconds / 1e3, [name for name in completed.stdout.strip().split(",") if name]
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--attempts", nargs="+", default=ATTEMPTS)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--out", default=os.path.join(RESULTS_DIRECTORY, "bench_import.json"))
+    parser.add_argument("--baseline")
+    args = parser.parse_args()
+
+    results = {
+        "python": platform.python_version(),
+        "bytecode_cache": not os.environ.get("PYTHONDONTWRITEBYTECODE"),
+        "runs": [],
+    }
+    print(f"{'attempt':<20} {'median ms':>10} {'min ms':>8}  heavy or lazy modules loaded")
+    for attempt in args.attempts:
+        import_once(attempt)
+        times, heavy = [], []
+        for _ in range(args.repeat):
+            milliseconds, heavy = import_once(attempt)
+            times.append(milliseconds)
+        run_result = {"attempt": attempt, "median_ms": round(statistics.median(times), 3), "min_ms": round(min(times), 3), "heavy_modules": heavy}
+        results["runs"].append(run_result)
+        print(f"{attempt:<20} {run_result['median_ms']:>10.1f} {run_result['min_ms']:>8.1f}  {', '.join(heavy) or '-'}")
+        if attempt == "simulation" and heavy:
+            raise RuntimeError(f"importing simulation loads {', '.join(heavy)}")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, "w") as out:
+        json.dump(results, out, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            before = {run["attempt"]: run for run in json.load(baseline)["runs"]}
+        print(f"{'attempt':<20} {'speedup':>8}")
+        for run_result in results["runs"]:
+            previous = before.get(run_result["attempt"])
+            if previous is not None:
+                print(f"{run_result['attempt']:<20} {previous['median_ms'] / run_result['median_ms']:>8.2f}")
+
+if __name__ == "__main__":
+    main()
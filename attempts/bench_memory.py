@@ -0,0 +1,42 @@
+"""
+Peak memory of a FileManagementSystem holding N files.
+
+Usage: python bench_memory.py [N ...]   (default: 1000000 10000000)
+Each N runs in a fresh interpreter so peaks do not overlap.
+"""
+import resource
+import subprocess
+import sys
+import time
+
+from simulation import FileManagementSystem, Server
+
+def build(file_count: int) -> FileManagementSystem:
+    file_management_system = FileManagementSystem(Server())
+    for i in range(file_count):
+        # every other file gets a ttl so the expiry queue is exercised too
+        file_management_system.file_upload_at(1625140800 + i, f"file-{i:09}.txt", f"{i % 1000 + 1}kb", 86400 if i % 2 else None)
+    return file_management_system
+
+def measure(file_count: int) -> tuple[float, float]:
+    # ru_maxrss is in KiB on Linux
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    file_management_system = build(file_count)
+    elapsed = time.perf_counter() - start
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    assert len(file_management_system.table) == file_count
+    return (after - before) * 1024, elapsed
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "--child":
+        used, elapsed = measure(int(sys.argv[2]))
+        print(f"{used:.0f} {elapsed:.2f}")
+        sys.exit()
+
+    file_counts = [int(arg) for arg in sys.argv[1:]] or [1_000_000, 10_000_000]
+    print(f"{'files':>12} {'peak MiB':>10} {'bytes/file':>11} {'build s':>9}")
+    for file_count in file_counts:
+        result = subprocess.run([sys.executable, __file__, "--child", str(file_count)], capture_output=True, text=True, check=True)
+        used, elapsed = result.stdout.split()
+        print(f"{file_count:>12} {float(used) / 2 ** 20:>10.1f} {float(used) / file_count:>11.1f} {float(elapsed):>9.2f}")
@@ -0,0 +1,38 @@
+"""
+Cold start from a binary snapshot against replaying the command trace.
+
+Usage: python bench_snapshot.py [N ...]   (default: 100000 1000000)
+For each N, replays N uploads, writes a snapshot of the result, then times opening the
+snapshot (and its first search), and loading it back into a FileManagementSystem.
+"""
+import os
+import sys
+import tempfile
+import time
+
+from file_snapshot import Snapshot, write_snapshot
+from simulation import FileManagementSystem, Server, format_timestamp, simulate_coding_framework
+
+def trace(file_count: int) -> list[list]:
+    return [["FILE_UPLOAD_AT", format_timestamp(1625140800 + i), f"dir-{i % 100:02}/file-{i:09}.txt", f"{i % 1000 + 1}kb", 86400 if i % 2 else None] for i in range(file_count)]
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+if __name__ == "__main__":
+    file_counts = [int(arg) for arg in sys.argv[1:]] or [100_000, 1_000_000]
+    print(f"{'files':>10} {'replay s':>9} {'write s':>8} {'MiB':>7} {'open s':>8} {'1st search s':>12} {'load s':>8}")
+    for file_count in file_counts:
+        commands = trace(file_count)
+        file_management_system = FileManagementSystem(Server())
+        _, replay = timed(lambda: simulate_coding_framework(commands, file_management_system=file_management_system))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "files.snapshot")
+            _, write = timed(lambda: write_snapshot(file_management_system, path))
+            snapshot, opened = timed(lambda: Snapshot(path))
+            _, first_search = timed(lambda: snapshot.file_search_at(1625140800 + file_count, "dir-42/"))
+            _, load = timed(snapshot.load)
+            print(f"{file_count:>10} {replay:>9.2f} {write:>8.2f} {os.path.getsize(path) / 2 ** 20:>7.1f} {opened:>8.4f} {first_search:>12.4f} {load:>8.2f}")
+            snapshot.close()
@@ -0,0 +1,54 @@
+"""
+Write-ahead log commit throughput and recovery time.
+
+Usage: python bench_wal.py [N]   (default: 100000)
+Commits N uploads with a range of group sizes, then recovers N logged uploads with and
+without a checkpoint in front of the last 10% of them.
+"""
+import sys
+import tempfile
+import time
+
+from simulation import FileManagementSystem, Server, format_timestamp, stream_coding_framework
+from write_ahead_log import WriteAheadLog
+
+def uploads(file_count: int, start: int = 0) -> list[list]:
+    return [["FILE_UPLOAD_AT", format_timestamp(1625140800 + i), f"file-{i:09}.txt", f"{i % 1000 + 1}kb", 86400 if i % 2 else None] for i in range(start, start + file_count)]
+
+def commit_throughput(file_count: int, group_size: int) -> float:
+    # every record is fsynced as part of some group; fewer, larger groups mean fewer fsyncs
+    with tempfile.TemporaryDirectory() as directory:
+        commands = uploads(file_count)
+        start = time.perf_counter()
+        for _ in stream_coding_framework(commands, wal=WriteAheadLog(directory, group_size=group_size)):
+            pass
+        return file_count / (time.perf_counter() - start)
+
+def recovery_time(file_count: int, checkpoint: bool) -> tuple[int, float]:
+    with tempfile.TemporaryDirectory() as directory:
+        tail = file_count // 10 if checkpoint else file_count
+        wal = WriteAheadLog(directory, group_size=4096)
+        for _ in stream_coding_framework(uploads(file_count - tail), wal=wal):
+            pass
+        if checkpoint:
+            wal = WriteAheadLog(directory, group_size=4096)
+            wal.recover(FileManagementSystem(Server()))
+            wal.checkpoint()
+            wal.close()
+        for _ in stream_coding_framework(uploads(tail, file_count - tail), wal=WriteAheadLog(directory, group_size=4096)):
+            pass
+        start = time.perf_counter()
+        replayed = WriteAheadLog(directory).recover(FileManagementSystem(Server()))
+        return replayed, time.perf_counter() - start
+
+if __name__ == "__main__":
+    file_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    print(f"{'group size':>10} {'commits/s':>12}")
+    for group_size in [1, 16, 256, 4096]:
+        # single-record groups fsync every command, so they get a smaller run
+        count = file_count // 100 if group_size == 1 else file_count
+        print(f"{group_size:>10} {commit_throughput(count, group_size):>12.0f}")
+    print(f"{'recovery':>10} {'replayed':>12} {'seconds':>9}")
+    for checkpoint in [False, True]:
+        replayed, elapsed = recovery_time(file_count, checkpoint)
+        print(f"{'checkpoint' if checkpoint else 'full log':>10} {replayed:>12} {elapsed:>9.2f}")
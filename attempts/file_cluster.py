@@ -0,0 +1,187 @@
+"""
+FileCluster: many servers behind the FileManagementSystem interface, with file names placed on a
+consistent hash ring.
+"""
+import bisect
+import hashlib
+import heapq
+import itertools
+from typing import Iterable
+
+from simulation import SEARCH_LIMIT, File, FileManagementSystem, Server, format_timestamp, to_epoch
+
+# hash ring points per server in a FileCluster
+CLUSTER_REPLICAS = 128
+
+class FileCluster():
+    """
+    Many named servers behind the FileManagementSystem interface. Each file name is placed on one
+    server by consistent hashing (CLUSTER_REPLICAS points per server on a hash ring), searches fan
+    out to every server and merge the per-server top 10, and copies work across servers. Adding a
+    server only moves the files whose ring arc it takes over, about 1/N of them.
+    """
+    def __init__(self, servers: Iterable[Server]):
+        self.systems: dict[str, FileManagementSystem] = {}
+        # sorted (hash point, server name) pairs
+        self.ring: list[tuple[int, str]] = []
+        # latest timestamp seen by any server; every server is kept at it, so an untimed read on one
+        # that saw fewer timed commands does not return files the cluster has expired
+        self.clock: int | None = None
+        for server in servers:
+            self._join(server)
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+    def _join(self, server: Server) -> None:
+        if server.name in self.systems:
+            raise RuntimeError(f"server {server.name} already exists")
+        self.systems[server.name] = FileManagementSystem(server)
+        if self.clock is not None:
+            self.systems[server.name]._advance(self.clock)
+        for replica in range(CLUSTER_REPLICAS):
+            bisect.insort(self.ring, (self._hash(f"{server.name}#{replica}"), server.name))
+
+    def _advance(self, timestamp: str | int) -> int:
+        moment = to_epoch(timestamp)
+        if self.clock is None or moment > self.clock:
+            self.clock = moment
+            for system in self.systems.values():
+                system._advance(moment)
+        return moment
+
+    def owner(self, file_name: str) -> FileManagementSystem:
+        if not self.ring:
+            raise RuntimeError("cluster has no servers")
+        idx = bisect.bisect_left(self.ring, (self._hash(file_name), ""))
+        return self.systems[self.ring[idx % len(self.ring)][1]]
+
+    def add_server(self, server: Server) -> int:
+        """
+        Adds a server and moves over the files it now owns, with the files they replaced, so
+        ROLLBACK still brings those back. Returns how many files moved.
+        """
+        self._join(server)
+        system = self.systems[server.name]
+        moved = 0
+        for other in self.systems.values():
+            if other is system:
+                continue
+            moving = [file_name for file_name in itertools.chain(other.files, other.expired) if self.owner(file_name) is system]
+            for file_name in moving:
+                system._put(file_name, other._take(file_name))
+            if moving:
+                moved_names = set(moving)
+                other.undo_log = [entry for entry in other.undo_log[other.undo_start:] if entry[1] not in moved_names]
+                other.undo_start = 0
+            moved += len(moving)
+        return moved
+
+    def _merge_top(self, found: list[tuple[FileManagementSystem, list[str]]], timestamp: int | None = None) -> list[str]:
+        # each server already returned its own top 10; rank their union by (-size, name)
+        candidates = []
+        for system, file_names in found:
+            for file_name in file_names:
+                file = system.file_get(file_name)[0] if timestamp is None else system.file_get_at(timestamp, file_name)[0]
+                candidates.append((-file.size, file_name))
+        return [file_name for _, file_name in heapq.nsmallest(SEARCH_LIMIT, candidates)]
+
+    def file_upload(self, file_name: str, size: str | int) -> str:
+        return self.owner(file_name).file_upload(file_name, size)
+
+    def file_get(self, file_name: str) -> tuple[File, str] | None:
+        return self.owner(file_name).file_get(file_name)
+
+    def file_copy(self, source: str, dest: str) -> str:
+        source_system, dest_system = self.owner(source), self.owner(dest)
+        if source_system is dest_system:
+            return source_system.file_copy(source, dest)
+        source_file = source_system.file_get(source)
+        if source_file is None:
+            raise RuntimeError(f"file {source} not found")
+        dest_system._write(dest, source_file[0].size)
+        return f"copied {source} to {dest}"
+
+    def file_search(self, prefix: str) -> str:
+        found = [(system, system.search(prefix)) for system in self.systems.values()]
+        return f"found [{', '.join(self._merge_top(found))}]"
+
+    def file_upload_at(self, timestamp: str | int, file_name: str, size: str | int, ttl: int | None = None) -> str:
+        return self.owner(file_name).file_upload_at(self._advance(timestamp), file_name, size, ttl)
+
+    def file_get_at(self, timestamp: str | int, file_name: str) -> tuple[File | None, str]:
+        return self.owner(file_name).file_get_at(self._advance(timestamp), file_name)
+
+    def file_copy_at(self, timestamp: str | int, source: str, dest: str) -> str:
+        moment = self._advance(timestamp)
+        source_system, dest_system = self.owner(source), self.owner(dest)
+        if source_system is dest_system:
+            return source_system.file_copy_at(moment, source, dest)
+        source_file = source_system.file_get_at(moment, source)[0]
+        if source_file is None:
+            raise RuntimeError(f"file {source} not found")
+        dest_system._write(dest, source_file.size, moment)
+        return f"copied at {source} to {dest}"
+
+    def file_search_at(self, timestamp: str | int, prefix: str) -> str:
+        moment = self._advance(timestamp)
+        found = [(system, system.search_at(moment, prefix)) for system in self.systems.values()]
+        return f"found at [{', '.join(self._merge_top(found, moment))}]"
+
+    def get_many_at(self, timestamp: str | int, file_names: Iterable[str]) -> list[str]:
+        moment = to_epoch(timestamp)
+        return [self.file_get_at(moment, file_name)[1] for file_name in file_names]
+
+    def search_many_at(self, timestamp: str | int, prefixes: Iterable[str]) -> list[str]:
+        moment = to_epoch(timestamp)
+        return [self.file_search_at(moment, prefix) for prefix in prefixes]
+
+    def space_at(self, timestamp: str | int) -> str:
+        moment = self._advance(timestamp)
+        used = sum(system._used_at(moment) for system in self.systems.values())
+        capacities = [system.server.capacity for system in self.systems.values()]
+        if None in capacities:
+            return f"used {used} bytes, no limit"
+        return f"used {used} bytes, {sum(capacities) - used} bytes free"
+
+    def storage(self) -> str:
+        # copies between servers are re-uploaded, so only copies within a server share content
+        logical = sum(system.table.logical_bytes for system in self.systems.values())
+        physical = sum(system.table.contents.physical_bytes for system in self.systems.values())
+        return f"logical {logical} bytes, physical {physical} bytes"
+
+    def file_expiring_between(self, start: str | int, end: str | int) -> str:
+        first, last = to_epoch(start), to_epoch(end)
+        found = [[(system.table.expires[row], system.table.names[row]) for row in system._expiring_rows(first, last)] for system in self.systems.values()]
+        return f"expiring [{', '.join(file_name for _, file_name in heapq.merge(*found))}]"
+
+    def usage_at(self, timestamp: str | int) -> str:
+        moment = to_epoch(timestamp)
+        return f"used {sum(system._usage_at(moment) for system in self.systems.values())} bytes at {format_timestamp(timestamp)}"
+
+    def dir_size(self, path: str) -> str:
+        folders = [folder for folder in (system._folder(path) for system in self.systems.values()) if folder is not None]
+        if not folders:
+            return "dir not found"
+        return f"{folders[0].folder_path or '/'} has {sum(folder.file_count for folder in folders)} files, {sum(folder.total_size for folder in folders)} bytes"
+
+    def dir_list(self, path: str) -> str:
+        folders = [folder for folder in (system._folder(path) for system in self.systems.values()) if folder is not None]
+        if not folders:
+            return "dir not found"
+        entries = [f"{folder_name}/" for folder_name in sorted(set().union(*(folder.children for folder in folders)))]
+        entries += sorted(itertools.chain.from_iterable(folder.files for folder in folders))
+        return f"listed [{', '.join(entries)}]"
+
+    def rollback(self, timestamp: str | int) -> str:
+        for system in self.systems.values():
+            system.rollback(timestamp)
+        return f"rollback to {format_timestamp(timestamp)}"
+
+    def file_get_as_of(self, timestamp: str | int, file_name: str) -> tuple[File | None, str]:
+        # versions would have to follow files across rebalances; the cluster keeps no history
+        raise RuntimeError("file history is disabled")
+
+    def file_search_as_of(self, timestamp: str | int, prefix: str) -> str:
+        raise RuntimeError("file history is disabled")
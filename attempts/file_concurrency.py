@@ -0,0 +1,167 @@
+"""
+ConcurrentFileSystem: one writer and many lock-free readers over published LayeredSnapshots.
+"""
+import bisect
+import heapq
+import threading
+from typing import Iterable
+
+from file_snapshot import SNAPSHOT_EXPIRED, SNAPSHOT_LIVE, Snapshot, snapshot_bytes
+from simulation import SEARCH_LIMIT, FileManagementSystem, Server, command_handlers, compile_commands, is_alive, prefix_end, to_epoch
+
+# changed names a ConcurrentFileSystem layers over its last full snapshot, and commands it keeps to
+# replay over the state saved with it, before writing a new one, unless a quarter of its rows is more
+CONCURRENT_LAYERED_MIN = 4096
+
+class LayeredSnapshot():
+    """
+    Immutable state a ConcurrentFileSystem publishes: a Snapshot, with layers of changes on top.
+    A layer maps each name a batch changed to (state, size, expires_at) of its live or expired
+    file, or None when it holds neither. A batch adds one layer and merges it into the layers
+    below while they are no bigger, like a binary counter, so a read looks at O(log n) layers
+    and a change is copied O(log n) times before the next full snapshot takes it in.
+    """
+    def __init__(self, base: Snapshot, layers: tuple[tuple[dict, list[str]], ...] = ()):
+        self.base: Snapshot = base
+        # (changes, their names sorted), oldest first
+        self.layers: tuple[tuple[dict, list[str]], ...] = layers
+        self.layered: int = sum(len(changes) for changes, _ in layers)
+
+    def add_layer(self, changes: dict) -> "LayeredSnapshot":
+        layers = list(self.layers)
+        while layers and len(layers[-1][0]) <= len(changes):
+            changes = {**layers.pop()[0], **changes}
+        layers.append((changes, sorted(changes)))
+        return LayeredSnapshot(self.base, tuple(layers))
+
+    @staticmethod
+    def _matches(change: tuple[int, int, int] | None, moment: int | None) -> bool:
+        # the same test Snapshot makes of its rows: live without a moment, alive at one otherwise
+        return change is not None and (change[0] == SNAPSHOT_LIVE if moment is None else is_alive(change[2], moment))
+
+    def _find(self, file_name: str, moment: int | None) -> bool:
+        for changes, _ in reversed(self.layers):
+            if file_name in changes:
+                return self._matches(changes[file_name], moment)
+        return self.base._find(file_name, moment) is not None
+
+    def _top_files(self, prefix: str, moment: int | None) -> list[str]:
+        end = prefix_end(prefix)
+        seen, candidates = set(), []
+        for changes, file_names in reversed(self.layers):
+            start = bisect.bisect_left(file_names, prefix)
+            stop = len(file_names) if end is None else bisect.bisect_left(file_names, end)
+            for file_name in file_names[start:stop]:
+                if file_name not in seen:
+                    seen.add(file_name)
+                    if self._matches(changes[file_name], moment):
+                        candidates.append((-changes[file_name][1], file_name))
+        candidates.extend(self.base._ranked(prefix, moment, seen))
+        return [file_name for _, file_name in heapq.nsmallest(SEARCH_LIMIT, candidates)]
+
+    def file_get(self, file_name: str) -> str | None:
+        return f"got {file_name}" if self._find(file_name, None) else None
+
+    def file_get_at(self, timestamp: str | int, file_name: str) -> str:
+        return f"got at {file_name}" if self._find(file_name, to_epoch(timestamp)) else "file not found"
+
+    def file_search(self, prefix: str) -> str:
+        return f"found [{', '.join(self._top_files(prefix, None))}]"
+
+    def file_search_at(self, timestamp: str | int, prefix: str) -> str:
+        return f"found at [{', '.join(self._top_files(prefix, to_epoch(timestamp)))}]"
+
+class ConcurrentFileSystem():
+    """
+    One writer, many reader threads. Writes go through a FileManagementSystem under a lock and,
+    once a whole batch is applied, publish an immutable LayeredSnapshot of the result by swapping
+    a single reference. Reads never take the lock: each one answers from the state published
+    last, so a reader sees every batch (a ROLLBACK included) either entirely or not at all, and
+    never blocks a writer. Use snapshot() to make several reads from one state.
+
+    A batch publishes only the names it changed, as a new layer; a full Snapshot is written once
+    the layers hold more than CONCURRENT_LAYERED_MIN names or a quarter of the snapshot's rows,
+    and also once that many commands were written since, so the batches kept to undo a failed
+    one stay bounded even when every batch changes the same few names.
+    A batch that raises is undone: the system is rebuilt from the state saved with the last full
+    snapshot plus the batches written since, and file_management_system then refers to the
+    rebuilt one.
+    """
+    def __init__(self, file_management_system: FileManagementSystem | None = None):
+        self.file_management_system: FileManagementSystem = file_management_system if file_management_system is not None else FileManagementSystem(Server())
+        self.handlers: list = command_handlers(self.file_management_system)
+        self.lock: threading.Lock = threading.Lock()
+        self._publish_snapshot()
+
+    def _publish_snapshot(self) -> None:
+        # a full snapshot for the next layers to go over, and the state a failed batch goes back to
+        file_management_system = self.file_management_system
+        file_management_system.changed = set()
+        self.checkpoint: dict = file_management_system._export_state()
+        # compiled commands of the batches written since the checkpoint
+        self.written: list[tuple[int, tuple]] = []
+        self.published: LayeredSnapshot = LayeredSnapshot(Snapshot(snapshot_bytes(file_management_system)))
+
+    def _change(self, file_name: str) -> tuple[int, int, int] | None:
+        file_management_system = self.file_management_system
+        table = file_management_system.table
+        for state, index in ((SNAPSHOT_LIVE, file_management_system.files), (SNAPSHOT_EXPIRED, file_management_system.expired)):
+            row = index.get(file_name)
+            if row is not None:
+                return state, table.sizes[row], table.expires[row]
+        return None
+
+    def _restore(self) -> None:
+        old = self.file_management_system
+        restored = FileManagementSystem(Server(old.server.capacity, old.server.name), retention=old.retention, history=old.history, stats=old.stats, search_cache_size=old.search_cache_size, backend=old.backend)
+        restored._import_state(self.checkpoint)
+        handlers = command_handlers(restored)
+        for opcode, args in self.written:
+            handlers[opcode](*args)
+        restored.changed = set()
+        self.file_management_system, self.handlers = restored, handlers
+
+    def write(self, commands: Iterable[list]) -> list:
+        """
+        Applies a batch of commands and publishes the state after it, or raises the first error
+        with nothing of the batch applied.
+        """
+        with self.lock:
+            program = compile_commands(commands)
+            try:
+                results = [self.handlers[opcode](*args) for opcode, args in program]
+            except Exception:
+                self._restore()
+                raise
+            self.written.extend(program)
+            published, changed = self.published, self.file_management_system.changed
+            bound = max(CONCURRENT_LAYERED_MIN, len(published.base) // 4)
+            if published.layered + len(changed) > bound or len(self.written) > bound:
+                self._publish_snapshot()
+            elif changed:
+                self.file_management_system.changed = set()
+                self.published = published.add_layer({file_name: self._change(file_name) for file_name in changed})
+        return results
+
+    def snapshot(self) -> LayeredSnapshot:
+        return self.published
+
+    def file_get(self, file_name: str) -> str | None:
+        return self.published.file_get(file_name)
+
+    def file_get_at(self, timestamp: str | int, file_name: str) -> str:
+        return self.published.file_get_at(timestamp, file_name)
+
+    def file_search(self, prefix: str) -> str:
+        return self.published.file_search(prefix)
+
+    def file_search_at(self, timestamp: str | int, prefix: str) -> str:
+        return self.published.file_search_at(timestamp, prefix)
+
+    def get_many_at(self, timestamp: str | int, file_names: Iterable[str]) -> list[str]:
+        snapshot, moment = self.published, to_epoch(timestamp)
+        return [snapshot.file_get_at(moment, file_name) for file_name in file_names]
+
+    def search_many_at(self, timestamp: str | int, prefixes: Iterable[str]) -> list[str]:
+        snapshot, moment = self.published, to_epoch(timestamp)
+        return [snapshot.file_search_at(moment, prefix) for prefix in prefixes]
@@ -0,0 +1,241 @@
+"""
+Line-delimited network front-end for a FileManagementSystem, over TCP or a Unix socket.
+
+Protocol: every request is one line holding a JSON command list, e.g. ["FILE_UPLOAD", "a.txt", "1kb"],
+and every response is one line holding the JSON result simulate_coding_framework would give
+for it, or {"error": message} when the command fails. Responses on a connection come back in
+request order, so clients may pipeline as many requests as they like.
+
+Requests from every connection go through one bounded queue into a single engine task, which
+runs whatever is queued (up to batch_size) as one batch. A full queue stops connections from
+reading further requests, and a connection with pipeline_depth unanswered requests, or whose
+client is not reading its responses, stops reading too: backpressure reaches the sockets.
+
+Usage: python file_service.py [--port P | --unix PATH] [--wal DIRECTORY]
+"""
+import argparse
+import asyncio
+import collections
+import json
+
+from simulation import MUTATING_OPCODES, OPCODES, FileManagementSystem, Server, Stats, command_handlers
+from write_ahead_log import WriteAheadLog
+
+SERVICE_BATCH_SIZE = 512
+SERVICE_QUEUE_SIZE = 4096
+SERVICE_PIPELINE_DEPTH = 1024
+# how many pipelined requests FileClient.execute_many writes before waiting for the socket
+CLIENT_FLUSH_EVERY = 256
+
+class FileService():
+    """
+    Serves one FileManagementSystem to many connections. With a WriteAheadLog, the system is
+    recovered from it first and every batch is committed before its responses are sent; a batch
+    whose commit fails answers every request in it with the error.
+    """
+    def __init__(self, file_management_system: FileManagementSystem | None = None, batch_size: int = SERVICE_BATCH_SIZE, queue_size: int = SERVICE_QUEUE_SIZE, pipeline_depth: int = SERVICE_PIPELINE_DEPTH, wal: WriteAheadLog | None = None, stats: Stats | None = None):
+        self.file_management_system: FileManagementSystem = file_management_system if file_management_system is not None else FileManagementSystem(Server(), stats=stats)
+        self.batch_size: int = batch_size
+        self.queue_size: int = queue_size
+        self.pipeline_depth: int = pipeline_depth
+        self.wal: WriteAheadLog | None = wal
+        self.handlers: list = command_handlers(self.file_management_system)
+        if stats is not None:
+            self.handlers = stats.instrument(self.handlers)
+        if wal is not None:
+            wal.recover(self.file_management_system)
+        # created on start, inside the running event loop
+        self.queue: asyncio.Queue | None = None
+        self.engine: asyncio.Task | None = None
+        self.servers: list[asyncio.AbstractServer] = []
+        self.closed: bool = False
+
+    def _start_engine(self) -> None:
+        if self.engine is None:
+            self.queue = asyncio.Queue(self.queue_size)
+            self.engine = asyncio.create_task(self._run_engine())
+
+    async def start_tcp(self, host: str = "127.0.0.1", port: int = 0) -> asyncio.AbstractServer:
+        self._start_engine()
+        server = await asyncio.start_server(self._serve, host, port)
+        self.servers.append(server)
+        return server
+
+    async def start_unix(self, path: str) -> asyncio.AbstractServer:
+        self._start_engine()
+        server = await asyncio.start_unix_server(self._serve, path)
+        self.servers.append(server)
+        return server
+
+    async def close(self) -> None:
+        # the engine stops first, so whatever it has not taken yet is answered with an error
+        self.closed = True
+        if self.engine is not None:
+            self.engine.cancel()
+            self._fail_queued()
+        for server in self.servers:
+            server.close()
+            await server.wait_closed()
+        if self.wal is not None:
+            self.wal.close()
+
+    def _fail_queued(self) -> None:
+        while not self.queue.empty():
+            _, future = self.queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("service closed"))
+
+    def _execute(self, command):
+        compiled = OPCODES.get(command[0]) if isinstance(command, list) and command else None
+        if compiled is None:
+            raise RuntimeError(f"unknown command {command!r}")
+        opcode, args = compiled[0], compiled[1](command)
+        if self.wal is not None and opcode in MUTATING_OPCODES:
+            return self.wal.execute(self.handlers[opcode], opcode, args)
+        return self.handlers[opcode](*args)
+
+    async def _run_engine(self) -> None:
+        while True:
+            # wait for one request, then take whatever else is already queued
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            results = []
+            for command, _ in batch:
+                try:
+                    results.append(self._execute(command))
+                except Exception as error:
+                    results.append({"error": str(error)})
+            if self.wal is not None:
+                try:
+                    self.wal.commit()
+                except Exception as error:
+                    # nothing in the batch is durable, so none of it is answered as done
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(error)
+                    continue
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        # unanswered requests of this connection, in order; bounded by pipeline_depth
+        pending = asyncio.Queue(self.pipeline_depth)
+        responder = asyncio.create_task(self._respond(pending, writer))
+        loop = asyncio.get_running_loop()
+        try:
+            while line := await reader.readline():
+                if not line.strip():
+                    continue
+                future = loop.create_future()
+                try:
+                    command = json.loads(line)
+                except ValueError:
+                    future.set_result({"error": "malformed command"})
+                else:
+                    if self.closed:
+                        future.set_exception(RuntimeError("service closed"))
+                    else:
+                        await self.queue.put((command, future))
+                        if self.closed:
+                            # was waiting on a full queue while the service closed
+                            self._fail_queued()
+                await pending.put(future)
+        except ConnectionError:
+            pass
+        finally:
+            await pending.put(None)
+            await responder
+            writer.close()
+
+    async def _respond(self, pending: asyncio.Queue, writer: asyncio.StreamWriter) -> None:
+        while (future := await pending.get()) is not None:
+            try:
+                result = await future
+            except Exception as error:
+                result = {"error": str(error)}
+            try:
+                writer.write((json.dumps(result) + "\n").encode())
+                # waits only while the client is not keeping up
+                await writer.drain()
+            except ConnectionError:
+                # the client is gone; keep consuming so its reader can finish
+                continue
+
+class FileClient():
+    """
+    Pipelining client: send() writes a request and returns a future for its response right
+    away, execute() waits for one. Failed commands raise RuntimeError from their future.
+    """
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader: asyncio.StreamReader = reader
+        self.writer: asyncio.StreamWriter = writer
+        self.pending: collections.deque[asyncio.Future] = collections.deque()
+        self.receiver: asyncio.Task = asyncio.create_task(self._receive())
+
+    @classmethod
+    async def connect_tcp(cls, host: str, port: int) -> "FileClient":
+        return cls(*await asyncio.open_connection(host, port))
+
+    @classmethod
+    async def connect_unix(cls, path: str) -> "FileClient":
+        return cls(*await asyncio.open_unix_connection(path))
+
+    def send(self, command: list) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append(future)
+        self.writer.write((json.dumps(command) + "\n").encode())
+        return future
+
+    async def execute(self, command: list):
+        future = self.send(command)
+        await self.writer.drain()
+        return await future
+
+    async def execute_many(self, commands: list[list]) -> list:
+        # pipelined; a failed command's RuntimeError is returned in its place
+        futures = []
+        for command in commands:
+            futures.append(self.send(command))
+            if len(futures) % CLIENT_FLUSH_EVERY == 0:
+                await self.writer.drain()
+        await self.writer.drain()
+        return await asyncio.gather(*futures, return_exceptions=True)
+
+    async def _receive(self) -> None:
+        while line := await self.reader.readline():
+            result = json.loads(line)
+            future = self.pending.popleft()
+            if isinstance(result, dict) and "error" in result:
+                future.set_exception(RuntimeError(result["error"]))
+            else:
+                future.set_result(result)
+        for future in self.pending:
+            future.set_exception(ConnectionError("connection closed"))
+        self.pending.clear()
+
+    async def close(self) -> None:
+        # half-close, so the server still answers everything sent so far
+        self.writer.write_eof()
+        await self.receiver
+        self.writer.close()
+        await self.writer.wait_closed()
+
+async def _main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix")
+    parser.add_argument("--wal")
+    args = parser.parse_args()
+    service = FileService(wal=WriteAheadLog(args.wal) if args.wal else None)
+    server = await (service.start_unix(args.unix) if args.unix else service.start_tcp(args.host, args.port))
+    print(f"serving on {', '.join(str(sock.getsockname()) for sock in server.sockets)}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await service.close()
+
+if __name__ == "__main__":
+    asyncio.run(_main())
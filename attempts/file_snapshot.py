@@ -0,0 +1,216 @@
+"""
+Binary snapshots of a FileManagementSystem: write_snapshot / snapshot_bytes write one, Snapshot
+answers reads from it memory-mapped and loads it back. Needs NumPy, imported on first use.
+"""
+import itertools
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import Iterator
+
+from simulation import NO_TIME, SEARCH_LIMIT, FileManagementSystem, Server, is_alive, prefix_end, to_epoch
+
+# binary snapshot layout: a fixed header, then the int64 columns size, uploaded, expires, content
+# and replaced (the row each row replaced, -1 for none), the n + 1 int64 name offsets into the heap,
+# one uint8 state per row (padded to 8 bytes) and the UTF-8 name heap. Rows are sorted by name, so
+# a prefix is a contiguous row range
+SNAPSHOT_MAGIC = b"FMSSNAP\0"
+SNAPSHOT_VERSION = 2
+SNAPSHOT_HEADER = "<8sIIqqq"
+SNAPSHOT_HEADER_SIZE = 64
+# row states: live, evicted by the clock but kept for reads behind it, only in the history, or
+# replaced by a timed write and kept for ROLLBACK to put back. Only the first two answer reads
+SNAPSHOT_LIVE, SNAPSHOT_EXPIRED, SNAPSHOT_VERSION_ONLY, SNAPSHOT_REPLACED = range(4)
+
+def _snapshot_chunks(file_management_system: FileManagementSystem) -> Iterator[bytes]:
+    import numpy
+
+    table = file_management_system.table
+    states = dict.fromkeys(itertools.chain.from_iterable(file_management_system.versions.values()), SNAPSHOT_VERSION_ONLY)
+    states.update(dict.fromkeys(file_management_system.replaced.values(), SNAPSHOT_REPLACED))
+    states.update(dict.fromkeys(file_management_system.expired.values(), SNAPSHOT_EXPIRED))
+    states.update(dict.fromkeys(file_management_system.files.values(), SNAPSHOT_LIVE))
+    rows = sorted(states, key=lambda row: (table.names[row], table.uploaded[row], states[row]))
+    positions = {row: idx for idx, row in enumerate(rows)}
+    replaced = array("q", (positions[file_management_system.replaced[row]] if row in file_management_system.replaced else -1 for row in rows))
+    encoded = [table.names[row].encode() for row in rows]
+    offsets = numpy.zeros(len(rows) + 1, dtype=numpy.int64)
+    numpy.cumsum([len(name) for name in encoded], out=offsets[1:])
+    state_column = numpy.fromiter((states[row] for row in rows), dtype=numpy.uint8, count=len(rows))
+    clock = file_management_system.clock if file_management_system.clock is not None else NO_TIME
+    yield struct.pack(SNAPSHOT_HEADER, SNAPSHOT_MAGIC, SNAPSHOT_VERSION, 0, len(rows), clock, int(offsets[-1])).ljust(SNAPSHOT_HEADER_SIZE, b"\0")
+    for column in (table.sizes, table.uploaded, table.expires, table.content):
+        yield array("q", (column[row] for row in rows)).tobytes()
+    yield replaced.tobytes()
+    yield offsets.tobytes()
+    yield state_column.tobytes().ljust(-(-len(rows) // 8) * 8, b"\0")
+    yield b"".join(encoded)
+
+def write_snapshot(file_management_system: FileManagementSystem, path: str) -> None:
+    """
+    Writes the state of file_management_system to path as a binary snapshot. The file is written
+    next to path and renamed over it, so a reader never sees a partial snapshot.
+    """
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb") as snapshot:
+        snapshot.writelines(_snapshot_chunks(file_management_system))
+        snapshot.flush()
+        os.fsync(snapshot.fileno())
+    os.replace(temporary, path)
+
+def snapshot_bytes(file_management_system: FileManagementSystem) -> bytes:
+    # the same snapshot, kept in memory
+    return b"".join(_snapshot_chunks(file_management_system))
+
+class Snapshot():
+    """
+    Read-only view of a binary snapshot, memory-mapped so that opening it costs the same for any
+    number of files and pages are only read as queries touch them. Answers the read commands
+    as the system that wrote it would have; load() turns it back into a FileManagementSystem.
+    A snapshot_bytes() buffer can be opened the same way, without a file. Needs NumPy, which
+    writing and opening snapshots import on first use.
+    """
+    def __init__(self, source: str | bytes):
+        import numpy
+
+        if isinstance(source, bytes):
+            self.buffer: mmap.mmap | bytes = source
+        else:
+            with open(source, "rb") as snapshot:
+                self.buffer = mmap.mmap(snapshot.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, row_count, clock, heap_size = struct.unpack_from(SNAPSHOT_HEADER, self.buffer)
+        if magic != SNAPSHOT_MAGIC:
+            raise RuntimeError(f"{source if isinstance(source, str) else 'buffer'} is not a file snapshot")
+        if version != SNAPSHOT_VERSION:
+            raise RuntimeError(f"unsupported snapshot version {version}")
+        self.row_count: int = row_count
+        self.clock: int | None = clock if clock != NO_TIME else None
+        states_at = SNAPSHOT_HEADER_SIZE + 8 * (6 * row_count + 1)
+        if isinstance(source, bytes):
+            columns = numpy.frombuffer(source, dtype=numpy.int64, count=6 * row_count + 1, offset=SNAPSHOT_HEADER_SIZE)
+            self.states: numpy.ndarray = numpy.frombuffer(source, dtype=numpy.uint8, count=row_count, offset=states_at)
+        else:
+            # separate maps for the arrays, so the buffer has no exports and close() can unmap it
+            columns = numpy.memmap(source, dtype=numpy.int64, mode="r", offset=SNAPSHOT_HEADER_SIZE, shape=(6 * row_count + 1,))
+            self.states = numpy.memmap(source, dtype=numpy.uint8, mode="r", offset=states_at, shape=(row_count,))
+        self.sizes, self.uploaded, self.expires, self.content, self.replaced = (columns[i * row_count:(i + 1) * row_count] for i in range(5))
+        self.offsets: numpy.ndarray = columns[5 * row_count:]
+        self.heap_at: int = states_at + -(-row_count // 8) * 8
+
+    def __len__(self) -> int:
+        return self.row_count
+
+    def _name_bytes(self, row: int) -> bytes:
+        return self.buffer[self.heap_at + int(self.offsets[row]):self.heap_at + int(self.offsets[row + 1])]
+
+    def name(self, row: int) -> str:
+        return self._name_bytes(row).decode()
+
+    def _bisect(self, key: bytes) -> int:
+        # first row whose name is not below key; UTF-8 bytes sort like the strings they encode
+        lo, hi = 0, self.row_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._name_bytes(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _prefix_range(self, prefix: str) -> tuple[int, int]:
+        end = prefix_end(prefix)
+        return self._bisect(prefix.encode()), self.row_count if end is None else self._bisect(end.encode())
+
+    def _find(self, file_name: str, moment: int | None) -> int | None:
+        # the live or expired row of file_name, if it is alive at moment (or live, without one)
+        start, stop = self._prefix_range(file_name)
+        for row in range(start, stop):
+            if self._name_bytes(row) != file_name.encode():
+                break
+            state = self.states[row]
+            if state == SNAPSHOT_LIVE and moment is None or state <= SNAPSHOT_EXPIRED and moment is not None and is_alive(int(self.expires[row]), moment):
+                return row
+        return None
+
+    def _ranked(self, prefix: str, moment: int | None, exclude: set[str] | frozenset = frozenset()) -> list[tuple[int, str]]:
+        # (-size, name) of the top files under prefix whose names are not in exclude, best first
+        import numpy
+
+        start, stop = self._prefix_range(prefix)
+        states = self.states[start:stop]
+        if moment is None:
+            rows = numpy.flatnonzero(states == SNAPSHOT_LIVE)
+        else:
+            rows = numpy.flatnonzero((states <= SNAPSHOT_EXPIRED) & (self.expires[start:stop] > moment))
+        negated = -self.sizes[start:stop][rows]
+        # rows are name-sorted, so a stable sort by size breaks ties by name
+        order = numpy.argsort(negated, kind="stable")[:SEARCH_LIMIT + len(exclude)]
+        ranked = [(int(negated[idx]), self.name(start + int(rows[idx]))) for idx in order]
+        return [entry for entry in ranked if entry[1] not in exclude][:SEARCH_LIMIT]
+
+    def _top_files(self, prefix: str, moment: int | None) -> list[str]:
+        return [file_name for _, file_name in self._ranked(prefix, moment)]
+
+    def file_get(self, file_name: str) -> str | None:
+        return f"got {file_name}" if self._find(file_name, None) is not None else None
+
+    def file_get_at(self, timestamp: str | int, file_name: str) -> str:
+        return f"got at {file_name}" if self._find(file_name, to_epoch(timestamp)) is not None else "file not found"
+
+    def file_search(self, prefix: str) -> str:
+        return f"found [{', '.join(self._top_files(prefix, None))}]"
+
+    def file_search_at(self, timestamp: str | int, prefix: str) -> str:
+        return f"found at [{', '.join(self._top_files(prefix, to_epoch(timestamp)))}]"
+
+    def load(self, capacity: int | None = None, retention: int | None = None, history: bool = False, backend: str = "auto") -> FileManagementSystem:
+        """
+        Builds a FileManagementSystem from the snapshot, reading the columns in bulk.
+        """
+        import numpy
+
+        file_management_system = FileManagementSystem(Server(capacity), retention=retention, history=history, backend=backend)
+        table = file_management_system.table
+        heap = self.buffer[self.heap_at:self.heap_at + int(self.offsets[-1])].decode()
+        # offsets count bytes; they only index the decoded heap when every name is ASCII
+        if len(heap) == int(self.offsets[-1]):
+            offsets = self.offsets.tolist()
+            table.names = [sys.intern(heap[offsets[row]:offsets[row + 1]]) for row in range(self.row_count)]
+        else:
+            table.names = [sys.intern(self.name(row)) for row in range(self.row_count)]
+        table.sizes = array("q", self.sizes.tobytes())
+        table.uploaded = array("q", self.uploaded.tobytes())
+        table.expires = array("q", self.expires.tobytes())
+        # content ids are renumbered densely; copies still share theirs
+        _, first_rows, content = numpy.unique(self.content, return_index=True, return_inverse=True)
+        content = content.astype(numpy.int64).ravel()
+        table.content = array("q", content.tobytes())
+        table.contents.sizes = array("q", self.sizes[first_rows].tobytes())
+        table.contents.refs = array("q", numpy.bincount(content, minlength=len(first_rows)).astype(numpy.int64).tobytes())
+        table.contents.physical_bytes = int(self.sizes[first_rows].sum())
+        table.logical_bytes = int(self.sizes.sum())
+        state = {
+            "clock": self.clock,
+            "files": numpy.flatnonzero(self.states == SNAPSHOT_LIVE).tolist(),
+            "expired": numpy.flatnonzero(self.states == SNAPSHOT_EXPIRED).tolist(),
+            "versions": [],
+            # every timed write still held, and what it replaced, so ROLLBACK reaches as far back as it did
+            "undo": sorted((uploaded_at, table.names[row]) for row, uploaded_at in enumerate(self.uploaded.tolist()) if uploaded_at != NO_TIME and self.states[row] != SNAPSHOT_VERSION_ONLY),
+            "replaced": numpy.column_stack((numpy.flatnonzero(self.replaced >= 0), self.replaced[self.replaced >= 0])).tolist(),
+        }
+        if history:
+            versions = {}
+            for row, file_name in enumerate(table.names):
+                versions.setdefault(file_name, []).append(row)
+            state["versions"] = list(versions.values())
+        else:
+            for row in numpy.flatnonzero(self.states == SNAPSHOT_VERSION_ONLY).tolist():
+                table.release(row)
+        file_management_system._index_state(state, range(self.row_count))
+        return file_management_system
+
+    def close(self) -> None:
+        if not isinstance(self.buffer, bytes):
+            self.buffer.close()
@@ -0,0 +1,72 @@
+"""
+Load test for file_service: many pipelining clients against one localhost server.
+
+Usage: python load_test.py [--clients C] [--commands N] [--window W] [--port P | --unix PATH]
+Without --port or --unix, a FileService is started in this process on a free TCP port.
+Each client replays its own seeded workload trace (in its own name namespace, without
+rollbacks, which would undo the other clients' files) and the run reports requests/s and
+p50/p99 round-trip latency.
+"""
+import argparse
+import asyncio
+import functools
+import time
+
+import numpy
+
+from file_service import FileClient, FileService
+from workload import generate_trace
+
+async def run_client(client: FileClient, commands: list[list], window: int, latencies: list[float]) -> int:
+    # keeps up to window requests in flight; each latency runs from a send to its response
+    errors = 0
+    futures = []
+    in_flight = asyncio.Semaphore(window)
+
+    def done(_, sent: float) -> None:
+        latencies.append(time.perf_counter() - sent)
+        in_flight.release()
+
+    for command in commands:
+        await in_flight.acquire()
+        future = client.send(command)
+        future.add_done_callback(functools.partial(done, sent=time.perf_counter()))
+        futures.append(future)
+        await client.writer.drain()
+    for result in await asyncio.gather(*futures, return_exceptions=True):
+        errors += isinstance(result, Exception)
+    return errors
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--commands", type=int, default=20000, help="per client")
+    parser.add_argument("--window", type=int, default=64, help="requests in flight per client")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--unix")
+    args = parser.parse_args()
+
+    service = None
+    if args.port is None and args.unix is None:
+        service = FileService()
+        server = await service.start_tcp(args.host, 0)
+        args.port = server.sockets[0].getsockname()[1]
+    traces = [generate_trace(args.commands, seed=client, rollback_rate=0, namespace=f"c{client}/") for client in range(args.clients)]
+    clients = [await (FileClient.connect_unix(args.unix) if args.unix else FileClient.connect_tcp(args.host, args.port)) for _ in range(args.clients)]
+
+    latencies = []
+    start = time.perf_counter()
+    errors = await asyncio.gather(*(run_client(client, trace, args.window, latencies) for client, trace in zip(clients, traces)))
+    elapsed = time.perf_counter() - start
+    for client in clients:
+        await client.close()
+    if service is not None:
+        await service.close()
+
+    requests = args.clients * args.commands
+    print(f"{requests} requests from {args.clients} clients in {elapsed:.2f}s: {requests / elapsed:.0f} requests/s, {sum(errors)} errors")
+    print(f"latency p50 {numpy.percentile(latencies, 50) * 1e3:.2f}ms p99 {numpy.percentile(latencies, 99) * 1e3:.2f}ms")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,175 +1,1352 @@
-import json
-import math
 import string
-import re
-import random
 import sys
-import traceback
 import functools
-from collections import OrderedDict
-from typing import List
+import importlib
+import heapq
+import bisect
+import itertools
+import time
+from array import array
+from collections import Counter, OrderedDict
+from typing import IO, TYPE_CHECKING, Iterable, Iterator
+from datetime import date, datetime, timedelta
 
-import numpy
-import sortedcontainers
-from datetime import datetime
+if TYPE_CHECKING:
+    # both import this module; the entry points only take them as arguments
+    from file_cluster import FileCluster
+    from write_ahead_log import WriteAheadLog
 
-def is_alive(upload_timestamp: str, get_timestamp: str, ttl: int) -> bool:
-    return (datetime.strptime(get_timestamp, "%Y-%m-%dT%H:%M:%S") - datetime.strptime(upload_timestamp, "%Y-%m-%dT%H:%M:%S")).total_seconds() < ttl
+SEARCH_LIMIT = 10
+# searches matching at least this many names go through the NumPy path, when the backend allows it
+VECTOR_SEARCH_MIN = 64
+# FileManagementSystem backends. "python" needs nothing outside the standard library; "auto" starts
+# out the same and takes on NumPy for wide searches and sortedcontainers for big indexes when they
+# are installed; "sortedcontainers" and "numpy" import theirs up front ("numpy" implies both)
+BACKENDS = ("auto", "python", "sortedcontainers", "numpy")
+# files held at which "auto" moves its sorted indexes from PlainSortedList to sortedcontainers
+SORTED_BACKEND_MIN = 50_000
+# prefixes whose live top 10 is kept between searches
+SEARCH_CACHE_SIZE = 1024
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+EPOCH = datetime(1970, 1, 1)
+EPOCH_ORDINAL = EPOCH.toordinal()
+# sentinels for the int64 time columns: uploaded without a timestamp / never expires
+NO_TIME = -(1 << 63)
+NEVER = (1 << 63) - 1
+# ByteTimeline covers the epoch seconds below 2 ** TIMELINE_BITS (past the year 2500); earlier
+# times, and files uploaded without a timestamp, count from its start
+TIMELINE_BITS = 34
+SIZE_UNITS = {"b": 1, "kb": 1000, "mb": 1000 ** 2, "gb": 1000 ** 3}
+
+@functools.lru_cache(maxsize=4096)
+def parse_timestamp(timestamp: str) -> int:
+    # timestamps always use TIMESTAMP_FORMAT, so slice the fields instead of going through strptime
+    days = date(int(timestamp[0:4]), int(timestamp[5:7]), int(timestamp[8:10])).toordinal() - EPOCH_ORDINAL
+    return days * 86400 + int(timestamp[11:13]) * 3600 + int(timestamp[14:16]) * 60 + int(timestamp[17:19])
+
+def to_epoch(timestamp: str | int) -> int:
+    return timestamp if isinstance(timestamp, int) else parse_timestamp(timestamp)
+
+def format_timestamp(timestamp: str | int) -> str:
+    return timestamp if isinstance(timestamp, str) else (EPOCH + timedelta(seconds=timestamp)).strftime(TIMESTAMP_FORMAT)
+
+def parse_size(size: str) -> int:
+    # "200kb" -> 200000
+    amount = size.rstrip(string.ascii_letters)
+    return int(amount) * SIZE_UNITS[size[len(amount):].lower()]
+
+def to_bytes(size: str | int) -> int:
+    return size if isinstance(size, int) else parse_size(size)
+
+def prefix_end(prefix: str) -> str | None:
+    # smallest string above every string that starts with prefix, None when there is none
+    stripped = prefix.rstrip("\U0010ffff")
+    if not stripped:
+        return None
+    return stripped[:-1] + chr(ord(stripped[-1]) + 1)
+
+def is_alive(expires_at: int, moment: int) -> bool:
+    return moment < expires_at
 
 class Folder():
-    def __init__(self, folder_name: str, parent: None, children: None = None, folder_path: str | None = None):
+    """
+    Node of the server's path trie. File names are slash-delimited paths ("dir-a/dir-c/file-2.txt");
+    each folder keeps the bytes and number of files below it, updated along the path on every change.
+    """
+    def __init__(self, folder_name: str, parent: "Folder | None", children: "dict[str, Folder] | None" = None, folder_path: str | None = None):
         self.parent: Folder | None = parent
-        self.children: List[Folder | File] | None = children
+        self.children: dict[str, Folder] = children if children is not None else {}
         self.folder_name: str = folder_name
-        self.folder_path: str = folder_path
+        self.folder_path: str = folder_path if folder_path is not None else folder_name
+        # base name -> row of the files directly in this folder
+        self.files: dict[str, int] = {}
+        self.total_size: int = 0
+        self.file_count: int = 0
+
+class ContentTable():
+    """
+    Immutable file contents, shared by every name that was copied from the same upload. A record
+    is its size in bytes and the number of FileTable rows referencing it; it is freed (and its
+    slot reused) when the last of them is released.
+    """
+    def __init__(self):
+        self.sizes: array = array("q")
+        self.refs: array = array("q")
+        self.free: list[int] = []
+        # bytes of every record still referenced, i.e. what is actually stored
+        self.physical_bytes: int = 0
+
+    def __len__(self) -> int:
+        return len(self.sizes) - len(self.free)
+
+    def insert(self, size: int) -> int:
+        self.physical_bytes += size
+        if self.free:
+            content = self.free.pop()
+            self.sizes[content] = size
+            self.refs[content] = 1
+            return content
+        self.sizes.append(size)
+        self.refs.append(1)
+        return len(self.sizes) - 1
+
+    def share(self, content: int) -> None:
+        self.refs[content] += 1
+
+    def release(self, content: int) -> None:
+        self.refs[content] -= 1
+        if not self.refs[content]:
+            self.physical_bytes -= self.sizes[content]
+            self.free.append(content)
+
+class FileTable():
+    """
+    Struct-of-arrays storage for file metadata. A file is a row: its name in a list, and its size
+    in bytes, upload time, expiry time (epoch seconds) and content record in parallel int64 columns.
+    Copies point at the source's content record instead of getting their own; the size column
+    repeats the content's size so searches read a single column. A copy still takes a row of its
+    own (five 8-byte slots, and a version under history): its name, upload time and expiry are
+    its own, and as-of reads find it by name like any other file. Released rows go on a free list
+    and are reused by the next insert.
+    """
+    def __init__(self):
+        self.names: list[str | None] = []
+        self.sizes: array = array("q")
+        self.uploaded: array = array("q")
+        self.expires: array = array("q")
+        self.content: array = array("q")
+        self.contents: ContentTable = ContentTable()
+        self.free: list[int] = []
+        # bytes of every row still held, counting each copy in full
+        self.logical_bytes: int = 0
+
+    def __len__(self) -> int:
+        return len(self.names) - len(self.free)
+
+    def insert(self, file_name: str, size: int, uploaded_at: int = NO_TIME, expires_at: int = NEVER, content: int | None = None) -> int:
+        # a new upload gets a new content record, a copy passes the one it shares
+        if content is None:
+            content = self.contents.insert(size)
+        else:
+            self.contents.share(content)
+            size = self.contents.sizes[content]
+        self.logical_bytes += size
+        if self.free:
+            row = self.free.pop()
+            self.names[row] = file_name
+            self.sizes[row] = size
+            self.uploaded[row] = uploaded_at
+            self.expires[row] = expires_at
+            self.content[row] = content
+            return row
+        self.names.append(file_name)
+        self.sizes.append(size)
+        self.uploaded.append(uploaded_at)
+        self.expires.append(expires_at)
+        self.content.append(content)
+        return len(self.names) - 1
+
+    def release(self, row: int) -> None:
+        self.logical_bytes -= self.sizes[row]
+        self.contents.release(self.content[row])
+        self.names[row] = None
+        self.free.append(row)
+
+class ByteTimeline():
+    """
+    Fenwick tree of byte deltas over time, stored sparsely in a dict: a file adds its size at its
+    upload time and takes it back at its expiry, so the bytes alive at a moment are the sum of the
+    deltas up to it. Adding a file and summing up to a moment each touch at most TIMELINE_BITS nodes.
+    """
+    def __init__(self):
+        self.tree: dict[int, int] = {}
+
+    def add(self, moment: int, delta: int) -> None:
+        tree, end = self.tree, 1 << TIMELINE_BITS
+        position = min(max(moment, 0), end - 1) + 1
+        while position <= end:
+            tree[position] = tree.get(position, 0) + delta
+            position += position & -position
+
+    def add_file(self, uploaded_at: int, expires_at: int, size: int) -> None:
+        # a negative size takes the file out again
+        self.add(uploaded_at, size)
+        if expires_at != NEVER:
+            self.add(expires_at, -size)
+
+    def move_end(self, old_end: int, new_end: int, size: int) -> None:
+        # a file held until new_end instead of old_end
+        if old_end != NEVER:
+            self.add(old_end, size)
+        if new_end != NEVER:
+            self.add(new_end, -size)
+
+    def total(self, moment: int) -> int:
+        tree, total = self.tree, 0
+        position = min(max(moment, 0), (1 << TIMELINE_BITS) - 1) + 1
+        while position:
+            total += tree.get(position, 0)
+            position &= position - 1
+        return total
+
+class PlainSortedList():
+    """
+    Sorted list kept in one Python list with bisect: the part of sortedcontainers.SortedList the
+    indexes use, without the import. Adding and removing shift the list, which stays cheap up to
+    SORTED_BACKEND_MIN items; the "auto" backend swaps in sortedcontainers past that.
+    """
+    def __init__(self, iterable: Iterable = ()):
+        self.items: list = sorted(iterable)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __iter__(self) -> Iterator:
+        return iter(self.items)
+
+    def __getitem__(self, index: int):
+        return self.items[index]
+
+    def add(self, value) -> None:
+        bisect.insort_right(self.items, value)
+
+    def update(self, iterable: Iterable) -> None:
+        self.items.extend(iterable)
+        self.items.sort()
+
+    def remove(self, value) -> None:
+        index = bisect.bisect_left(self.items, value)
+        if index == len(self.items) or self.items[index] != value:
+            raise ValueError(f"{value!r} not in list")
+        del self.items[index]
+
+    def bisect_left(self, value) -> int:
+        return bisect.bisect_left(self.items, value)
+
+    def bisect_right(self, value) -> int:
+        return bisect.bisect_right(self.items, value)
+
+    def irange(self, minimum=None, maximum=None) -> Iterator:
+        # values from minimum to maximum, both inclusive, read lazily like SortedList.irange
+        start = 0 if minimum is None else bisect.bisect_left(self.items, minimum)
+        stop = len(self.items) if maximum is None else bisect.bisect_right(self.items, maximum)
+        return map(self.items.__getitem__, range(start, stop))
+
+    def islice(self, start: int | None = None, stop: int | None = None) -> Iterator:
+        return iter(self.items[start:stop])
+
+def _import_backend(module_name: str, backend: str):
+    try:
+        return importlib.import_module(module_name)
+    except ImportError:
+        raise RuntimeError(f"backend {backend} needs {module_name}, which is not installed") from None
 
 class File():
-    def __init__(self, file_name: str, size: str, folder: Folder | None = None, timestamp: str = None, ttl: int = None):
-        self.folder: Folder | None = folder
-        self.file_name: str = file_name
-        self.size_str: str = size
-        self.size: int = int(size[:-2])
-        self.size_unit: str = size[-2:]
-        self.timestamp: str = timestamp
-        self.ttl: int = ttl if ttl is not None else numpy.inf
+    """
+    Read-only view of one FileTable row.
+    """
+    __slots__ = ("table", "row")
+
+    def __init__(self, table: FileTable, row: int):
+        self.table: FileTable = table
+        self.row: int = row
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, File) and self.table is other.table and self.row == other.row
+
+    def __hash__(self) -> int:
+        return hash((id(self.table), self.row))
+
+    @property
+    def file_name(self) -> str:
+        return self.table.names[self.row]
+
+    @property
+    def size(self) -> int:
+        return self.table.sizes[self.row]
+
+    @property
+    def uploaded_at(self) -> int | None:
+        uploaded_at = self.table.uploaded[self.row]
+        return uploaded_at if uploaded_at != NO_TIME else None
+
+    @property
+    def expires_at(self) -> int | None:
+        expires_at = self.table.expires[self.row]
+        return expires_at if expires_at != NEVER else None
+
+    @property
+    def ttl(self) -> int | None:
+        expires_at = self.expires_at
+        return expires_at - self.uploaded_at if expires_at is not None else None
+
 class Server(): 
-    def __init__(self, files: List[Folder | File] | None = None):
-        self.files: List[Folder | File] = files if files is not None else []
+    def __init__(self, capacity: int | None = None, name: str = "server"):
+        self.name: str = name
+        # byte limit, None for unlimited; used bytes are root.total_size
+        self.capacity: int | None = capacity
+        self.table: FileTable = FileTable()
+        self.root: Folder = Folder("", None)
 
 class FileManagementSystem():
-    def __init__(self, server: Server):
+    def __init__(self, server: Server, retention: int | None = None, history: bool = False, stats: "Stats | None" = None, search_cache_size: int = SEARCH_CACHE_SIZE, backend: str = "auto"):
+        if backend not in BACKENDS:
+            raise RuntimeError(f"unknown backend {backend}")
         self.server: Server = server
-    
-    def file_upload(self, file_name: str, size: str) -> str:
-        for file in self.server.files:
-            if isinstance(file, File) and file.file_name == file_name:
-                raise RuntimeError(f"file {file_name} already exists")
-            if isinstance(file, Folder) and file.children:
-                for child in file.children:
-                    if child.file_name == file_name:
-                        raise RuntimeError(f"file {file_name} already exists")
-        self.server.files.append(File(file_name, size))
+        # one of BACKENDS. The sorted indexes below are sorted_list instances, which "auto" moves to
+        # sortedcontainers once SORTED_BACKEND_MIN files are held (upgrade_sorted until then);
+        # vectorized says whether wide searches use NumPy, None until "auto" has its first one
+        self.backend: str = backend
+        self.sorted_list: type = PlainSortedList
+        if backend in ("sortedcontainers", "numpy"):
+            self.sorted_list = _import_backend("sortedcontainers", backend).SortedList
+        self.upgrade_sorted: bool = backend == "auto"
+        self.vectorized: bool | None = None if backend == "auto" else backend == "numpy"
+        if backend == "numpy":
+            _import_backend("numpy", backend)
+        # opt-in engine counters; every update is behind an is-None check
+        self.stats: Stats | None = stats
+        self.table: FileTable = server.table
+        # name -> row index over every live file on the server
+        self.files: dict[str, int] = {}
+        # the same names kept sorted, so a prefix is one contiguous range
+        self.names: PlainSortedList = self.sorted_list()
+
+        # latest timestamp seen; every file in self.files is alive at it
+        self.clock: int | None = None
+        # (expires_at, row) for live files with a ttl
+        self.expiry_queue: list[tuple[int, int]] = []
+
+        # commands may arrive out of timestamp order, so files evicted by the clock are kept
+        # aside for reads behind it. None, the default, keeps them and everything ROLLBACK needs for as
+        # long as the system lives; with a retention they are dropped for good once that many seconds
+        # old, and reads or a ROLLBACK further behind the clock raise rather than answer from less
+        self.retention: int | None = retention
+        self.expired: dict[str, int] = {}
+        self.expired_names: PlainSortedList = self.sorted_list()
+        # (expires_at, row) of the same files, for retention and for bytes still alive behind the clock
+        self.expired_by_expiry: PlainSortedList = self.sorted_list()
+
+        # opt-in version history for as-of reads: every row ever added, per name, ordered by upload
+        # time. Versions are the same rows the live indexes use, so nothing is copied per version
+        self.history: bool = history
+        self.versions: dict[str, list[int]] = {}
+        self.version_names: PlainSortedList = self.sorted_list()
+
+        # built by the first FILE_EXPIRING_BETWEEN / USAGE_AT, then kept up to date over the files
+        # held (live and expired): (expires_at, row) of the ones with a ttl, and their bytes over time
+        self.expiring: PlainSortedList | None = None
+        self.timeline: ByteTimeline | None = None
+
+        # (uploaded_at, name) of every timed write, in time order, so ROLLBACK visits only the names
+        # it has to undo; row -> the row it replaced, kept allocated for ROLLBACK to put back. With a
+        # retention, the entries before undo_start are behind it and no longer count
+        self.undo_log: list[tuple[int, str]] = []
+        self.undo_start: int = 0
+        self.replaced: dict[int, int] = {}
+
+        # names whose live or expired file changed, collected while a ConcurrentFileSystem publishes
+        # this system's state; None when nothing is collecting them
+        self.changed: set[str] | None = None
+
+        # LRU of prefix -> (live top 10, size of the 10th or None when fewer matched). An entry is
+        # dropped only when a live file under its prefix leaves the top 10 or could enter it
+        self.search_cache_size: int = search_cache_size
+        self.search_cache: OrderedDict[str, tuple[list[str], int | None]] = OrderedDict()
+        self.search_cache_hits: int = 0
+        self.search_cache_misses: int = 0
+
+    def _add_version(self, row: int) -> None:
+        file_name = self.table.names[row]
+        versions = self.versions.get(file_name)
+        if versions is None:
+            self.versions[file_name] = [row]
+            self.version_names.add(file_name)
+        else:
+            bisect.insort_right(versions, row, key=self.table.uploaded.__getitem__)
+
+    def _version_at(self, file_name: str, moment: int) -> int | None:
+        # the newest version uploaded by moment; an older one was already dead when it was replaced
+        versions = self.versions.get(file_name)
+        if versions is None:
+            return None
+        idx = bisect.bisect_right(versions, moment, key=self.table.uploaded.__getitem__)
+        if self.stats is not None and idx:
+            self.stats.counters["is_alive_calls"] += 1
+        if idx == 0 or not is_alive(self.table.expires[versions[idx - 1]], moment):
+            return None
+        return versions[idx - 1]
+
+    def _held_until(self, row: int, replaced_at: int = NEVER) -> int:
+        # a file counts as held from its upload until it expires or, when a timed write replaced it,
+        # until that write; a file replaced by one uploaded before it never counted at all
+        table = self.table
+        return max(table.uploaded[row], min(table.expires[row], replaced_at))
+
+    def _drop(self, row: int, replaced_at: int = NEVER) -> None:
+        # rows stay allocated while the version history still points at them; what a row replaced goes with it
+        table = self.table
+        while row != -1:
+            if self.timeline is not None:
+                self.timeline.add_file(table.uploaded[row], self._held_until(row, replaced_at), -table.sizes[row])
+            replaced_at = table.uploaded[row]
+            replaced = self.replaced.pop(row, -1)
+            if not self.history:
+                table.release(row)
+            row = replaced
+
+    def _remove_version(self, row: int) -> None:
+        file_name = self.table.names[row]
+        versions = self.versions[file_name]
+        versions.remove(row)
+        if not versions:
+            del self.versions[file_name]
+            self.version_names.remove(file_name)
+
+    def _add_file(self, row: int) -> None:
+        # replaces the indexed file of the same name, a live one (copies overwrite) or an expired one
+        file_name = self.table.names[row]
+        replaced = self._unindex(file_name)
+        if self.history:
+            self._add_version(row)
+        table = self.table
+        uploaded = table.uploaded[row]
+        if uploaded != NO_TIME:
+            idx = bisect.bisect_right(self.undo_log, (uploaded, file_name))
+            self.undo_log.insert(idx, (uploaded, file_name))
+            if idx < self.undo_start:
+                # already behind the retention horizon, as a file moved in by a rebalance can be
+                self.undo_start += 1
+            if replaced != -1:
+                self.replaced[row] = replaced
+                if self.timeline is not None:
+                    # kept for ROLLBACK, the replaced file goes on counting up to this write
+                    self.timeline.move_end(table.expires[replaced], self._held_until(replaced, uploaded), table.sizes[replaced])
+        elif replaced != -1:
+            self._drop(replaced)
+        if self.timeline is not None:
+            self.timeline.add_file(uploaded, table.expires[row], table.sizes[row])
+        self._place(row)
+
+    def _place(self, row: int) -> None:
+        file_name = self.table.names[row]
+        if self.changed is not None:
+            self.changed.add(file_name)
+        self._track(row, 1)
+        if self.clock is not None and self.table.expires[row] <= self.clock:
+            self._index_expired(row)
+            return
+        self.files[file_name] = row
+        self.names.add(file_name)
+        if self.upgrade_sorted and len(self.files) + len(self.expired) >= SORTED_BACKEND_MIN:
+            self._use_sortedcontainers()
+        self._tree_add(row)
+        if self.table.expires[row] != NEVER:
+            heapq.heappush(self.expiry_queue, (self.table.expires[row], row))
+        if self.search_cache:
+            self._invalidate_searches(file_name, self.table.sizes[row])
+
+    def _use_sortedcontainers(self) -> None:
+        # "auto" past SORTED_BACKEND_MIN files: rebuild the sorted indexes as SortedLists, whose
+        # chunked inserts beat shifting one big list. Without sortedcontainers they stay as they are
+        self.upgrade_sorted = False
+        try:
+            import sortedcontainers
+        except ImportError:
+            return
+        self.sorted_list = sortedcontainers.SortedList
+        self.names = self.sorted_list(self.names)
+        self.expired_names = self.sorted_list(self.expired_names)
+        self.expired_by_expiry = self.sorted_list(self.expired_by_expiry)
+        self.version_names = self.sorted_list(self.version_names)
+        if self.expiring is not None:
+            self.expiring = self.sorted_list(self.expiring)
+
+    def _unindex(self, file_name: str) -> int:
+        # takes the file out of the live or the expired index, -1 when it is in neither
+        if self.changed is not None:
+            self.changed.add(file_name)
+        if file_name in self.files:
+            row = self._unindex_live(file_name)
+        elif file_name in self.expired:
+            row = self._unindex_expired(file_name)
+        else:
+            return -1
+        self._track(row, -1)
+        return row
+
+    def _track(self, row: int, sign: int) -> None:
+        # a row joins (1) or leaves (-1) the files held; the clock moving a file from the live index
+        # to the expired one changes neither. The byte timeline also counts the rows replaced by
+        # timed writes, so _add_file, _drop and rollback keep it instead
+        table = self.table
+        if self.expiring is not None and table.expires[row] != NEVER:
+            if sign > 0:
+                self.expiring.add((table.expires[row], row))
+            else:
+                self.expiring.remove((table.expires[row], row))
+
+    def _unindex_live(self, file_name: str) -> int:
+        # a removed row may linger in expiry_queue; _advance skips entries that no longer match
+        self.names.remove(file_name)
+        row = self.files.pop(file_name)
+        self._tree_remove(row)
+        if self.search_cache:
+            self._invalidate_searches(file_name)
+        return row
+
+    def _invalidate_searches(self, file_name: str, size: int | None = None) -> None:
+        # size is given for a file that became live, None for one that stopped being live
+        cache = self.search_cache
+        if len(cache) <= len(file_name):
+            prefixes = [prefix for prefix in cache if file_name.startswith(prefix)]
+        else:
+            prefixes = [file_name[:end] for end in range(len(file_name) + 1) if file_name[:end] in cache]
+        for prefix in prefixes:
+            file_names, tenth_size = cache[prefix]
+            if file_name in file_names if size is None else tenth_size is None or size >= tenth_size:
+                del cache[prefix]
+
+    def _tree_add(self, row: int) -> None:
+        *folder_names, base_name = self.table.names[row].split("/")
+        size = self.table.sizes[row]
+        folder = self.server.root
+        folder.total_size += size
+        folder.file_count += 1
+        for folder_name in folder_names:
+            child = folder.children.get(folder_name)
+            if child is None:
+                child = folder.children[folder_name] = Folder(folder_name, folder, folder_path=f"{folder.folder_path}/{folder_name}".lstrip("/"))
+            folder = child
+            folder.total_size += size
+            folder.file_count += 1
+        folder.files[base_name] = row
+
+    def _tree_remove(self, row: int) -> None:
+        *folder_names, base_name = self.table.names[row].split("/")
+        size = self.table.sizes[row]
+        folder = self.server.root
+        for folder_name in folder_names:
+            folder = folder.children[folder_name]
+        del folder.files[base_name]
+        while folder is not None:
+            folder.total_size -= size
+            folder.file_count -= 1
+            if folder.file_count == 0 and folder.parent is not None:
+                # nothing left below it, drop the folder
+                del folder.parent.children[folder.folder_name]
+            folder = folder.parent
+
+    def _folder(self, path: str) -> Folder | None:
+        folder = self.server.root
+        for folder_name in path.strip("/").split("/") if path.strip("/") else []:
+            folder = folder.children.get(folder_name)
+            if folder is None:
+                return None
+        return folder
+
+    def _index_expired(self, row: int) -> None:
+        file_name = self.table.names[row]
+        if self.changed is not None:
+            self.changed.add(file_name)
+        self.expired[file_name] = row
+        self.expired_names.add(file_name)
+        self.expired_by_expiry.add((self.table.expires[row], row))
+
+    def _unindex_expired(self, file_name: str) -> int:
+        self.expired_names.remove(file_name)
+        row = self.expired.pop(file_name)
+        self.expired_by_expiry.remove((self.table.expires[row], row))
+        return row
+
+    def _check_retained(self, moment: int) -> None:
+        # what a read or ROLLBACK further behind the clock than retention needs may already be gone
+        if self.retention is not None and self.clock is not None and moment < self.clock - self.retention:
+            raise RuntimeError(f"{format_timestamp(moment)} is more than {self.retention} seconds behind the clock")
+
+    def _advance(self, timestamp: str | int) -> int:
+        moment = to_epoch(timestamp)
+        self._check_retained(moment)
+        if self.clock is not None and moment <= self.clock:
+            return moment
+        self.clock = moment
+        names, expires = self.table.names, self.table.expires
+        while self.expiry_queue and self.expiry_queue[0][0] <= moment:
+            expires_at, row = heapq.heappop(self.expiry_queue)
+            if expires[row] == expires_at and self.files.get(names[row]) == row:
+                self._index_expired(self._unindex_live(names[row]))
+        if self.retention is not None:
+            horizon = moment - self.retention
+            while self.expired_by_expiry and self.expired_by_expiry[0][0] <= horizon:
+                self._drop(self._unindex(names[self.expired_by_expiry[0][1]]))
+            # ROLLBACK never goes behind the horizon, so of each name's writes before it only the
+            # newest can come back. What those replaced goes as soon as the horizon passes, so the
+            # state depends on the clock alone and not on how it got there, as WAL replay needs
+            idx = bisect.bisect_left(self.undo_log, horizon, lo=self.undo_start, key=lambda entry: entry[0])
+            for file_name in dict.fromkeys(file_name for _, file_name in self.undo_log[self.undo_start:idx]):
+                row = self.files.get(file_name, self.expired.get(file_name, -1))
+                while row != -1 and self.table.uploaded[row] >= horizon:
+                    row = self.replaced.get(row, -1)
+                if row != -1:
+                    self._drop(self.replaced.pop(row, -1), self.table.uploaded[row])
+            self.undo_start = idx
+            # the entries themselves are cut in one slice once they are half the log
+            if idx and idx * 2 >= len(self.undo_log):
+                del self.undo_log[:idx]
+                self.undo_start = 0
+        return moment
+
+    def _used_at(self, moment: int | None = None) -> int:
+        # bytes alive at moment, as USAGE_AT counts them. At the clock that is every live file, kept
+        # up to date by the folder tree; behind it the byte timeline answers
+        if moment is None or self.clock is None or moment >= self.clock:
+            return self.server.root.total_size
+        return self._usage_at(moment)
+
+    def _check_capacity(self, file_name: str, size: int, moment: int | None = None) -> None:
+        if self.server.capacity is not None and self._used_at(moment) + size > self.server.capacity:
+            raise RuntimeError(f"not enough space for {file_name}")
+
+    def _take(self, file_name: str) -> list[tuple[int, int, int]]:
+        # removes a live or expired file together with the files it replaced, kept for ROLLBACK, and
+        # returns their (size, uploaded_at, expires_at) columns, newest first
+        table, columns = self.table, []
+        row = walk = self._unindex(file_name)
+        while walk != -1:
+            columns.append((table.sizes[walk], table.uploaded[walk], table.expires[walk]))
+            walk = self.replaced.get(walk, -1)
+        self._drop(row)
+        return columns
+
+    def _put(self, file_name: str, columns: list[tuple[int, int, int]]) -> None:
+        # writes _take's files back oldest first, so each replaces the one before it and the undo
+        # log gets an entry for every timed one, as it had where they came from
+        for size, uploaded_at, expires_at in reversed(columns):
+            self._add_file(self.table.insert(file_name, size, uploaded_at, expires_at))
+
+    def _write(self, file_name: str, size: int, moment: int | None = None, content: int | None = None) -> None:
+        # adds file_name, overwriting the file of that name alive at moment (live, for untimed writes)
+        current = self.files.get(file_name) if moment is None else self._get_alive(file_name, moment)
+        # the overwritten file frees its bytes, if they count at moment (a live file may be newer)
+        freed = self.table.sizes[current] if current is not None and (moment is None or self.table.uploaded[current] <= moment) else 0
+        self._check_capacity(file_name, size - freed, moment)
+        self._add_file(self.table.insert(file_name, size, NO_TIME if moment is None else moment, content=content))
+
+    def _get_alive(self, file_name: str, moment: int) -> int | None:
+        # live files are alive at any moment up to the clock, only the expired ones need a check
+        row = self.files.get(file_name)
+        if row is not None:
+            return row
+        row = self.expired.get(file_name)
+        if row is None:
+            return None
+        if self.stats is not None:
+            self.stats.counters["is_alive_calls"] += 1
+        return row if is_alive(self.table.expires[row], moment) else None
+
+    def _alive_expired_rows(self, prefix: str, moment: int):
+        # expired files under prefix that were still alive at moment, in name order
+        expires = self.table.expires
+        checked = 0
+        for row in self._prefix_matches(prefix, self.expired_names, self.expired):
+            checked += 1
+            if is_alive(expires[row], moment):
+                yield row
+        if self.stats is not None:
+            self.stats.counters["is_alive_calls"] += checked
+
+    @staticmethod
+    def _prefix_names(prefix: str, names: "PlainSortedList"):
+        for file_name in names.irange(minimum=prefix):
+            if not file_name.startswith(prefix):
+                break
+            yield file_name
+
+    def _prefix_matches(self, prefix: str, names: "PlainSortedList | None" = None, files: dict[str, int] | None = None):
+        names = self.names if names is None else names
+        files = self.files if files is None else files
+        for file_name in self._prefix_names(prefix, names):
+            yield files[file_name]
+
+    def _top_files(self, rows) -> list[str]:
+        # rows arrive in name order and nsmallest is stable, so ties on size stay sorted by name
+        sizes, names = self.table.sizes, self.table.names
+        if self.stats is not None:
+            rows = list(rows)
+            self.stats.counters["matches_sorted"] += len(rows)
+        return [names[row] for row in heapq.nsmallest(SEARCH_LIMIT, rows, key=lambda row: -sizes[row])]
+
+    @staticmethod
+    def _prefix_range(prefix: str, names: "PlainSortedList") -> tuple[int, int]:
+        # positions [start, stop) of the names starting with prefix
+        end = prefix_end(prefix)
+        return names.bisect_left(prefix), len(names) if end is None else names.bisect_left(end)
+
+    def _use_vectorized(self, scanned: int) -> bool:
+        if scanned < VECTOR_SEARCH_MIN or self.vectorized is False:
+            return False
+        if self.vectorized is None:
+            # "auto" takes NumPy on at its first search this wide, if it is installed
+            try:
+                import numpy
+            except ImportError:
+                numpy = None
+            self.vectorized = numpy is not None
+        return self.vectorized
+
+    def _top_files_vectorized(self, row_ranges: list[tuple["PlainSortedList", dict[str, int], int, int]], moment: int | None = None) -> list[str]:
+        """
+        NumPy path of _top_files for wide prefixes: the rows of each name range are gathered into
+        one array, filtered by a single compare against the expiry column, and the top
+        SEARCH_LIMIT sizes are selected with argpartition instead of sorting every match.
+        """
+        import numpy
+
+        # views over the array columns; they must not outlive this call or the columns cannot grow
+        sizes = numpy.frombuffer(self.table.sizes, dtype=numpy.int64)
+        expires = numpy.frombuffer(self.table.expires, dtype=numpy.int64)
+        picked = []
+        for names, files, start, stop in row_ranges:
+            rows = numpy.fromiter(map(files.__getitem__, names.islice(start, stop)), dtype=numpy.int64, count=stop - start)
+            if self.stats is not None and moment is not None:
+                self.stats.counters["is_alive_calls"] += len(rows)
+            if moment is not None:
+                rows = rows[expires[rows] > moment]
+            if self.stats is not None:
+                self.stats.counters["matches_sorted"] += len(rows)
+            negated = -sizes[rows]
+            if len(rows) > SEARCH_LIMIT:
+                # everything strictly bigger than the 10th size, then ties in name order (rows are name-sorted)
+                kth = negated[numpy.argpartition(negated, SEARCH_LIMIT - 1)[:SEARCH_LIMIT]].max()
+                bigger = numpy.flatnonzero(negated < kth)
+                ties = numpy.flatnonzero(negated == kth)[:SEARCH_LIMIT - len(bigger)]
+                rows = rows[numpy.concatenate((bigger, ties))]
+            picked.extend(rows.tolist())
+        sizes, names = self.table.sizes, self.table.names
+        picked.sort(key=lambda row: (-sizes[row], names[row]))
+        return [names[row] for row in picked[:SEARCH_LIMIT]]
+
+    def file_upload(self, file_name: str, size: str | int) -> str:
+        if file_name in self.files:
+            raise RuntimeError(f"file {file_name} already exists")
+        size = to_bytes(size)
+        self._check_capacity(file_name, size)
+        self._add_file(self.table.insert(file_name, size))
         return f"uploaded {file_name}"
     
     def file_get(self, file_name: str) -> tuple[File, str] | None:
-        for file in self.server.files:
-            if isinstance(file, File) and file.file_name == file_name:
-                return file, f"got {file_name}"
-            if isinstance(file, Folder) and file.children:
-                for child in file.children:
-                    if child.file_name == file_name:
-                        return child, f"got {file_name}"
-        return None
+        row = self.files.get(file_name)
+        if row is None:
+            return None
+        return File(self.table, row), f"got {file_name}"
     
     def file_copy(self, source: str, dest: str) -> str:
-        # check if source and dest exsist
-        source_file_size = self.file_get(source)[0].size_str
-        if source_file_size is None:
+        # check that source exists
+        source_row = self.files.get(source)
+        if source_row is None:
             raise RuntimeError(f"file {source} not found")
-        dest_file_size = self.file_get(dest)
-        if dest_file_size is not None:
-            raise RuntimeError(f"file {dest} already exists")
-        self.file_upload(file_name=dest, size=source_file_size)
+        self._write(dest, self.table.sizes[source_row], content=self.table.content[source_row])
         return f"copied {source} to {dest}"
     
+    def search(self, prefix: str) -> list[str]:
+        cached = self.search_cache.get(prefix)
+        if cached is not None:
+            self.search_cache_hits += 1
+            if self.stats is not None:
+                self.stats.counters["search_cache_hits"] += 1
+            self.search_cache.move_to_end(prefix)
+            return list(cached[0])
+        self.search_cache_misses += 1
+        if self.stats is not None:
+            self.stats.counters["search_cache_misses"] += 1
+        start, stop = self._prefix_range(prefix, self.names)
+        if self.stats is not None:
+            self.stats.counters["files_scanned"] += stop - start
+        if self._use_vectorized(stop - start):
+            file_names = self._top_files_vectorized([(self.names, self.files, start, stop)])
+        else:
+            file_names = self._top_files(self._prefix_matches(prefix))
+        if self.search_cache_size:
+            tenth_size = self.table.sizes[self.files[file_names[-1]]] if len(file_names) == SEARCH_LIMIT else None
+            self.search_cache[prefix] = (list(file_names), tenth_size)
+            if len(self.search_cache) > self.search_cache_size:
+                self.search_cache.popitem(last=False)
+        return file_names
+
     def file_search(self, prefix: str) -> str:
-        found_files = []
-        for file in self.server.files:
-            if isinstance(file, File) and file.file_name.startswith(prefix):
-                found_files.append((file.file_name, file.size))
-        found_files.sort(key=lambda x: x[1], reverse=True)
-        file_names = [file[0] for file in found_files]
-        return f"found [{', '.join(file_names)}]"
+        return f"found [{', '.join(self.search(prefix))}]"
     
-    def file_upload_at(self, timestamp: str, file_name: str, size: str, ttl: int | None = None) -> str:
-        for file in self.server.files:
-            if isinstance(file, File) and file.file_name == file_name:
-                raise RuntimeError(f"file {file_name} already exists")
-            if isinstance(file, Folder) and file.children:
-                for child in file.children:
-                    if child.file_name == file_name:
-                        raise RuntimeError(f"file {file_name} already exists")
-        self.server.files.append(File(file_name, size, timestamp=timestamp, ttl=ttl))
+    def file_upload_at(self, timestamp: str | int, file_name: str, size: str | int, ttl: int | None = None) -> str:
+        moment = self._advance(timestamp)
+        if self._get_alive(file_name, moment) is not None:
+            raise RuntimeError(f"file {file_name} already exists")
+        expires_at = moment + int(ttl) if ttl is not None else NEVER
+        size = to_bytes(size)
+        self._check_capacity(file_name, size, moment)
+        self._add_file(self.table.insert(file_name, size, moment, expires_at))
         return f"uploaded at {file_name}"
 
-    def file_get_at(self, timestamp: str, file_name: str) -> tuple[File | None, str]:
-        for file in self.server.files:
-            if isinstance(file, File) and file.file_name == file_name:
-                if is_alive(file.timestamp, timestamp, file.ttl):
-                    return file, f"got at {file_name}"
-                else:
-                    return None, "file not found"
-            if isinstance(file, Folder) and file.children:
-                for child in file.children:
-                    if child.file_name == file_name:
-                        if is_alive(child.timestamp, timestamp, child.ttl):
-                            return child, f"got at {file_name}"
-                        else:
-                            return None, "file not found"
+    def file_get_at(self, timestamp: str | int, file_name: str) -> tuple[File | None, str]:
+        row = self._get_alive(file_name, self._advance(timestamp))
+        if row is not None:
+            return File(self.table, row), f"got at {file_name}"
         return None, "file not found"
 
-    def file_copy_at(self, timestamp: str, source: str, dest: str) -> str:
-        # check if source and dest exsist
-        source_file = self.file_get_at(timestamp, source)[0]
-        if source_file is None:
+    def file_copy_at(self, timestamp: str | int, source: str, dest: str) -> str:
+        moment = self._advance(timestamp)
+        # check that source exists
+        source_row = self._get_alive(source, moment)
+        if source_row is None:
             raise RuntimeError(f"file {source} not found")
-        dest_file = self.file_get_at(timestamp, dest)[0]
-        if dest_file is not None:
-            raise RuntimeError(f"file {dest} already exists")
-        self.file_upload_at(timestamp, dest, source_file.size_str)
+        self._write(dest, self.table.sizes[source_row], moment, content=self.table.content[source_row])
         return f"copied at {source} to {dest}"
     
-    def file_search_at(self, timestamp: str, prefix: str) -> str:
-        found_files = []
-        for file in self.server.files:
-            if isinstance(file, File) and file.file_name.startswith(prefix):
-                if is_alive(file.timestamp, timestamp, file.ttl):
-                    found_files.append((file.file_name, file.size))
-        found_files.sort(key=lambda x: x[1], reverse=True)
-        file_names = [file[0] for file in found_files]
+    def search_at(self, timestamp: str | int, prefix: str) -> list[str]:
+        moment = self._advance(timestamp)
+        if moment == self.clock:
+            # at the clock exactly the live files are alive, which is what search ranks
+            return self.search(prefix)
+        # behind the clock, expired files that were still alive at moment count too
+        row_ranges = [
+            (self.names, self.files, *self._prefix_range(prefix, self.names)),
+            (self.expired_names, self.expired, *self._prefix_range(prefix, self.expired_names)),
+        ]
+        scanned = sum(stop - start for _, _, start, stop in row_ranges)
+        if self.stats is not None:
+            self.stats.counters["files_scanned"] += scanned
+        if self._use_vectorized(scanned):
+            return self._top_files_vectorized(row_ranges, moment)
+        alive_rows = heapq.merge(self._prefix_matches(prefix), self._alive_expired_rows(prefix, moment), key=self.table.names.__getitem__)
+        return self._top_files(alive_rows)
+
+    def file_search_at(self, timestamp: str | int, prefix: str) -> str:
+        return f"found at [{', '.join(self.search_at(timestamp, prefix))}]"
+
+    def get_many_at(self, timestamp: str | int, file_names: Iterable[str]) -> list[str]:
+        """
+        FILE_GET_AT for many names at one timestamp: the timestamp is parsed and the clock
+        advanced once for the whole batch. Results come back in request order.
+        """
+        moment = self._advance(timestamp)
+        return [f"got at {file_name}" if self._get_alive(file_name, moment) is not None else "file not found" for file_name in file_names]
+
+    def search_many_at(self, timestamp: str | int, prefixes: Iterable[str]) -> list[str]:
+        """
+        FILE_SEARCH_AT for many prefixes at one timestamp. Prefixes nested in another one of the
+        batch ("Up" and "Update") share a single walk of the name index, liveness is checked once
+        per file, and each prefix then ranks its own slice of that walk. Results come back in
+        request order.
+        """
+        moment = self._advance(timestamp)
+        prefixes = list(prefixes)
+        found = {}
+        root = None
+        for prefix in sorted(set(prefixes)):
+            if root is None or not prefix.startswith(root):
+                # a new outermost prefix: collect its alive files once, in name order
+                root = prefix
+                rows = self._prefix_matches(root)
+                if moment < self.clock:
+                    rows = heapq.merge(rows, self._alive_expired_rows(root, moment), key=self.table.names.__getitem__)
+                root_rows = list(rows)
+                if self.stats is not None:
+                    self.stats.counters["files_scanned"] += len(root_rows)
+                root_names = [self.table.names[row] for row in root_rows]
+            end = prefix_end(prefix)
+            start, stop = bisect.bisect_left(root_names, prefix), len(root_names) if end is None else bisect.bisect_left(root_names, end)
+            found[prefix] = f"found at [{', '.join(self._top_files(root_rows[start:stop]))}]"
+        return [found[prefix] for prefix in prefixes]
+
+    def space_at(self, timestamp: str | int) -> str:
+        used = self._used_at(self._advance(timestamp))
+        if self.server.capacity is None:
+            return f"used {used} bytes, no limit"
+        return f"used {used} bytes, {self.server.capacity - used} bytes free"
+
+    def _expiring_rows(self, first: int, last: int) -> list[int]:
+        # files held whose ttl runs out after first and no later than last, by expiry time then name
+        table = self.table
+        if self.expiring is None:
+            rows = itertools.chain(self.files.values(), self.expired.values())
+            self.expiring = self.sorted_list((table.expires[row], row) for row in rows if table.expires[row] != NEVER)
+        rows = [row for _, row in self.expiring.irange(minimum=(first + 1, -1), maximum=(last, NEVER))]
+        rows.sort(key=lambda row: (table.expires[row], table.names[row]))
+        return rows
+
+    def file_expiring_between(self, start: str | int, end: str | int) -> str:
+        """
+        Names of the files held, live or expired and kept for reads behind the clock, whose ttl runs
+        out after start and no later than end, by expiry time then name. Does not move the clock.
+        """
+        return f"expiring [{', '.join(self.table.names[row] for row in self._expiring_rows(to_epoch(start), to_epoch(end)))}]"
+
+    def _usage_at(self, moment: int) -> int:
+        if self.timeline is None:
+            self.timeline = ByteTimeline()
+            table = self.table
+            for row in itertools.chain(self.files.values(), self.expired.values()):
+                replaced_at = NEVER
+                while row != -1:
+                    self.timeline.add_file(table.uploaded[row], self._held_until(row, replaced_at), table.sizes[row])
+                    replaced_at = table.uploaded[row]
+                    row = self.replaced.get(row, -1)
+        return self.timeline.total(moment)
+
+    def usage_at(self, timestamp: str | int) -> str:
+        """
+        Bytes of the files held that were alive at timestamp: uploaded by then (untimed uploads
+        always count) and not yet expired. A file a timed write replaced counts up to that write,
+        so later writes leave the past alone. Unlike SPACE_AT, it does not move the clock and
+        leaves out files uploaded after timestamp.
+        """
+        return f"used {self._usage_at(to_epoch(timestamp))} bytes at {format_timestamp(timestamp)}"
+
+    def storage(self) -> str:
+        """
+        Bytes held by the server: logical counts every file, copy and kept expired file or version
+        in full, physical counts each shared content record once.
+        """
+        return f"logical {self.table.logical_bytes} bytes, physical {self.table.contents.physical_bytes} bytes"
+
+    def dir_size(self, path: str) -> str:
+        folder = self._folder(path)
+        if folder is None:
+            return "dir not found"
+        return f"{folder.folder_path or '/'} has {folder.file_count} files, {folder.total_size} bytes"
+
+    def dir_list(self, path: str) -> str:
+        # subfolders first, marked with a trailing slash, then the files directly inside
+        folder = self._folder(path)
+        if folder is None:
+            return "dir not found"
+        entries = [f"{folder_name}/" for folder_name in sorted(folder.children)] + sorted(folder.files)
+        return f"listed [{', '.join(entries)}]"
+
+    def rollback(self, timestamp: str | int) -> str:
+        moment = to_epoch(timestamp)
+        self._check_retained(moment)
+        idx = bisect.bisect_right(self.undo_log, moment, lo=self.undo_start, key=lambda entry: entry[0])
+        undone = self.undo_log[idx:]
+        del self.undo_log[idx:]
+        if self.stats is not None:
+            self.stats.counters["rollback_entries_undone"] += len(undone)
+        table = self.table
+        for file_name in dict.fromkeys(file_name for _, file_name in undone):
+            # -1 when dropped by retention or moved away by a rebalance since
+            row = self._unindex(file_name)
+            # back along what each write replaced to the newest file written by moment, which comes
+            # back with its own size and expiry, as live or expired by the clock
+            replaced_at = NEVER
+            while row != -1 and table.uploaded[row] > moment:
+                if self.timeline is not None:
+                    self.timeline.add_file(table.uploaded[row], self._held_until(row, replaced_at), -table.sizes[row])
+                replaced_at = table.uploaded[row]
+                replaced = self.replaced.pop(row, -1)
+                if self.history:
+                    self._remove_version(row)
+                table.release(row)
+                row = replaced
+            if row != -1:
+                if self.timeline is not None and replaced_at != NEVER:
+                    self.timeline.move_end(self._held_until(row, replaced_at), table.expires[row], table.sizes[row])
+                self._place(row)
+        return f"rollback to {format_timestamp(timestamp)}"
+
+    def _export_state(self) -> dict:
+        # every held row once, plus which index each belongs to; rows are renumbered densely
+        table = self.table
+        held = [row for row, file_name in enumerate(table.names) if file_name is not None]
+        renumbered = {row: idx for idx, row in enumerate(held)}
+        return {
+            "clock": self.clock,
+            "rows": [[table.names[row], table.sizes[row], table.uploaded[row], table.expires[row], table.content[row]] for row in held],
+            "files": [renumbered[row] for row in self.files.values()],
+            "expired": [renumbered[row] for row in self.expired.values()],
+            "versions": [[renumbered[row] for row in versions] for versions in self.versions.values()],
+            "undo": self.undo_log[self.undo_start:],
+            "replaced": [[renumbered[row], renumbered[replaced]] for row, replaced in self.replaced.items()],
+        }
+
+    def _import_state(self, state: dict) -> None:
+        # loads _export_state output into an empty system; copies keep sharing one content record
+        contents, rows = {}, []
+        for file_name, size, uploaded_at, expires_at, content in state["rows"]:
+            row = self.table.insert(sys.intern(file_name), size, uploaded_at, expires_at, contents.get(content))
+            contents.setdefault(content, self.table.content[row])
+            rows.append(row)
+        self._index_state(state, rows)
+
+    def _index_state(self, state: dict, rows: list[int] | range) -> None:
+        # builds the indexes over rows already in the table; state refers to them by position in rows
+        self.clock = state["clock"]
+        names, expires = self.table.names, self.table.expires
+        live = [rows[idx] for idx in state["files"]]
+        self.files.update(zip(map(names.__getitem__, live), live))
+        self.names.update(self.files)
+        for row in live:
+            self._tree_add(row)
+        self.expiry_queue.extend((expires[row], row) for row in live if expires[row] != NEVER)
+        heapq.heapify(self.expiry_queue)
+        expired = [rows[idx] for idx in state["expired"]]
+        self.expired.update(zip(map(names.__getitem__, expired), expired))
+        self.expired_names.update(self.expired)
+        self.expired_by_expiry.update((expires[row], row) for row in expired)
+        for versions in state["versions"]:
+            self.versions[self.table.names[rows[versions[0]]]] = [rows[idx] for idx in versions]
+            self.version_names.add(self.table.names[rows[versions[0]]])
+        self.undo_log = [(uploaded_at, file_name) for uploaded_at, file_name in state["undo"]]
+        self.replaced = {rows[row]: rows[replaced] for row, replaced in state["replaced"]}
+        if self.upgrade_sorted and len(self.files) + len(self.expired) >= SORTED_BACKEND_MIN:
+            self._use_sortedcontainers()
+
+    def file_get_as_of(self, timestamp: str | int, file_name: str) -> tuple[File | None, str]:
+        """
+        Answers FILE_GET_AT against the state as it was at timestamp, i.e. ignoring every upload
+        made after it, without touching the current state. Needs history=True.
+        """
+        if not self.history:
+            raise RuntimeError("file history is disabled")
+        row = self._version_at(file_name, to_epoch(timestamp))
+        if row is not None:
+            return File(self.table, row), f"got at {file_name}"
+        return None, "file not found"
+
+    def file_search_as_of(self, timestamp: str | int, prefix: str) -> str:
+        """
+        Answers FILE_SEARCH_AT against the state as it was at timestamp. Needs history=True.
+        """
+        if not self.history:
+            raise RuntimeError("file history is disabled")
+        moment = to_epoch(timestamp)
+        found_rows = (self._version_at(file_name, moment) for file_name in self._prefix_names(prefix, self.version_names))
+        file_names = self._top_files(row for row in found_rows if row is not None)
         return f"found at [{', '.join(file_names)}]"
     
 
 
-def simulate_coding_framework(list_of_lists):
+def read_commands(source: str | IO[str]) -> Iterator[list]:
+    """
+    Lazily reads a command trace stored as JSON lines, one ["FILE_UPLOAD", ...] list per line.
+
+    Parameters:
+    source (str | IO[str]): Path to the trace, or an open text file.
+    """
+    if isinstance(source, str):
+        with open(source) as trace:
+            yield from read_commands(trace)
+        return
+    import json
+
+    for line in source:
+        if line.strip():
+            yield json.loads(line)
+
+# integer opcodes for compiled commands; OPCODES maps a command name to its opcode and the
+# function that turns the raw command into ready-to-call arguments (interned names, epoch
+# timestamps, byte sizes, int ttls), so the executor never looks at strings again
+(OP_FILE_UPLOAD, OP_FILE_GET, OP_FILE_COPY, OP_FILE_SEARCH, OP_FILE_UPLOAD_AT, OP_FILE_GET_AT,
+ OP_FILE_COPY_AT, OP_FILE_SEARCH_AT, OP_ROLLBACK, OP_FILE_GET_AS_OF, OP_FILE_SEARCH_AS_OF,
+ OP_FILE_GET_MANY_AT, OP_FILE_SEARCH_MANY_AT, OP_DIR_SIZE, OP_DIR_LIST, OP_SPACE_AT, OP_STORAGE,
+ OP_FILE_EXPIRING_BETWEEN, OP_USAGE_AT) = range(19)
+
+COMMAND_BATCH_SIZE = 4096
+
+def _ttl(action: list) -> int | None:
+    return int(action[4]) if len(action) > 4 and action[4] is not None else None
+
+OPCODES = {
+    "FILE_UPLOAD": (OP_FILE_UPLOAD, lambda action: (sys.intern(action[1]), parse_size(action[2]))),
+    "FILE_GET": (OP_FILE_GET, lambda action: (sys.intern(action[1]),)),
+    "FILE_COPY": (OP_FILE_COPY, lambda action: (sys.intern(action[1]), sys.intern(action[2]))),
+    "FILE_SEARCH": (OP_FILE_SEARCH, lambda action: (action[1],)),
+    "FILE_UPLOAD_AT": (OP_FILE_UPLOAD_AT, lambda action: (parse_timestamp(action[1]), sys.intern(action[2]), parse_size(action[3]), _ttl(action))),
+    "FILE_GET_AT": (OP_FILE_GET_AT, lambda action: (parse_timestamp(action[1]), sys.intern(action[2]))),
+    "FILE_COPY_AT": (OP_FILE_COPY_AT, lambda action: (parse_timestamp(action[1]), sys.intern(action[2]), sys.intern(action[3]))),
+    "FILE_SEARCH_AT": (OP_FILE_SEARCH_AT, lambda action: (parse_timestamp(action[1]), action[2])),
+    "ROLLBACK": (OP_ROLLBACK, lambda action: (parse_timestamp(action[1]),)),
+    "FILE_GET_AS_OF": (OP_FILE_GET_AS_OF, lambda action: (parse_timestamp(action[1]), sys.intern(action[2]))),
+    "FILE_SEARCH_AS_OF": (OP_FILE_SEARCH_AS_OF, lambda action: (parse_timestamp(action[1]), action[2])),
+    "FILE_GET_MANY_AT": (OP_FILE_GET_MANY_AT, lambda action: (parse_timestamp(action[1]), [sys.intern(file_name) for file_name in action[2:]])),
+    "FILE_SEARCH_MANY_AT": (OP_FILE_SEARCH_MANY_AT, lambda action: (parse_timestamp(action[1]), action[2:])),
+    "DIR_SIZE": (OP_DIR_SIZE, lambda action: (action[1],)),
+    "DIR_LIST": (OP_DIR_LIST, lambda action: (action[1],)),
+    "SPACE_AT": (OP_SPACE_AT, lambda action: (parse_timestamp(action[1]),)),
+    "STORAGE": (OP_STORAGE, lambda action: ()),
+    "FILE_EXPIRING_BETWEEN": (OP_FILE_EXPIRING_BETWEEN, lambda action: (parse_timestamp(action[1]), parse_timestamp(action[2]))),
+    "USAGE_AT": (OP_USAGE_AT, lambda action: (parse_timestamp(action[1]),)),
+}
+
+OPCODE_NAMES = {opcode: command for command, (opcode, _) in OPCODES.items()}
+# latency histogram buckets: bucket i counts calls under 2 ** i microseconds, the last one the rest
+LATENCY_BUCKETS = 24
+
+class Stats():
+    """
+    Opt-in instrumentation: per-opcode call counts, total time and latency histograms recorded by
+    the dispatcher, and engine counters (files_scanned, is_alive_calls, matches_sorted,
+    rollback_entries_undone, search_cache_hits/misses) bumped by a FileManagementSystem given
+    this object, and late_commands by reorder_commands. Nothing is timed or counted unless a Stats is passed in.
+    """
+    def __init__(self):
+        self.calls: list[int] = [0] * len(OPCODES)
+        self.nanoseconds: list[int] = [0] * len(OPCODES)
+        self.histograms: list[list[int]] = [[0] * LATENCY_BUCKETS for _ in OPCODES]
+        self.counters: Counter = Counter()
+
+    def instrument(self, handlers: list) -> list:
+        # handlers indexed by opcode, each wrapped to time its calls
+        return [self._timed(opcode, handler) for opcode, handler in enumerate(handlers)]
+
+    def _timed(self, opcode: int, handler):
+        histogram = self.histograms[opcode]
+
+        def timed(*args):
+            start = time.perf_counter_ns()
+            try:
+                return handler(*args)
+            finally:
+                elapsed = time.perf_counter_ns() - start
+                self.calls[opcode] += 1
+                self.nanoseconds[opcode] += elapsed
+                histogram[min((elapsed // 1000).bit_length(), LATENCY_BUCKETS - 1)] += 1
+        return timed
+
+    def as_dict(self) -> dict:
+        bounds = [f"<{2 ** bucket}us" for bucket in range(LATENCY_BUCKETS - 1)] + ["more"]
+        return {
+            "commands": {
+                OPCODE_NAMES[opcode]: {
+                    "calls": calls,
+                    "seconds": self.nanoseconds[opcode] / 1e9,
+                    "latency": {bound: count for bound, count in zip(bounds, self.histograms[opcode]) if count},
+                }
+                for opcode, calls in enumerate(self.calls) if calls
+            },
+            "counters": dict(sorted(self.counters.items())),
+        }
+
+    def to_json(self) -> str:
+        import json
+
+        return json.dumps(self.as_dict(), indent=2)
+
+def compile_commands(commands: Iterable[list]) -> list[tuple[int, tuple]]:
+    """
+    Compiles a batch of commands into (opcode, args) pairs. Unknown commands are dropped, as the
+    simulator has always ignored them.
+
+    Parameters:
+    commands (Iterable[List[str]]): Commands, e.g. a list of lists.
+    """
+    program = []
+    for action in commands:
+        compiled = OPCODES.get(action[0])
+        if compiled is not None:
+            program.append((compiled[0], compiled[1](action)))
+    return program
+
+def _compile_stream(commands: Iterable[list]) -> Iterator[tuple[int, tuple]]:
+    commands = iter(commands)
+    while batch := list(itertools.islice(commands, COMMAND_BATCH_SIZE)):
+        yield from compile_commands(batch)
+
+# commands whose first argument is the moment they happen at; reorder_commands moves only these
+REORDERED_OPCODES = frozenset({OP_FILE_UPLOAD_AT, OP_FILE_GET_AT, OP_FILE_COPY_AT, OP_FILE_SEARCH_AT, OP_FILE_GET_MANY_AT, OP_FILE_SEARCH_MANY_AT, OP_SPACE_AT})
+
+def reorder_commands(program: Iterable[tuple[int, tuple]], lateness: int, stats: Stats | None = None) -> Iterator[tuple[int, int, tuple]]:
+    """
+    Ingest stage that hands compiled commands to the engine in timestamp order. Yields (position,
+    opcode, args) for every command, position being its index in program, so results can be put
+    back in arrival order.
+
+    Timed commands (REORDERED_OPCODES) wait in a heap until the watermark, the newest timestamp
+    seen minus lateness seconds, passes them, and leave it in timestamp order (arrival order for
+    ties). Every other command (ROLLBACK, untimed, as-of and directory commands) is a barrier:
+    whatever is buffered goes first, then the command itself. A timed command older than one
+    already released is late; it goes straight through, and the engine answers it on its general
+    path for moments behind the clock, which is slower but still correct as long as the engine
+    keeps what it needs. One with a retention does not: a late command further than that behind
+    the clock raises RuntimeError instead.
+
+    Parameters:
+    program (Iterable[tuple[int, tuple]]): (opcode, args) pairs, as compile_commands returns them.
+    lateness (int): Seconds a command may arrive after newer ones and still be put in order.
+    stats (Stats | None): Count late commands into stats.counters["late_commands"].
+    """
+    buffered = []
+    # newest timestamp seen and the last one released, since the last barrier
+    newest = released = None
+    for position, (opcode, args) in enumerate(program):
+        if opcode not in REORDERED_OPCODES:
+            while buffered:
+                _, buffered_position, buffered_opcode, buffered_args = heapq.heappop(buffered)
+                yield buffered_position, buffered_opcode, buffered_args
+            newest = released = None
+            yield position, opcode, args
+            continue
+        moment = args[0]
+        if released is not None and moment < released:
+            if stats is not None:
+                stats.counters["late_commands"] += 1
+            yield position, opcode, args
+            continue
+        heapq.heappush(buffered, (moment, position, opcode, args))
+        newest = moment if newest is None else max(newest, moment)
+        while buffered and buffered[0][0] <= newest - lateness:
+            released, buffered_position, buffered_opcode, buffered_args = heapq.heappop(buffered)
+            yield buffered_position, buffered_opcode, buffered_args
+    while buffered:
+        _, buffered_position, buffered_opcode, buffered_args = heapq.heappop(buffered)
+        yield buffered_position, buffered_opcode, buffered_args
+
+def command_handlers(file_management_system: FileManagementSystem) -> list:
+    # indexed by opcode; each handler takes the compiled args and returns the command's output
+    return [
+        file_management_system.file_upload,
+        # FILE_GET returns nothing for a missing file
+        lambda file_name: (file_management_system.file_get(file_name) or (None, None))[1],
+        file_management_system.file_copy,
+        file_management_system.file_search,
+        file_management_system.file_upload_at,
+        lambda timestamp, file_name: file_management_system.file_get_at(timestamp, file_name)[1],
+        file_management_system.file_copy_at,
+        file_management_system.file_search_at,
+        file_management_system.rollback,
+        lambda timestamp, file_name: file_management_system.file_get_as_of(timestamp, file_name)[1],
+        file_management_system.file_search_as_of,
+        file_management_system.get_many_at,
+        file_management_system.search_many_at,
+        file_management_system.dir_size,
+        file_management_system.dir_list,
+        file_management_system.space_at,
+        file_management_system.storage,
+        file_management_system.file_expiring_between,
+        file_management_system.usage_at,
+    ]
+
+# commands that change state; only these go to the write-ahead log
+MUTATING_OPCODES = frozenset({OP_FILE_UPLOAD, OP_FILE_COPY, OP_FILE_UPLOAD_AT, OP_FILE_COPY_AT, OP_ROLLBACK})
+
+def _run_reordered(steps: Iterator[tuple[int, int, tuple]], handlers: list, wal: "WriteAheadLog | None") -> Iterator[str]:
+    # runs commands in the order steps releases them and yields the results in arrival order
+    results, ready, next_position = {}, [], 0
+    for position, opcode, args in steps:
+        results[position] = wal.execute(handlers[opcode], opcode, args) if wal is not None and opcode in MUTATING_OPCODES else handlers[opcode](*args)
+        while next_position in results:
+            ready.append(results.pop(next_position))
+            next_position += 1
+        if ready and (wal is None or len(ready) >= COMMAND_BATCH_SIZE):
+            if wal is not None:
+                wal.commit()
+            yield from ready
+            ready = []
+    if wal is not None:
+        wal.commit()
+    yield from ready
+
+def stream_coding_framework(commands: Iterable[list], history: bool = False, capacity: int | None = None, file_management_system: "FileManagementSystem | FileCluster | None" = None, wal: "WriteAheadLog | None" = None, stats: Stats | None = None, lateness: int | None = None, retention: int | None = None) -> Iterator[str]:
+    """
+    Runs commands and yields each result as soon as it is produced. Commands are compiled
+    COMMAND_BATCH_SIZE at a time, so memory does not grow with the length of the trace.
+
+    Parameters:
+    commands (Iterable[List[str]]): Commands, e.g. a list of lists or read_commands(path).
+    history (bool): Keep file versions so FILE_GET_AS_OF / FILE_SEARCH_AS_OF can be answered.
+    capacity (int | None): Server byte limit; uploads and copies that would exceed it raise.
+    file_management_system (FileManagementSystem | FileCluster | None): Run against this system
+        instead of a fresh single server; history, capacity and retention are then ignored.
+    wal (WriteAheadLog | None): Recover the system (a FileManagementSystem) from this log first,
+        then log every mutating command; a batch's results are yielded once they are committed.
+    stats (Stats | None): Time every command and count engine work into this object.
+    lateness (int | None): Put timed commands through reorder_commands with this lateness bound,
+        so the engine sees them in timestamp order; results still come in command order, each
+        once every command before it has run.
+    retention (int | None): Opt-in bound on how long expired files and the undo log are kept;
+        commands further than that behind the clock raise. Raised to lateness when that is longer,
+        since a command can still arrive that late after a barrier. None keeps everything.
+    """
+
+    if file_management_system is None:
+        # create server
+        server = Server(capacity)
+
+        # create file management system
+        if retention is not None and lateness is not None:
+            retention = max(retention, lateness)
+        file_management_system = FileManagementSystem(server, retention=retention, history=history, stats=stats)
+
+    handlers = command_handlers(file_management_system)
+    if stats is not None:
+        handlers = stats.instrument(handlers)
+    commands = iter(commands)
+    if lateness is not None:
+        if wal is not None:
+            wal.recover(file_management_system)
+        try:
+            yield from _run_reordered(reorder_commands(_compile_stream(commands), lateness, stats), handlers, wal)
+        finally:
+            if wal is not None:
+                wal.close()
+        return
+    if wal is None:
+        while batch := list(itertools.islice(commands, COMMAND_BATCH_SIZE)):
+            for opcode, args in compile_commands(batch):
+                yield handlers[opcode](*args)
+        return
+
+    wal.recover(file_management_system)
+    try:
+        while batch := list(itertools.islice(commands, COMMAND_BATCH_SIZE)):
+            results = [wal.execute(handlers[opcode], opcode, args) if opcode in MUTATING_OPCODES else handlers[opcode](*args) for opcode, args in compile_commands(batch)]
+            wal.commit()
+            yield from results
+    finally:
+        wal.close()
+
+
+def simulate_coding_framework(list_of_lists, history: bool = False, capacity: int | None = None, file_management_system: "FileManagementSystem | FileCluster | None" = None, stats: Stats | None = None, lateness: int | None = None, retention: int | None = None):
     """
     Simulates a coding framework operation on a list of lists of strings.
 
     Parameters:
     list_of_lists (List[List[str]]): A list of lists containing strings.
+    history (bool): Keep file versions so FILE_GET_AS_OF / FILE_SEARCH_AS_OF can be answered.
+    capacity (int | None): Server byte limit; uploads and copies that would exceed it raise.
+    file_management_system (FileManagementSystem | FileCluster | None): Run against this system instead of a fresh one.
+    stats (Stats | None): Time every command and count engine work into this object.
+    lateness (int | None): Hand timed commands to the engine in timestamp order, see reorder_commands.
+    retention (int | None): Seconds expired files are kept for reads behind the clock, at least lateness; None keeps them.
     """
-
-    # create server
-    server = Server()
-
-    # create file management system
-    file_management_system = FileManagementSystem(server)
-
-    output = []
-    for action in list_of_lists:
-        if action[0] == "FILE_UPLOAD":
-            output.append(file_management_system.file_upload(file_name=action[1], size=action[2]))
-        elif action[0] == "FILE_GET":
-            output.append(file_management_system.file_get(file_name=action[1])[1])
-        elif action[0] == "FILE_COPY":
-            output.append(file_management_system.file_copy(source=action[1], dest=action[2]))
-        elif action[0] == "FILE_SEARCH":
-            output.append(file_management_system.file_search(prefix=action[1]))
-        elif action[0] == "FILE_UPLOAD_AT":
-            if len(action) == 4:
-                output.append(file_management_system.file_upload_at(timestamp=action[1], file_name=action[2], size=action[3]))
-            else:
-                output.append(file_management_system.file_upload_at(timestamp=action[1], file_name=action[2], size=action[3], ttl=action[4]))
-        elif action[0] == "FILE_GET_AT":
-            output.append(file_management_system.file_get_at(timestamp=action[1], file_name=action[2])[1])
-        elif action[0] == "FILE_COPY_AT":
-            output.append(file_management_system.file_copy_at(timestamp=action[1], source=action[2], dest=action[3]))
-        elif action[0] == "FILE_SEARCH_AT":
-            output.append(file_management_system.file_search_at(timestamp=action[1], prefix=action[2]))
-    return output
+    return list(stream_coding_framework(list_of_lists, history=history, capacity=capacity, file_management_system=file_management_system, stats=stats, lateness=lateness, retention=retention))
     
 
-if __name__ == "__main__":
+if __name__ == "__main__" and len(sys.argv) > 1:
+    # replay a JSON lines trace: python simulation.py trace.jsonl
+    import json
+
+    for result in stream_coding_framework(read_commands(sys.argv[1])):
+        print(json.dumps(result))
+elif __name__ == "__main__":
     test_data_1 = [["FILE_UPLOAD", "Cars.txt", "200kb"], 
                               ["FILE_GET", "Cars.txt"], 
                               ["FILE_COPY", "Cars.txt", "Cars2.txt"], 
@@ -199,4 +1376,20 @@ if __name__ == "__main__":
         ]
     test_output_3 = ["uploaded at Python.txt", "uploaded at CodeSignal.txt", "got at Python.txt", "copied at Python.txt to PythonCopy.txt", "found at [Python.txt, PythonCopy.txt]", "uploaded at Expired.txt", "file not found", "copied at CodeSignal.txt to CodeSignalCopy.txt", "found at [CodeSignal.txt, CodeSignalCopy.txt]"]
     test_pass_3 = simulate_coding_framework(test_data_3) == test_output_3
-    print(f"Test 3 passed: {test_pass_3}")
\ No newline at end of file
+    print(f"Test 3 passed: {test_pass_3}")
+
+    test_data_4 = [
+            ["FILE_UPLOAD_AT", "2021-07-01T12:00:00", "Initial.txt", "100kb"], 
+            ["FILE_UPLOAD_AT", "2021-07-01T12:05:00", "Update1.txt", "150kb", 3600], 
+            ["FILE_GET_AT", "2021-07-01T12:10:00", "Initial.txt"], 
+            ["FILE_COPY_AT", "2021-07-01T12:15:00", "Update1.txt", "Update1Copy.txt"], 
+            ["FILE_UPLOAD_AT", "2021-07-01T12:20:00", "Update2.txt", "200kb", 1800], 
+            ["ROLLBACK", "2021-07-01T12:10:00"], 
+            ["FILE_GET_AT", "2021-07-01T12:25:00", "Update1.txt"], 
+            ["FILE_GET_AT", "2021-07-01T12:25:00", "Initial.txt"], 
+            ["FILE_SEARCH_AT", "2021-07-01T12:25:00", "Up"],
+            ["FILE_GET_AT", "2021-07-01T12:25:00", "Update2.txt"]
+        ]
+    test_output_4 = ["uploaded at Initial.txt", "uploaded at Update1.txt", "got at Initial.txt", "copied at Update1.txt to Update1Copy.txt", "uploaded at Update2.txt", "rollback to 2021-07-01T12:10:00", "got at Update1.txt", "got at Initial.txt", "found at [Update1.txt]", "file not found"]
+    test_pass_4 = simulate_coding_framework(test_data_4) == test_output_4
+    print(f"Test 4 passed: {test_pass_4}")
\ No newline at end of file
@@ -1,29 +1,29 @@
-import json
 import math
-import string
-import re
-import random
-import sys
-import traceback
 import functools
-from collections import OrderedDict
+from datetime import date
 
-import numpy
-import sortedcontainers
-from datetime import datetime
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
 
-def is_alive(upload_timestamp, current_timestamp, ttl):
-    if not upload_timestamp:
+@functools.lru_cache(maxsize=4096)
+def to_epoch(timestamp):
+    # "%Y-%m-%dT%H:%M:%S" -> epoch seconds, slicing the fixed-width fields instead of calling strptime
+    if isinstance(timestamp, int):
+        return timestamp
+    days = date(int(timestamp[0:4]), int(timestamp[5:7]), int(timestamp[8:10])).toordinal() - EPOCH_ORDINAL
+    return days * 86400 + int(timestamp[11:13]) * 3600 + int(timestamp[14:16]) * 60 + int(timestamp[17:19])
+
+def is_alive(upload_time, current_time, ttl):
+    if upload_time is None:
         return True
-    return ((datetime.strptime(current_timestamp, "%Y-%m-%dT%H:%M:%S") - datetime.strptime(upload_timestamp, "%Y-%m-%dT%H:%M:%S")).total_seconds() < ttl)
+    return current_time - upload_time < ttl
 
 class File():
-    def __init__(self, file_name: str, size: str, upload_time: str | None = None, ttl: int | None = None):
+    def __init__(self, file_name: str, size: str, upload_time: int | None = None, ttl: int | None = None):
         self.file_name = file_name
         self.size = size
         self.size_num = int(size[:-2])
         self.upload_time = upload_time 
-        self.ttl = ttl if ttl else numpy.inf
+        self.ttl = ttl if ttl else math.inf
 
 class FileManagementSystem():
     def __init__(self, files: list[File] | None = None):
@@ -68,6 +68,7 @@ class FileManagementSystem():
         return f"found [{str_results}]"
     
     def file_upload_at(self, timestamp, file_name, size, ttl = None):
+        timestamp = to_epoch(timestamp)
         for file in self.files:
             if file.file_name == file_name:
                 raise Exception(f"{file_name} already exists")
@@ -75,12 +76,14 @@ class FileManagementSystem():
         return f"uploaded at {file_name}"
 
     def file_get_at(self, timestamp, file_name):
+        timestamp = to_epoch(timestamp)
         for file in self.files:
             if file.file_name == file_name and is_alive(file.upload_time, timestamp, file.ttl):
                 return file, f"got at {file_name}"
         return None, "file not found"
     
     def file_copy_at(self, timestamp, source, dest):
+        timestamp = to_epoch(timestamp)
         source_file = self.file_get_at(timestamp, source)[0]
         if not source_file:
             raise Exception(f"{source} does not exist")
@@ -91,6 +94,7 @@ class FileManagementSystem():
         return f"copied at {source} to {dest}"
     
     def file_search_at(self, timestamp, prefix):
+        timestamp = to_epoch(timestamp)
         results = []
         for file in self.files:
             if file.file_name.startswith(prefix) and is_alive(file.upload_time, timestamp, file.ttl):
@@ -101,9 +105,10 @@ class FileManagementSystem():
         return f"found at [{str_results}]"
     
     def rollback(self, timestamp):
+        moment = to_epoch(timestamp)
         for idx, file in enumerate(self.files):
             # check if file was uploaded yet
-            if is_alive(file.upload_time, timestamp, 0):
+            if is_alive(file.upload_time, moment, 0):
                 self.files.pop(idx)
         return f"rollback to {timestamp}"
             
@@ -131,14 +136,14 @@ def simulate_coding_framework(list_of_lists):
         if action[0] == "FILE_UPLOAD_AT":
             if len(action) == 4:
                 action.append(None)
-            outputs.append(file_management_system.file_upload_at(file_name=action[2], size=action[3], timestamp=action[1], ttl=action[4]))
+            outputs.append(file_management_system.file_upload_at(file_name=action[2], size=action[3], timestamp=to_epoch(action[1]), ttl=action[4]))
         if action[0] == "FILE_GET_AT":
-            outputs.append(file_management_system.file_get_at(timestamp=action[1], file_name=action[2])[1])
+            outputs.append(file_management_system.file_get_at(timestamp=to_epoch(action[1]), file_name=action[2])[1])
         if action[0] == "FILE_COPY_AT":
-            outputs.append(file_management_system.file_copy_at(timestamp=action[1], source=action[2], dest=action[3]))
+            outputs.append(file_management_system.file_copy_at(timestamp=to_epoch(action[1]), source=action[2], dest=action[3]))
         if action[0] == "FILE_SEARCH_AT":
-            print(file_management_system.file_search_at(timestamp=action[1], prefix=action[2]))
-            outputs.append(file_management_system.file_search_at(timestamp=action[1], prefix=action[2]))
+            print(file_management_system.file_search_at(timestamp=to_epoch(action[1]), prefix=action[2]))
+            outputs.append(file_management_system.file_search_at(timestamp=to_epoch(action[1]), prefix=action[2]))
         if action[0] == "ROLLBACK":
             outputs.append(file_management_system.rollback(timestamp=action[1]))
         
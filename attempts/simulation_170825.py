@@ -1,18 +1,6 @@
-import json
 import math
-import string
-import re
-import random
-import sys
-import traceback
-import functools
-from collections import OrderedDict
-import numpy as np
 from datetime import datetime as dt
 
-import numpy
-import sortedcontainers
-
 size_map = {"kb": 1000}
 
 def to_bytes(size: str):
@@ -21,7 +9,7 @@ def to_bytes(size: str):
     return amount * size_map[unit]
 
 class File:
-    def __init__(self, file_name: str, size: str, timestamp: str = None, ttl: int = np.inf):
+    def __init__(self, file_name: str, size: str, timestamp: str = None, ttl: int = math.inf):
         self.file_name = file_name
         self.size = size
         self.size_bytes = to_bytes(size)
@@ -68,7 +56,7 @@ class FileSystem:
         res = res[:-2] + "]"
         return res
     
-    def file_upload_at(self, timestamp: str, file_name: str, size: str, ttl: int = np.inf):
+    def file_upload_at(self, timestamp: str, file_name: str, size: str, ttl: int = math.inf):
         for file in self.files:
             if file.file_name == file_name:
                 RuntimeError(f"File with name: {file_name} already exsists")
@@ -1,28 +1,24 @@
-import json
-import math
-import string
-import re
-import random
-import sys
-import traceback
 import functools
-from collections import OrderedDict
+from datetime import date
 
-import numpy as np
-import sortedcontainers
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
 
-from datetime import datetime as dt
-from datetime import timedelta
+@functools.lru_cache(maxsize=4096)
+def to_epoch(timestamp):
+    # fixed "YYYY-MM-DDTHH:MM:SS" layout, so slice the fields instead of calling fromisoformat per comparison
+    days = date(int(timestamp[0:4]), int(timestamp[5:7]), int(timestamp[8:10])).toordinal() - EPOCH_ORDINAL
+    return days * 86400 + int(timestamp[11:13]) * 3600 + int(timestamp[14:16]) * 60 + int(timestamp[17:19])
 
 class File():
     def __init__(self, file_name, size, upload_time = None, ttl = 10000000000):
         self.file_name = file_name
         self.size = size
-        self.upload_time = dt.fromisoformat(upload_time)
+        self.upload_time = to_epoch(upload_time)
         self.ttl = ttl
+        self.expires_at = self.upload_time + int(ttl)
 
     def is_alive(self, timestamp):
-        return self.upload_time + timedelta(seconds=self.ttl) > dt.fromisoformat(timestamp) 
+        return self.expires_at > to_epoch(timestamp)
 
 class FileSystem():
     def __init__(self):
@@ -92,7 +88,8 @@ class FileSystem():
         for file in self.files:
             if file.file_name == file_to:
                 file.size = source_size
-                file.upload_time = timestamp
+                file.upload_time = to_epoch(timestamp)
+                file.expires_at = file.upload_time + int(file.ttl)
                 return f"copied {file_from} to {file_to}"
 
         self.FILE_UPLOAD_AT(timestamp, file_to, source_size)
@@ -109,8 +106,9 @@ class FileSystem():
 
     def ROLLBACK(self, timestamp):
         files_to_remove = []
+        moment = to_epoch(timestamp)
         for file in self.files:
-            if file.upload_time > dt.fromisoformat(timestamp):
+            if file.upload_time > moment:
                 files_to_remove.append(file)
         for file in files_to_remove:
             self.files.remove(file)
@@ -0,0 +1,904 @@
+import asyncio
+import io
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+from datetime import datetime, timezone
+import file_concurrency
+import simulation
+import workload
+from file_cluster import FileCluster
+from file_concurrency import ConcurrentFileSystem
+from file_service import FileClient, FileService
+from file_snapshot import Snapshot, write_snapshot, snapshot_bytes
+from simulation import simulate_coding_framework, stream_coding_framework, read_commands, compile_commands, OP_FILE_UPLOAD_AT, OP_FILE_GET_AT, OP_ROLLBACK, COMMAND_BATCH_SIZE, reorder_commands, FileManagementSystem, Server, Stats, parse_timestamp, format_timestamp, TIMESTAMP_FORMAT
+from write_ahead_log import WriteAheadLog
+
+class TestFileManagementSystem(unittest.TestCase):
+
+    def setUp(self):
+        self.test_data_1 = [["FILE_UPLOAD", "Cars.txt", "200kb"],
+                              ["FILE_GET", "Cars.txt"],
+                              ["FILE_COPY", "Cars.txt", "Cars2.txt"],
+                              ["FILE_GET", "Cars2.txt"] ]
+        self.test_data_2 = [["FILE_UPLOAD", "Foo.txt", "100kb"],
+                            ["FILE_UPLOAD", "Bar.csv", "200kb"],
+                            ["FILE_UPLOAD", "Baz.pdf", "300kb"],
+                            ["FILE_SEARCH", "Ba"]]
+        self.test_data_3 = [
+            ["FILE_UPLOAD_AT", "2021-07-01T12:00:00", "Python.txt", "150kb"],
+            ["FILE_UPLOAD_AT", "2021-07-01T12:00:00", "CodeSignal.txt", "150kb", 3600],
+            ["FILE_GET_AT", "2021-07-01T13:00:01", "Python.txt"],
+            ["FILE_COPY_AT", "2021-07-01T12:00:00", "Python.txt", "PythonCopy.txt"],
+            ["FILE_SEARCH_AT", "2021-07-01T12:00:00", "Py"],
+            ["FILE_UPLOAD_AT", "2021-07-01T12:00:00", "Expired.txt", "100kb", 1],
+            ["FILE_GET_AT", "2021-07-01T12:00:02", "Expired.txt"],
+            ["FILE_COPY_AT", "2021-07-01T12:00:00", "CodeSignal.txt", "CodeSignalCopy.txt"],
+            ["FILE_SEARCH_AT", "2021-07-01T12:00:00", "Code"]
+        ]
+        self.test_data_4 = [
+            ["FILE_UPLOAD_AT", "2021-07-01T12:00:00", "Initial.txt", "100kb"],
+            ["FILE_UPLOAD_AT", "2021-07-01T12:05:00", "Update1.txt", "150kb", 3600],
+            ["FILE_GET_AT", "2021-07-01T12:10:00", "Initial.txt"],
+            ["FILE_COPY_AT", "2021-07-01T12:15:00", "Update1.txt", "Update1Copy.txt"],
+            ["FILE_UPLOAD_AT", "2021-07-01T12:20:00", "Update2.txt", "200kb", 1800],
+            ["ROLLBACK", "2021-07-01T12:10:00"],
+            ["FILE_GET_AT", "2021-07-01T12:25:00", "Update1.txt"],
+            ["FILE_GET_AT", "2021-07-01T12:25:00", "Initial.txt"],
+            ["FILE_SEARCH_AT", "2021-07-01T12:25:00", "Up"],
+            ["FILE_GET_AT", "2021-07-01T12:25:00", "Update2.txt"]
+        ]
+
+    def test_group_1(self):
+        output = simulate_coding_framework(self.test_data_1)
+        self.assertEqual(output, ["uploaded Cars.txt", "got Cars.txt", "copied Cars.txt to Cars2.txt", "got Cars2.txt"])
+
+    def test_group_2(self):
+        output = simulate_coding_framework(self.test_data_2)
+        self.assertEqual(output, ["uploaded Foo.txt", "uploaded Bar.csv", "uploaded Baz.pdf", "found [Baz.pdf, Bar.csv]"])
+
+    def test_group_3(self):
+        output = simulate_coding_framework(self.test_data_3)
+        self.assertEqual(output, ["uploaded at Python.txt", "uploaded at CodeSignal.txt", "got at Python.txt", "copied at Python.txt to PythonCopy.txt", "found at [Python.txt, PythonCopy.txt]", "uploaded at Expired.txt", "file not found", "copied at CodeSignal.txt to CodeSignalCopy.txt", "found at [CodeSignal.txt, CodeSignalCopy.txt]"])
+
+    def test_group_4(self):
+        output = simulate_coding_framework(self.test_data_4)
+        self.assertEqual(output, ["uploaded at Initial.txt", "uploaded at Update1.txt", "got at Initial.txt", "copied at Update1.txt to Update1Copy.txt", "uploaded at Update2.txt", "rollback to 2021-07-01T12:10:00", "got at Update1.txt", "got at Initial.txt", "found at [Update1.txt]", "file not found"])
+
+    def test_name_index(self):
+        file_management_system = FileManagementSystem(Server())
+        file_management_system.file_upload("Cars.txt", "200kb")
+        file_management_system.file_copy("Cars.txt", "Cars2.txt")
+        self.assertEqual(file_management_system.file_get("Cars2.txt")[0].row, file_management_system.files["Cars2.txt"])
+        self.assertIsNone(file_management_system.file_get("Boats.txt"))
+        with self.assertRaises(RuntimeError):
+            file_management_system.file_upload("Cars2.txt", "100kb")
+
+    def test_name_index_after_rollback(self):
+        file_management_system = FileManagementSystem(Server())
+        file_management_system.file_upload_at("2021-07-01T12:00:00", "Initial.txt", "100kb")
+        file_management_system.file_upload_at("2021-07-01T12:20:00", "Update.txt", "200kb")
+        file_management_system.rollback("2021-07-01T12:10:00")
+        self.assertNotIn("Update.txt", file_management_system.files)
+        self.assertEqual(list(file_management_system.names), ["Initial.txt"])
+        self.assertEqual(len(file_management_system.table), 1)
+        self.assertEqual(file_management_system.file_upload_at("2021-07-01T12:30:00", "Update.txt", "200kb"), "uploaded at Update.txt")
+
+    def test_search_top_10_by_size_then_name(self):
+        file_management_system = FileManagementSystem(Server())
+        for i in range(12):
+            file_management_system.file_upload(f"Log{i:02}.txt", f"{100 + i // 2 * 10}kb")
+        file_management_system.file_upload("Other.txt", "999kb")
+        self.assertEqual(file_management_system.file_search("Log"), "found [Log10.txt, Log11.txt, Log08.txt, Log09.txt, Log06.txt, Log07.txt, Log04.txt, Log05.txt, Log02.txt, Log03.txt]")
+        file_management_system.rollback("2021-07-01T12:00:00")
+        self.assertEqual(file_management_system.file_search("Log1"), "found [Log10.txt, Log11.txt]")
+        self.assertEqual(file_management_system.file_search("Missing"), "found []")
+
+    def test_search_index_after_rollback(self):
+        file_management_system = FileManagementSystem(Server())
+        file_management_system.file_upload_at("2021-07-01T12:00:00", "Update1.txt", "100kb")
+        file_management_system.file_upload_at("2021-07-01T12:20:00", "Update2.txt", "200kb")
+        file_management_system.rollback("2021-07-01T12:10:00")
+        self.assertEqual(file_management_system.file_search_at("2021-07-01T12:25:00", "Up"), "found at [Update1.txt]")
+
+    def test_rollback_restores_overwritten_files(self):
+        stats = Stats()
+        file_management_system = FileManagementSystem(Server(), stats=stats)
+        for i in range(100):
+            file_management_system.file_upload_at("2021-07-01T11:00:00", f"Old{i:03}.txt", "1kb")
+        file_management_system.file_upload_at("2021-07-01T12:00:00", "Source.txt", "300kb")
+        file_management_system.file_upload_at("2021-07-01T12:00:00", "Dest.txt", "100kb", 3600)
+        file_management_system.file_upload_at("2021-07-01T12:00:00", "Short.txt", "50kb", 60)
+        # a copy overwrites its destination, an upload replaces an expired file of the same name
+        self.assertEqual(file_management_system.file_copy_at("2021-07-01T12:10:00", "Source.txt", "Dest.txt"), "copied at Source.txt to Dest.txt")
+        file_management_system.file_upload_at("2021-07-01T12:10:00", "Short.txt", "70kb")
+        self.assertEqual(file_management_system.file_get_at("2021-07-01T12:10:00", "Dest.txt")[0].size, 300000)
+        file_management_system.rollback("2021-07-01T12:05:00")
+        # both come back with their own sizes and expiry, and only the two writes were visited
+        self.assertEqual(stats.counters["rollback_entries_undone"], 2)
+        self.assertEqual(file_management_system.file_get_at("2021-07-01T12:20:00", "Dest.txt")[0].size, 100000)
+        self.assertEqual(file_management_system.file_get_at("2021-07-01T13:00:00", "Dest.txt"), (None, "file not found"))
+        self.assertEqual(file_management_system.file_get_at("2021-07-01T12:00:30", "Short.txt")[0].size, 50000)
+        self.assertEqual(file_management_system.file_get_at("2021-07-01T13:00:00", "Short.txt"), (None, "file not found"))
+        # a later rollback undoes the writes before them
+        file_management_system.rollback("2021-07-01T11:30:00")
+        self.assertEqual(stats.counters["rollback_entries_undone"], 5)
+        self.assertEqual(file_management_system.file_search_at("2021-07-01T13:00:00", "Old09"), "found at [Old090.txt, Old091.txt, Old092.txt, Old093.txt, Old094.txt, Old095.txt, Old096.txt, Old097.txt, Old098.txt, Old099.txt]")
+        self.assertEqual(len(file_management_system.table), 100)
+
+    def test_rollback_matches_replaying_the_kept_writes(self):
+        rng = random.Random(7)
+        file_names = [f"dir-{i % 2}/file-{i}.txt" for i in range(6)]
+        file_management_system = FileManagementSystem(Server(), search_cache_size=0)
+        writes, moment = [], 1625140800
+        for _ in range(400):
+            moment += rng.randrange(30)
+            if rng.random() < 0.1:
+                target = moment - rng.randrange(600)
+                file_management_system.rollback(target)
+                writes = [write for write in writes if parse_timestamp(write[1]) <= target]
+                reference = FileManagementSystem(Server())
+                simulate_coding_framework(writes, file_management_system=reference)
+                for file_name in file_names:
+                    found = [system.file_get_at(moment, file_name)[0] for system in (file_management_system, reference)]
+                    self.assertEqual(*[(file.size, file.uploaded_at, file.expires_at) if file is not None else None for file in found])
+                continue
+            file_name = rng.choice(file_names)
+            if rng.random() < 0.5:
+                write = ["FILE_COPY_AT", format_timestamp(moment), rng.choice(file_names), file_name]
+            else:
+                write = ["FILE_UPLOAD_AT", format_timestamp(moment), file_name, f"{rng.randrange(1, 100)}kb", rng.choice([None, 60, 600])]
+            try:
+                simulate_coding_framework([write], file_management_system=file_management_system)
+            except RuntimeError:
+                continue
+            writes.append(write)
+
+    def test_expired_files_are_evicted(self):
+        file_management_system = FileManagementSystem(Server())
+        file_management_system.file_upload_at("2021-07-01T12:00:00", "Forever.txt", "100kb")
+        file_management_system.file_upload_at("2021-07-01T12:00:00", "Short.txt", "100kb", 60)
+        self.assertEqual(len(file_management_system.expiry_queue), 1)
+        self.assertEqual(file_management_system.file_get_at("2021-07-01T12:01:00", "Short.txt")[1], "file not found")
+        self.assertNotIn("Short.txt", file_management_system.files)
+        self.assertIn("Short.txt", file_management_system.expired)
+        self.assertEqual(file_management_system.file_upload_at("2021-07-01T12:01:00", "Short.txt", "200kb"), "uploaded at Short.txt")
+
+    def test_reads_behind_the_clock_see_expired_files(self):
+        file_management_system = FileManagementSystem(Server())
+        file_management_system.file_upload_at("2021-07-01T12:00:00", "Short.txt", "100kb", 60)
+        file_management_system.file_get_at("2021-07-01T13:00:00", "Short.txt")
+        self.assertEqual(file_management_system.file_get_at("2021-07-01T12:00:30", "Short.txt")[1], "got at Short.txt")
+        self.assertEqual(file_management_system.file_search_at("2021-07-01T12:00:30", "Sh"), "found at [Short.txt]")
+        with self.assertRaises(RuntimeError):
+            file_management_system.file_upload_at("2021-07-01T12:00:30", "Short.txt", "100kb")
+
+    def test_retention_drops_old_expired_files(self):
+        file_management_system = FileManagementSystem(Server(), retention=3600)
+        file_management_system.file_upload_at("2021-07-01T12:00:00", "Short.txt", "100kb", 60)
+        file_management_system.file_get_at("2021-07-01T12:30:00", "Short.txt")
+        self.assertIn("Short.txt", file_management_system.expired)
+        file_management_system.file_get_at("2021-07-01T14:00:00", "Short.txt")
+        self.assertEqual(file_management_system.expired, {})
+
+    def test_retention_bounds_dead_rows(self):
+        trace = [["FILE_UPLOAD_AT", format_timestamp(1625140800 + i), f"file-{i}.txt", "1kb", 5] for i in range(20000)]
+        file_management_system = FileManagementSystem(Server(), retention=3600)
+        simulate_coding_framework(trace, file_management_system=file_management_system)
+        self.assertLessEqual(len(file_management_system.table), 3600 + 5)
+        self.assertLessEqual(len(file_management_system.undo_log), 2 * 3600 + 1)
+        file_management_system = FileManagementSystem(Server())
+        simulate_coding_framework(trace, file_management_system=file_management_system)
+        self.assertEqual(len(file_management_system.table), 20000)
+        # the default keeps everything, so reads and ROLLBACK far behind the clock still answer
+        trace = [["FILE_UPLOAD_AT", "2021-07-01T12:00:00", "Short.txt", "1kb", 5], ["FILE_GET_AT", "2021-07-01T14:00:00", "Other.txt"], ["FILE_SEARCH", "Sh"], ["FILE_GET_AT", "2021-07-01T12:00:01", "Short.txt"]]
+        self.assertEqual(simulate_coding_framework(trace)[-1], "got at Short.txt")
+        self.assertEqual(simulate_coding_framework(trace, retention=3600, lateness=3 * 3600)[-1], "got at Short.txt")
+        with self.assertRaises(RuntimeError):
+            simulate_coding_framework(trace, retention=3600)
+        trace = [["FILE_UPLOAD_AT", "2021-07-01T12:00:00", "A.txt", "1kb"], ["FILE_UPLOAD_AT", "2021-07-01T12:00:01", "B.txt", "1kb"], ["FILE_GET_AT", "2021-07-01T14:00:00", "A.txt"], ["ROLLBACK", "2021-07-01T12:00:00"], ["FILE_GET_AT", "2021-07-01T14:00:00", "B.txt"]]
+        self.assertEqual(simulate_coding_framework(trace)[-1], "file not found")
+        with self.assertRaises(RuntimeError):
+            simulate_coding_framework(trace, retention=3600)
+
+    def test_parse_timestamp_matches_strptime(self):
+        for timestamp in ["1970-01-01T00:00:00", "2021-07-01T12:00:00", "2024-02-29T23:59:59", "1969-12-31T23:59:59", "2100-03-01T00:00:01"]:
+            expected = int(datetime.strptime(timestamp, TIMESTAMP_FORMAT).replace(tzinfo=timezone.utc).timestamp())
+            self.assertEqual(parse_timestamp(timestamp), expected)
+            self.assertEqual(format_timestamp(parse_timestamp(timestamp)), timestamp)
+
+    def test_files_store_epoch_seconds(self):
+        file_management_system = FileManagementSystem(Server())
+        file_management_system.file_upload_at("2021-07-01T12:00:00", "Short.txt", "100kb", "60")
+        file = file_management_system.file_get("Short.txt")[0]
+        self.assertEqual((file.uploaded_at, file.expires_at), (1625140800, 1625140860))
+        self.assertEqual(file_management_system.file_get_at(1625140859, "Short.txt")[1], "got at Short.txt")
+        self.assertEqual(file_management_system.rollback(1625140800), "rollback to 2021-07-01T12:00:00")
+
+    def test_as_of_reads(self):
+        output = simulate_coding_framework(self.test_data_4[:5] + [
+            ["FILE_GET_AS_OF", "2021-07-01T12:10:00", "Update1Copy.txt"],
+            ["FILE_GET_AS_OF", "2021-07-01T12:15:00", "Update1Copy.txt"],
+            ["FILE_SEARCH_AS_OF", "2021-07-01T12:10:00", "Up"],
+            ["FILE_SEARCH_AS_OF", "2021-07-01T12:20:00", "Up"],
+            ["FILE_SEARCH_AS_OF", "2021-07-01T14:00:00", "Up"],
+            ["FILE_SEARCH_AT", "2021-07-01T12:10:00", "Up"],
+        ], history=True)
+        self.assertEqual(output[5:], ["file not found", "got at Update1Copy.txt", "found at [Update1.txt]", "found at [Update2.txt, Update1.txt, Update1Copy.txt]", "found at [Update1Copy.txt]", "found at [Update2.txt, Update1.txt, Update1Copy.txt]"])
+
+    def test_as_of_reads_follow_rollback_and_reuploads(self):
+        file_management_system = FileManagementSystem(Server(), history=True)
+        file_management_system.file_upload_at("2021-07-01T12:00:00", "Short.txt", "100kb", 60)
+        file_management_system.file_upload_at("2021-07-01T12:05:00", "Short.txt", "300kb")
+        file_management_system.file_upload_at("2021-07-01T12:20:00", "Late.txt", "200kb")
+        self.assertEqual(file_management_system.file_get_as_of("2021-07-01T12:00:30", "Short.txt")[0].size, 100000)
+        self.assertIsNone(file_management_system.file_get_as_of("2021-07-01T12:02:00", "Short.txt")[0])
+        self.assertEqual(file_management_system.file_get_as_of("2021-07-01T12:06:00", "Short.txt")[0].size, 300000)
+        file_management_system.rollback("2021-07-01T12:10:00")
+        self.assertEqual(file_management_system.file_search_as_of("2021-07-01T12:30:00", ""), "found at [Short.txt]")
+        self.assertEqual(file_management_system.file_search_at("2021-07-01T12:30:00", ""), "found at [Short.txt]")
+
+    def test_as_of_reads_need_history(self):
+        with self.assertRaises(RuntimeError):
+            FileManagementSystem(Server()).file_get_as_of("2021-07-01T12:00:00", "Cars.txt")
+
+    def test_stream_matches_list_api(self):
+        trace = io.StringIO("".join(json.dumps(action) + "\n" for action in self.test_data_3) + "\n")
+        results = stream_coding_framework(read_commands(trace))
+        self.assertEqual(next(results), "uploaded at Python.txt")
+        self.assertEqual(list(results), simulate_coding_framework(self.test_data_3)[1:])
+
+    def test_stream_is_lazy(self):
+        commands = itertools.chain([["FILE_UPLOAD", "Cars.txt", "200kb"]], itertools.repeat(["FILE_SEARCH", "Cars"]))
+        results = stream_coding_framework(commands)
+        self.assertEqual(next(results), "uploaded Cars.txt")
+        self.assertEqual(next(results), "found [Cars.txt]")
+
+    def test_compile_commands(self):
+        program = compile_commands(self.test_data_3[:3] + [["ROLLBACK", "2021-07-01T12:00:00"], ["UNKNOWN", "Cars.txt"]])
+        self.assertEqual(program, [
+            (OP_FILE_UPLOAD_AT, (1625140800, "Python.txt", 150000, None)),
+            (OP_FILE_UPLOAD_AT, (1625140800, "CodeSignal.txt", 150000, 3600)),
+            (OP_FILE_GET_AT, (1625144401, "Python.txt")),
+            (OP_ROLLBACK, (1625140800,)),
+        ])
+        self.assertEqual(simulate_coding_framework(self.test_data_4 + [["UNKNOWN", "Cars.txt"]] * (COMMAND_BATCH_SIZE + 1) + [["FILE_SEARCH", "Init"]])[-1], "found [Initial.txt]")
+
+    def test_reorder_commands(self):
+        program = compile_commands(self.test_data_3)
+        self.assertEqual([position for position, _, _ in reorder_commands(program, 3600)], [0, 1, 3, 4, 5, 7, 8, 6, 2])
+        # with no lateness allowed, everything behind 13:00:01 is late and runs where it arrived
+        stats = Stats()
+        self.assertEqual([position for position, _, _ in reorder_commands(program, 0, stats)], list(range(9)))
+        self.assertEqual(stats.counters["late_commands"], 6)
+        # a ROLLBACK releases everything buffered before it
+        program = compile_commands(self.test_data_4)
+        self.assertEqual([position for position, _, _ in reorder_commands(program, 3600)], [0, 1, 2, 3, 4, 5, 6, 7, 8, 9])
+        self.assertEqual(simulate_coding_framework(self.test_data_3, lateness=0), simulate_coding_framework(self.test_data_3))
+        self.assertEqual(simulate_coding_framework(self.test_data_4, lateness=3600), simulate_coding_framework(self.test_data_4))
+        # a late command can land far behind the clock; only a retention refuses to answer it
+        trace = [["FILE_UPLOAD_AT", "2021-07-01T12:00:00", "Short.txt", "1kb", 5], ["FILE_GET_AT", "2021-07-01T14:00:00", "Short.txt"], ["FILE_GET_AT", "2021-07-01T14:05:00", "Short.txt"], ["FILE_GET_AT", "2021-07-01T12:00:01", "Short.txt"]]
+        self.assertEqual(simulate_coding_framework(trace, lateness=60)[-1], "got at Short.txt")
+        with self.assertRaises(RuntimeError):
+            simulate_coding_framework(trace, lateness=60, retention=3600)
+
+    def test_reordered_stream_matches_a_time_ordered_trace(self):
+        def arriving_late(trace, seed):
+            # every timestamp arrives up to 100 seconds late; commands sharing one keep their order
+            rng = random.Random(seed)
+            delays = {command[1]: rng.randrange(100) for command in trace}
+            return sorted(range(len(trace)), key=lambda i: (parse_timestamp(trace[i][1]) + delays[trace[i][1]], i))
+
+        trace = workload.generate_trace(3000, seed=8, rollback_rate=0)
+        arrival = arriving_late(trace, 8)
+        shuffled = [trace[i] for i in arrival]
+        expected = simulate_coding_framework(trace)
+        stats = Stats()
+        self.assertEqual(simulate_coding_framework(shuffled, lateness=100, stats=stats), [expected[i] for i in arrival])
+        self.assertEqual(stats.counters["late_commands"], 0)
+        with tempfile.TemporaryDirectory() as directory:
+            self.assertEqual(list(stream_coding_framework(shuffled, wal=WriteAheadLog(directory), lateness=100)), [expected[i] for i in arrival])
+            recovered, reference = FileManagementSystem(Server()), FileManagementSystem(Server())
+            WriteAheadLog(directory).recover(recovered)
+            simulate_coding_framework(trace, file_management_system=reference)
+            self.assertEqual(recovered.file_search_at("2021-07-02T00:00:00", "p00/"), reference.file_search_at("2021-07-02T00:00:00", "p00/"))
+        # with a tighter bound some commands are late and run where they arrived, through the slow
+        # path (no copies here: a late copy could arrive before the upload of its source)
+        trace = workload.generate_trace(3000, seed=9, mix={"FILE_UPLOAD_AT": 40, "FILE_GET_AT": 30, "FILE_SEARCH_AT": 30}, rollback_rate=0)
+        stats = Stats()
+        self.assertEqual(len(simulate_coding_framework([trace[i] for i in arriving_late(trace, 9)], lateness=10, stats=stats)), len(trace))
+        self.assertGreater(stats.counters["late_commands"], 0)
+
+    def test_file_table_reuses_released_rows(self):
+        file_management_system = FileManagementSystem(Server())
+        file_management_system.file_upload_at("2021-07-01T12:00:00", "Initial.txt", "100kb")
+        file_management_system.file_upload_at("2021-07-01T12:20:00", "Update.txt", "2mb", 60)
+        update_row = file_management_system.files["Update.txt"]
+        file_management_system.rollback("2021-07-01T12:10:00")
+        self.assertEqual(file_management_system.table.free, [update_row])
+        file_management_system.file_upload_at("2021-07-01T12:30:00", "Next.txt", "1kb")
+        next_file = file_management_system.file_get("Next.txt")[0]
+        self.assertEqual((next_file.row, next_file.size, next_file.ttl), (update_row, 1000, None))
+        # the stale expiry entry of the released row must not expire the file now stored in it
+        self.assertEqual(file_management_system.file_get_at("2021-07-01T13:00:00", "Next.txt")[1], "got at Next.txt")
+
+    def test_search_orders_by_bytes(self):
+        output = simulate_coding_framework([["FILE_UPLOAD", "Big.txt", "2mb"], ["FILE_UPLOAD", "Bigger.txt", "900kb"], ["FILE_UPLOAD", "Bit.txt", "999b"], ["FILE_SEARCH", "Bi"]])
+        self.assertEqual(output[-1], "found [Big.txt, Bigger.txt, Bit.txt]")
+
+    def test_vectorized_search_matches_scalar_search(self):
+        rng = random.Random(7)
+        # uncached, so both paths really run
+        file_management_system = FileManagementSystem(Server(), search_cache_size=0)
+        for i in range(3000):
+            # few distinct sizes so plenty of ties have to be broken by name
+            file_management_system.file_upload_at(1625140800 + rng.randrange(3600), f"{rng.choice('abc')}{i:04}.txt", f"{rng.randrange(20)}kb", rng.choice([None, 60, 600, 6000]))
+        file_management_system.file_upload("b-untimed.txt", "19kb")
+        file_management_system.file_search_at(1625140800 + 7200, "")
+        for timestamp in [1625140800 + 300, 1625140800 + 7200, 1625140800 + 10 ** 6]:
+            for prefix in ["", "a", "b", "c1", "c12", "z"]:
+                with patch.object(simulation, "VECTOR_SEARCH_MIN", 1):
+                    vectorized = file_management_system.file_search_at(timestamp, prefix), file_management_system.file_search(prefix)
+                with patch.object(simulation, "VECTOR_SEARCH_MIN", 10 ** 9):
+                    scalar = file_management_system.file_search_at(timestamp, prefix), file_management_system.file_search(prefix)
+                self.assertEqual(vectorized, scalar)
+        file_management_system.file_upload("after-search.txt", "1kb")
+
+    def test_batched_reads(self):
+        output = simulate_coding_framework(self.test_data_4 + [
+            ["FILE_GET_MANY_AT", "2021-07-01T12:25:00", "Update2.txt", "Initial.txt", "Update1.txt", "Initial.txt"],
+            ["FILE_SEARCH_MANY_AT", "2021-07-01T12:25:00", "Update", "I", "Up", "", "Update1", "X"],
+        ])
+        self.assertEqual(output[-2], ["file not found", "got at Initial.txt", "got at Update1.txt", "got at Initial.txt"])
+        self.assertEqual(output[-1], ["found at [Update1.txt]", "found at [Initial.txt]", "found at [Update1.txt]", "found at [Update1.txt, Initial.txt]", "found at [Update1.txt]", "found at []"])
+
+    def test_batched_search_matches_single_searches(self):
+        rng = random.Random(3)
+        file_management_system = FileManagementSystem(Server())
+        for i in range(500):
+            file_management_system.file_upload_at(1625140800 + rng.randrange(3600), f"{rng.choice(['Up', 'Update', 'Code', 'Py'])}{i:03}", f"{rng.randrange(9)}kb", rng.choice([None, 60, 600]))
+        file_management_system.file_search_at(1625140800 + 7200, "")
+        prefixes = ["Up", "Update", "Update1", "Code", "Py", "Up", "", "Q"]
+        for timestamp in [1625140800 + 300, 1625140800 + 7200]:
+            self.assertEqual(file_management_system.search_many_at(timestamp, prefixes), [file_management_system.file_search_at(timestamp, prefix) for prefix in prefixes])
+            self.assertEqual(file_management_system.get_many_at(timestamp, ["Up001", "Py002"]), [file_management_system.file_get_at(timestamp, file_name)[1] for file_name in ["Up001", "Py002"]])
+
+    def test_directory_aggregates(self):
+        output = simulate_coding_framework([
+            ["FILE_UPLOAD", "file-1.zip", "4321b"],
+            ["FILE_UPLOAD_AT", "2021-07-01T12:00:00", "dir-a/dir-c/file-2.txt", "1100b"],
+            ["FILE_UPLOAD_AT", "2021-07-01T12:05:00", "dir-a/dir-c/file-3.csv", "2122b", 60],
+            ["FILE_COPY_AT", "2021-07-01T12:05:00", "dir-a/dir-c/file-2.txt", "dir-b/file-4.mdx"],
+            ["DIR_SIZE", "/"],
+            ["DIR_SIZE", "dir-a"],
+            ["DIR_LIST", "dir-a/dir-c"],
+            ["DIR_LIST", ""],
+            ["FILE_GET_AT", "2021-07-01T12:10:00", "dir-a/dir-c/file-3.csv"],
+            ["DIR_SIZE", "dir-a/dir-c"],
+            ["ROLLBACK", "2021-07-01T12:00:00"],
+            ["DIR_LIST", ""],
+            ["DIR_SIZE", "dir-b"],
+            ["FILE_SEARCH", "dir-a/"],
+        ])
+        self.assertEqual(output[4:], [
+            "/ has 4 files, 8643 bytes",
+            "dir-a has 2 files, 3222 bytes",
+            "listed [file-2.txt, file-3.csv]",
+            "listed [dir-a/, dir-b/, file-1.zip]",
+            "file not found",
+            "dir-a/dir-c has 1 files, 1100 bytes",
+            "rollback to 2021-07-01T12:00:00",
+            "listed [dir-a/, file-1.zip]",
+            "dir not found",
+            "found [dir-a/dir-c/file-2.txt]",
+        ])
+
+    def test_server_capacity(self):
+        output = simulate_coding_framework([
+            ["FILE_UPLOAD", "file-1.zip", "4321b"],
+            ["FILE_UPLOAD_AT", "2021-07-01T12:00:00", "dir-a/dir-c/file-2.txt", "11000b", 60],
+            ["SPACE_AT", "2021-07-01T12:00:00"],
+            ["FILE_COPY_AT", "2021-07-01T12:00:30", "file-1.zip", "file-1-copy.zip"],
+            ["SPACE_AT", "2021-07-01T12:05:00"],
+            ["SPACE_AT", "2021-07-01T12:00:30"],
+            ["FILE_UPLOAD_AT", "2021-07-01T12:05:00", "dir-b/file-4.mdx", "15000b"],
+            ["ROLLBACK", "2021-07-01T12:00:00"],
+            ["SPACE_AT", "2021-07-01T12:05:00"],
+        ], capacity=24000)
+        self.assertEqual(output[2:], ["used 15321 bytes, 8679 bytes free", "copied at file-1.zip to file-1-copy.zip", "used 8642 bytes, 15358 bytes free", "used 19642 bytes, 4358 bytes free", "uploaded at dir-b/file-4.mdx", "rollback to 2021-07-01T12:00:00", "used 4321 bytes, 19679 bytes free"])
+        self.assertEqual(simulate_coding_framework([["SPACE_AT", "2021-07-01T12:00:00"]]), ["used 0 bytes, no limit"])
+
+    def test_uploads_over_capacity_raise(self):
+        file_management_system = FileManagementSystem(Server(capacity=24000))
+        file_management_system.file_upload("file-1.zip", "20kb")
+        with self.assertRaises(RuntimeError):
+            file_management_system.file_copy("file-1.zip", "file-2.zip")
+        with self.assertRaises(RuntimeError):
+            file_management_system.file_upload_at("2021-07-01T12:00:00", "file-3.zip", "5kb")
+        self.assertEqual(file_management_system.file_upload_at("2021-07-01T12:00:00", "file-3.zip", "4kb", 10), "uploaded at file-3.zip")
+        # the ttl frees the space again
+        self.assertEqual(file_management_system.file_upload_at("2021-07-01T12:00:10", "file-4.zip", "4kb"), "uploaded at file-4.zip")
+
+    def test_expiry_window_and_usage_queries(self):
+        output = simulate_coding_framework([
+            ["FILE_UPLOAD", "Untimed.txt", "1kb"],
+            ["FILE_UPLOAD_AT", "2021-07-01T12:00:00", "Hour.txt", "100kb", 3600],
+            ["FILE_UPLOAD_AT", "2021-07-01T12:00:00", "Minute.txt", "20kb", 60],
+            ["FILE_EXPIRING_BETWEEN", "2021-07-01T12:00:00", "2021-07-01T13:00:00"],
+            ["USAGE_AT", "2021-07-01T12:00:30"],
+            ["USAGE_AT", "2021-07-01T12:30:00"],
+            ["FILE_COPY_AT", "2021-07-01T12:10:00", "Hour.txt", "Minute.txt"],
+            ["FILE_UPLOAD_AT", "2021-07-01T12:20:00", "Later.txt", "5kb", 60],
+            ["FILE_EXPIRING_BETWEEN", "2021-07-01T12:00:00", "2021-07-01T13:00:00"],
+            ["USAGE_AT", "2021-07-01T12:00:30"],
+            ["USAGE_AT", "2021-07-01T12:20:30"],
+            ["ROLLBACK", "2021-07-01T12:05:00"],
+            ["FILE_EXPIRING_BETWEEN", "2021-07-01T12:00:00", "2021-07-01T13:00:00"],
+            ["FILE_EXPIRING_BETWEEN", "2021-07-01T12:01:00", "2021-07-01T12:59:59"],
+            ["USAGE_AT", "2021-07-01T12:20:30"],
+            ["USAGE_AT", "2021-07-01T14:00:00"],
+            ["USAGE_AT", "2021-07-01T11:00:00"],
+        ])
+        self.assertEqual(output[3:], [
+            "expiring [Minute.txt, Hour.txt]",
+            "used 121000 bytes at 2021-07-01T12:00:30",
+            "used 101000 bytes at 2021-07-01T12:30:00",
+            "copied at Hour.txt to Minute.txt",
+            "uploaded at Later.txt",
+            # the copy replaced Minute.txt with Hour.txt's size and, as copies here do, no ttl
+            "expiring [Later.txt, Hour.txt]",
+            # Minute.txt counts up to the copy that replaced it at 12:10
+            "used 121000 bytes at 2021-07-01T12:00:30",
+            "used 206000 bytes at 2021-07-01T12:20:30",
+            "rollback to 2021-07-01T12:05:00",
+            "expiring [Minute.txt, Hour.txt]",
+            "expiring []",
+            "used 101000 bytes at 2021-07-01T12:20:30",
+            "used 1000 bytes at 2021-07-01T14:00:00",
+            "used 1000 bytes at 2021-07-01T11:00:00",
+        ])
+        # both answer from their indexes like a scan over every file held would, counting a
+        # replaced file up to the write that replaced it; later writes leave past answers alone
+        rng = random.Random(3)
+        file_management_system = FileManagementSystem(Server(), retention=1800)
+        answered = {}
+        for i in range(2000):
+            moment = 1625140800 + i * 3 + rng.randrange(60)
+            file_name, source = f"file-{rng.randrange(i + 1)}.txt", f"file-{rng.randrange(i + 1)}.txt"
+            if rng.random() < 0.02:
+                target = moment - rng.randrange(300)
+                file_management_system.rollback(target)
+                answered = {past: usage for past, usage in answered.items() if past < target}
+            elif file_management_system.file_get_at(moment, file_name)[0] is None:
+                file_management_system.file_upload_at(moment, file_name, f"{rng.randrange(1, 100)}kb", rng.choice([None, 30, 300, 3000]))
+            elif source != file_name and file_management_system.file_get_at(moment, source)[0] is not None:
+                file_management_system.file_copy_at(moment, source, file_name)
+            if i % 100 == 0:
+                table, held = file_management_system.table, list(file_management_system.files.values()) + list(file_management_system.expired.values())
+                used = 0
+                for row in held:
+                    replaced_at = simulation.NEVER
+                    while row != -1:
+                        if table.uploaded[row] <= moment - 100 < min(table.expires[row], replaced_at):
+                            used += table.sizes[row]
+                        replaced_at = table.uploaded[row]
+                        row = file_management_system.replaced.get(row, -1)
+                answered[moment - 100] = f"used {used} bytes at {format_timestamp(moment - 100)}"
+                # SPACE_AT means the same bytes, at or behind the clock
+                self.assertEqual(file_management_system.space_at(moment - 100), f"used {used} bytes, no limit")
+                self.assertEqual(file_management_system.space_at(file_management_system.clock), f"used {file_management_system._usage_at(file_management_system.clock)} bytes, no limit")
+                horizon = file_management_system.clock - file_management_system.retention
+                answered = {past: usage for past, usage in answered.items() if past > horizon}
+                for past, usage in answered.items():
+                    self.assertEqual(file_management_system.usage_at(past), usage)
+                expiring = sorted((table.expires[row], table.names[row]) for row in held if moment - 200 < table.expires[row] <= moment + 200)
+                self.assertEqual(file_management_system.file_expiring_between(moment - 200, moment + 200), f"expiring [{', '.join(file_name for _, file_name in expiring)}]")
+
+    def test_copies_share_content(self):
+        file_management_system = FileManagementSystem(Server())
+        file_management_system.file_upload_at("2021-07-01T12:00:00", "file-1.zip", "4kb", 60)
+        for i in range(2, 5):
+            file_management_system.file_copy_at("2021-07-01T12:00:10", "file-1.zip", f"file-{i}.zip")
+        table = file_management_system.table
+        self.assertEqual(len({table.content[file_management_system.files[f"file-{i}.zip"]] for i in range(1, 5)}), 1)
+        self.assertEqual(len(table.contents), 1)
+        self.assertEqual(file_management_system.storage(), "logical 16000 bytes, physical 4000 bytes")
+        # the source expiring leaves the copies and their shared content alone
+        self.assertEqual(file_management_system.file_get_at("2021-07-01T12:01:00", "file-1.zip"), (None, "file not found"))
+        self.assertEqual(file_management_system.file_get_at("2021-07-01T12:01:00", "file-3.zip")[0].size, 4000)
+        # neither does replacing one of the copies
+        file_management_system.file_upload_at("2021-07-01T12:02:00", "file-1.zip", "1kb")
+        self.assertEqual(file_management_system.file_get_at("2021-07-01T12:02:00", "file-1.zip")[0].size, 1000)
+        self.assertEqual(file_management_system.file_get_at("2021-07-01T12:02:00", "file-2.zip")[0].size, 4000)
+        # the replaced file-1.zip is kept for ROLLBACK to put back
+        self.assertEqual(file_management_system.storage(), "logical 17000 bytes, physical 5000 bytes")
+        file_management_system.rollback("2021-07-01T12:00:00")
+        self.assertEqual(file_management_system.storage(), "logical 4000 bytes, physical 4000 bytes")
+        self.assertEqual(len(table.contents), 1)
+        self.assertEqual(file_management_system.file_get_at("2021-07-01T12:00:30", "file-1.zip")[0].size, 4000)
+        self.assertEqual(simulate_coding_framework(self.test_data_1 + [["STORAGE"]])[-1], "logical 400000 bytes, physical 200000 bytes")
+
+    def test_write_ahead_log_recovers_state(self):
+        commands = self.test_data_3 + self.test_data_4 + [["FILE_UPLOAD", "dir-a/Untimed.txt", "5kb"], ["FILE_COPY", "dir-a/Untimed.txt", "Copy.txt"]]
+        reference = FileManagementSystem(Server())
+        expected = simulate_coding_framework(commands + self.test_data_4[6:], file_management_system=reference)
+        for checkpoint_every in [3, 10 ** 6]:
+            with tempfile.TemporaryDirectory() as directory:
+                output = list(stream_coding_framework(commands, wal=WriteAheadLog(directory, group_size=4, checkpoint_every=checkpoint_every)))
+                # a restart picks up where the first run stopped
+                output += stream_coding_framework(self.test_data_4[6:], wal=WriteAheadLog(directory))
+                self.assertEqual(output, expected)
+                file_management_system = FileManagementSystem(Server())
+                replayed = WriteAheadLog(directory).recover(file_management_system)
+                self.assertLess(replayed, 6 if checkpoint_every == 3 else 10 ** 6)
+                self.assertEqual(file_management_system.storage(), reference.storage())
+                self.assertEqual(file_management_system.dir_size(""), reference.dir_size(""))
+                self.assertEqual((file_management_system.clock, file_management_system.files.keys(), file_management_system.expired.keys()), (reference.clock, reference.files.keys(), reference.expired.keys()))
+                self.assertEqual(len(os.listdir(directory)), 2 if checkpoint_every == 3 else 1)
+
+    def test_write_ahead_log_recovers_what_retention_kept(self):
+        # reads move the clock without being logged, so what retention drops must depend on the clock alone
+        trace = workload.generate_trace(3000, seed=9, rollback_depth=90, max_step=3)
+        with tempfile.TemporaryDirectory() as directory:
+            reference = FileManagementSystem(Server(), retention=100)
+            list(stream_coding_framework(trace, file_management_system=reference, wal=WriteAheadLog(directory)))
+            file_management_system = FileManagementSystem(Server(), retention=100)
+            WriteAheadLog(directory).recover(file_management_system)
+        for system in [reference, file_management_system]:
+            self.assertEqual(system.clock, reference.clock)
+            self.assertEqual(system.undo_log[system.undo_start:], reference.undo_log[reference.undo_start:])
+            self.assertEqual(system.storage(), reference.storage())
+            self.assertEqual(system.usage_at(reference.clock - 100), reference.usage_at(reference.clock - 100))
+        expected = [reference.rollback(reference.clock - 100), reference.file_search_at(reference.clock, "")]
+        self.assertEqual([file_management_system.rollback(reference.clock - 100), file_management_system.file_search_at(reference.clock, "")], expected)
+
+    def test_write_ahead_log_ignores_torn_tail(self):
+        with tempfile.TemporaryDirectory() as directory:
+            list(stream_coding_framework(self.test_data_1, wal=WriteAheadLog(directory)))
+            with open(os.path.join(directory, "wal-0.log"), "a") as segment:
+                segment.write('[0, "Torn.txt", "1')
+            file_management_system = FileManagementSystem(Server())
+            self.assertEqual(WriteAheadLog(directory).recover(file_management_system), 2)
+            self.assertEqual(sorted(file_management_system.files), ["Cars.txt", "Cars2.txt"])
+            with open(os.path.join(directory, "wal-0.log")) as segment:
+                self.assertTrue(segment.read().endswith("\n"))
+
+    def test_snapshot_answers_like_the_system_that_wrote_it(self):
+        rng = random.Random(5)
+        file_management_system = FileManagementSystem(Server(), history=True)
+        for i in range(800):
+            timestamp = 1625140800 + rng.randrange(3600)
+            file_name = f"{rng.choice(['dir-a/', 'dir-b/', ''])}{rng.choice('abc')}{rng.randrange(300):03}.txt"
+            if file_management_system.file_get_at(timestamp, file_name)[0] is None:
+                file_management_system.file_upload_at(timestamp, file_name, f"{rng.randrange(20)}kb", rng.choice([None, 60, 600]))
+            elif rng.random() < 0.5 and file_management_system.file_get_at(timestamp, f"{file_name}.copy")[0] is None:
+                file_management_system.file_copy_at(timestamp, file_name, f"{file_name}.copy")
+        file_management_system.file_upload("dir-a/untimed-é.txt", "30kb")
+        prefixes, timestamps = ["", "dir-a/", "dir-b/b1", "c", "z"], [1625140800 + 120, 1625140800 + 3000, 1625140800 + 7200]
+        file_names = ["a001.txt", "dir-a/b002.txt", "dir-a/untimed-é.txt", "dir-b/c100.txt.copy", "missing.txt"]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "files.snapshot")
+            write_snapshot(file_management_system, path)
+            storage = file_management_system.storage()
+            # untimed searches first: the timed ones move the clock, which evicts files
+            expected = [file_management_system.file_search(prefix) for prefix in prefixes]
+            expected += [file_management_system.file_search_at(timestamp, prefix) for prefix in prefixes for timestamp in timestamps]
+            expected += [file_management_system.file_get_at(1625140800 + 1800, file_name)[1] for file_name in file_names]
+            snapshot = Snapshot(path)
+            for history in [False, True]:
+                loaded = snapshot.load(history=history)
+                if history:
+                    self.assertEqual(loaded.storage(), storage)
+                for system in [snapshot, loaded]:
+                    output = [system.file_search(prefix) for prefix in prefixes]
+                    output += [system.file_search_at(timestamp, prefix) for prefix in prefixes for timestamp in timestamps]
+                    output += [system.file_get_at(1625140800 + 1800, file_name) for file_name in file_names]
+                    self.assertEqual([result if isinstance(result, str) else result[1] for result in output], expected)
+                self.assertEqual(loaded.dir_list("dir-a"), file_management_system.dir_list("dir-a"))
+                self.assertEqual(loaded.space_at(1625140800 + 1800), file_management_system.space_at(1625140800 + 1800))
+            self.assertEqual(loaded.file_get_as_of(1625140800 + 900, "a001.txt")[1], file_management_system.file_get_as_of(1625140800 + 900, "a001.txt")[1])
+            snapshot.close()
+            with open(path, "r+b") as damaged:
+                damaged.write(b"NOTASNAP")
+            with self.assertRaises(RuntimeError):
+                Snapshot(path)
+
+    def test_snapshot_keeps_what_rollback_puts_back(self):
+        file_management_system = FileManagementSystem(Server())
+        file_management_system.file_upload("abc5", "8kb")
+        file_management_system.file_copy_at("2021-07-01T12:19:46", "abc5", "abc5")
+        trace = workload.generate_trace(2000, seed=6, prefix_count=2, rollback_rate=0)
+        simulate_coding_framework(trace, file_management_system=file_management_system)
+        loaded = Snapshot(snapshot_bytes(file_management_system)).load()
+        self.assertEqual(loaded.storage(), file_management_system.storage())
+        moment = parse_timestamp(trace[-1][1])
+        for timestamp in [moment - 300, 1625141851]:
+            expected = [file_management_system.rollback(timestamp), file_management_system.file_search_at(moment, ""), file_management_system.file_search_at(moment, "p01/")]
+            self.assertEqual([loaded.rollback(timestamp), loaded.file_search_at(moment, ""), loaded.file_search_at(moment, "p01/")], expected)
+            self.assertEqual(loaded.usage_at(moment - 600), file_management_system.usage_at(moment - 600))
+        self.assertEqual(loaded.file_search("abc"), "found [abc5]")
+
+    def test_generated_traces_are_seeded_and_valid(self):
+        trace = workload.generate_trace(3000, seed=4, rollback_rate=0.02, prefix_skew=2.0)
+        self.assertEqual(trace, workload.generate_trace(3000, seed=4, rollback_rate=0.02, prefix_skew=2.0))
+        self.assertNotEqual(trace, workload.generate_trace(3000, seed=5, rollback_rate=0.02, prefix_skew=2.0))
+        self.assertEqual({command[0] for command in trace}, {"FILE_UPLOAD_AT", "FILE_GET_AT", "FILE_COPY_AT", "FILE_SEARCH_AT", "ROLLBACK"})
+        # the skew piles most files onto the first prefix
+        uploads = [command[2] for command in trace if command[0] == "FILE_UPLOAD_AT"]
+        self.assertGreater(sum(file_name.startswith("p00/") for file_name in uploads), len(uploads) / 3)
+        # every command is valid, so nothing raises
+        self.assertEqual(len(simulate_coding_framework(trace)), 3000)
+        untimed = workload.generate_trace(500, mix={"FILE_UPLOAD": 2, "FILE_GET": 1, "FILE_COPY": 1, "FILE_SEARCH": 1}, rollback_rate=0)
+        self.assertEqual(len(simulate_coding_framework(untimed)), 500)
+
+    def test_stats(self):
+        stats = Stats()
+        self.assertEqual(simulate_coding_framework(self.test_data_4, history=True, stats=stats), simulate_coding_framework(self.test_data_4, history=True))
+        exported = json.loads(stats.to_json())
+        self.assertEqual({command: entry["calls"] for command, entry in exported["commands"].items()}, {"FILE_UPLOAD_AT": 3, "FILE_GET_AT": 4, "FILE_COPY_AT": 1, "ROLLBACK": 1, "FILE_SEARCH_AT": 1})
+        self.assertEqual(sum(exported["commands"]["FILE_GET_AT"]["latency"].values()), 4)
+        # the undo log entries of Update1Copy.txt and Update2.txt; ROLLBACK scans no files
+        self.assertEqual(exported["counters"]["rollback_entries_undone"], 2)
+        self.assertEqual(exported["counters"]["files_scanned"], 1)
+        self.assertEqual(exported["counters"]["matches_sorted"], 1)
+        self.assertEqual(stats.as_dict(), exported)
+        # reads behind the clock check expired files: Expired.txt once, CodeSignal.txt when copied and when searched
+        stats = Stats()
+        simulate_coding_framework(self.test_data_3, stats=stats)
+        self.assertEqual(stats.counters["is_alive_calls"], 3)
+        self.assertEqual(Stats().as_dict(), {"commands": {}, "counters": {}})
+
+    def test_file_service_pipelines_clients(self):
+        traces = [workload.generate_trace(600, seed=client, rollback_rate=0, namespace=f"c{client}/") for client in range(3)]
+
+        async def run(path: str):
+            # a tiny queue and pipeline depth so backpressure kicks in all the time
+            service = FileService(batch_size=16, queue_size=4, pipeline_depth=8)
+            await service.start_unix(path)
+            clients = [await FileClient.connect_unix(path) for _ in traces]
+            results = await asyncio.gather(*(client.execute_many(trace) for client, trace in zip(clients, traces)))
+            with self.assertRaises(RuntimeError):
+                await clients[0].execute(["FILE_COPY_AT", "2021-07-01T12:00:00", "missing.txt", "copy.txt"])
+            with self.assertRaises(RuntimeError):
+                await clients[0].execute(["NOT_A_COMMAND"])
+            self.assertEqual(await clients[1].execute(["FILE_UPLOAD", "shared.txt", "1kb"]), "uploaded shared.txt")
+            self.assertEqual(await clients[1].execute(["FILE_GET", "shared.txt"]), "got shared.txt")
+            self.assertIsNone(await clients[1].execute(["FILE_GET", "missing.txt"]))
+            self.assertEqual(await clients[2].execute(["FILE_GET_MANY_AT", "2021-07-01T12:00:00", "shared.txt", "missing.txt"]), ["got at shared.txt", "file not found"])
+            for client in clients:
+                await client.close()
+            await service.close()
+            return results
+
+        with tempfile.TemporaryDirectory() as directory:
+            results = asyncio.run(run(os.path.join(directory, "service.sock")))
+        # each client's namespace is its own, so it sees what it would see alone
+        self.assertEqual(results, [simulate_coding_framework(trace) for trace in traces])
+
+    def test_file_service_reports_failed_commits(self):
+        class FailingWriteAheadLog(WriteAheadLog):
+            failing = True
+
+            def commit(self) -> None:
+                if self.failing:
+                    raise OSError("disk full")
+                super().commit()
+
+        async def run(directory: str):
+            wal = FailingWriteAheadLog(os.path.join(directory, "wal"))
+            service = FileService(wal=wal)
+            await service.start_unix(os.path.join(directory, "service.sock"))
+            client = await FileClient.connect_unix(os.path.join(directory, "service.sock"))
+            with self.assertRaisesRegex(RuntimeError, "disk full"):
+                await client.execute(["FILE_UPLOAD", "a.txt", "1kb"])
+            # the engine lives on
+            wal.failing = False
+            self.assertEqual(await client.execute(["FILE_UPLOAD", "b.txt", "1kb"]), "uploaded b.txt")
+            await client.close()
+            # requests the engine has not taken yet are failed on close, not left hanging
+            futures = [asyncio.get_running_loop().create_future() for _ in range(3)]
+            for future in futures:
+                service.queue.put_nowait((["FILE_SEARCH", ""], future))
+            await service.close()
+            return futures
+
+        with tempfile.TemporaryDirectory() as directory:
+            futures = asyncio.run(run(directory))
+        self.assertTrue(all(isinstance(future.exception(), RuntimeError) for future in futures))
+
+    def test_concurrent_readers_see_whole_batches(self):
+        concurrent = ConcurrentFileSystem()
+        concurrent.write(self.test_data_3)
+        self.assertEqual(concurrent.file_search_at("2021-07-01T12:00:00", "Py"), simulate_coding_framework(self.test_data_3)[4])
+        seen, stop = [], threading.Event()
+
+        def read():
+            # each batch uploads or rolls back all ten files of one folder
+            while not stop.is_set():
+                for batch in range(5):
+                    seen.append(concurrent.file_search_at("2021-07-01T14:00:00", f"batch-{batch}/").count(".txt"))
+
+        readers = [threading.Thread(target=read) for _ in range(4)]
+        for reader in readers:
+            reader.start()
+        for batch in range(5):
+            concurrent.write([["FILE_UPLOAD_AT", f"2021-07-01T13:0{batch}:00", f"batch-{batch}/file-{i}.txt", f"{i + 1}kb"] for i in range(10)])
+        concurrent.write([["ROLLBACK", "2021-07-01T13:02:30"]])
+        stop.set()
+        for reader in readers:
+            reader.join()
+        self.assertTrue(seen)
+        self.assertEqual(set(seen) - {0, 10}, set())
+        self.assertEqual(concurrent.search_many_at("2021-07-01T14:00:00", ["batch-2/", "batch-3/"]), ["found at [" + ", ".join(f"batch-2/file-{i}.txt" for i in range(9, -1, -1)) + "]", "found at []"])
+        self.assertEqual(concurrent.get_many_at("2021-07-01T14:00:00", ["batch-0/file-0.txt", "batch-4/file-0.txt"]), ["got at batch-0/file-0.txt", "file not found"])
+
+    def test_concurrent_writes_publish_only_what_changed(self):
+        concurrent = ConcurrentFileSystem()
+        concurrent.write([["FILE_UPLOAD_AT", "2021-07-01T12:00:00", f"base/file-{i}.txt", f"{i % 50 + 1}kb"] for i in range(20000)])
+        base = concurrent.snapshot().base
+        rng = random.Random(12)
+        for batch in range(300):
+            moment = 1625140800 + 10 * batch
+            commands = [["FILE_UPLOAD_AT", format_timestamp(moment), f"dir-{rng.randrange(3)}/file-{batch}-{i}.txt", f"{rng.randrange(1, 60)}kb", rng.choice([None, 30])] for i in range(3)]
+            commands.append(["FILE_COPY_AT", format_timestamp(moment), f"base/file-{rng.randrange(10000)}.txt", f"base/file-{rng.randrange(10000, 20000)}.txt"])
+            if rng.random() < 0.05:
+                commands.append(["ROLLBACK", format_timestamp(moment - rng.randrange(60))])
+            concurrent.write(commands)
+            if batch % 50 == 0:
+                # the layers answer like a full snapshot of the same state
+                expected = Snapshot(snapshot_bytes(concurrent.file_management_system))
+                published = concurrent.snapshot()
+                for prefix in ["", "base/file-1", "dir-1/", "dir-2/file-1"]:
+                    self.assertEqual(published.file_search(prefix), expected.file_search(prefix))
+                    self.assertEqual(published.file_search_at(moment - 5, prefix), expected.file_search_at(moment - 5, prefix))
+                for file_name in ["base/file-7.txt", "base/file-8.txt", f"dir-0/file-{batch}-0.txt", "missing.txt"]:
+                    self.assertEqual(published.file_get(file_name), expected.file_get(file_name))
+                    self.assertEqual(published.file_get_at(moment + 700, file_name), expected.file_get_at(moment + 700, file_name))
+        # a few names per batch never came near a quarter of the rows: no full snapshot since
+        self.assertIs(concurrent.snapshot().base, base)
+        self.assertLess(len(concurrent.snapshot().layers), 12)
+        # a batch that fails partway leaves nothing behind, now or in later publishes
+        with self.assertRaises(RuntimeError):
+            concurrent.write([["FILE_UPLOAD", "partial.txt", "1kb"], ["FILE_COPY", "missing.txt", "copy.txt"]])
+        self.assertIsNone(concurrent.file_management_system.file_get("partial.txt"))
+        concurrent.write([["FILE_UPLOAD", "after.txt", "1kb"]])
+        self.assertEqual((concurrent.file_get("partial.txt"), concurrent.file_get("after.txt")), (None, "got after.txt"))
+        self.assertEqual(concurrent.file_search_at("2021-07-01T13:00:00", "base/file-1999"), Snapshot(snapshot_bytes(concurrent.file_management_system)).file_search_at("2021-07-01T13:00:00", "base/file-1999"))
+        # batches that keep changing one name never fill the layers, but still take a full snapshot
+        concurrent = ConcurrentFileSystem()
+        concurrent.write([["FILE_UPLOAD", "A.txt", "1kb"], ["FILE_UPLOAD", "B.txt", "1kb"]])
+        for _ in range(10000):
+            concurrent.write([["FILE_COPY", "A.txt", "B.txt"]])
+        self.assertLessEqual(len(concurrent.written), file_concurrency.CONCURRENT_LAYERED_MIN)
+        self.assertEqual(concurrent.file_get("B.txt"), "got B.txt")
+
+    def test_search_cache_answers_like_uncached_search(self):
+        trace = workload.generate_trace(4000, seed=9, rollback_rate=0.01, prefix_count=4, max_step=2, mix={"FILE_UPLOAD_AT": 30, "FILE_GET_AT": 5, "FILE_COPY_AT": 10, "FILE_SEARCH_AT": 55})
+        cached, uncached = FileManagementSystem(Server(), search_cache_size=8), FileManagementSystem(Server(), search_cache_size=0)
+        self.assertEqual(simulate_coding_framework(trace, file_management_system=cached), simulate_coding_framework(trace, file_management_system=uncached))
+        self.assertGreater(cached.search_cache_hits, 100)
+        self.assertLessEqual(len(cached.search_cache), 8)
+        self.assertEqual(uncached.search_cache_hits, 0)
+        # an upload too small to enter the top 10 keeps the entry, a bigger one drops it
+        file_management_system = FileManagementSystem(Server())
+        for i in range(12):
+            file_management_system.file_upload(f"Up{i:02}", f"{i + 10}kb")
+        file_management_system.file_upload("Code", "1kb")
+        expected = file_management_system.file_search("Up")
+        file_management_system.file_upload("Up-small", "1kb")
+        file_management_system.file_upload("Cod", "100kb")
+        self.assertEqual(file_management_system.file_search("Up"), expected)
+        self.assertEqual((file_management_system.search_cache_hits, file_management_system.search_cache_misses), (1, 1))
+        file_management_system.file_upload("Up-big", "100kb")
+        self.assertEqual(file_management_system.file_search("Up"), expected.replace("[", "[Up-big, ").replace(", Up02]", "]"))
+        self.assertEqual(file_management_system.search_cache_misses, 2)
+
+    def test_backends_answer_alike(self):
+        trace = workload.generate_trace(3000, seed=4, rollback_rate=0.005, prefix_count=3, max_step=2)
+        for options in [{}, {"retention": 600, "history": True}]:
+            outputs = {}
+            for backend in ["python", "sortedcontainers", "numpy", "auto"]:
+                file_management_system = FileManagementSystem(Server(), search_cache_size=0, backend=backend, **options)
+                # small enough for "auto" to move to sortedcontainers part way through the trace
+                with patch.object(simulation, "SORTED_BACKEND_MIN", 200):
+                    outputs[backend] = simulate_coding_framework(trace, file_management_system=file_management_system)
+                self.assertEqual(file_management_system.sorted_list is simulation.PlainSortedList, backend == "python")
+                self.assertEqual(file_management_system.vectorized, backend != "python" and backend != "sortedcontainers")
+            self.assertEqual(outputs["python"], outputs["sortedcontainers"])
+            self.assertEqual(outputs["python"], outputs["numpy"])
+            self.assertEqual(outputs["python"], outputs["auto"])
+        with self.assertRaises(RuntimeError):
+            FileManagementSystem(Server(), backend="rust")
+
+    def test_import_leaves_optional_modules_unloaded(self):
+        probe = "import sys, simulation; simulation.simulate_coding_framework([['FILE_UPLOAD', 'a.txt', '1kb'], ['FILE_SEARCH', 'a']]); print(sorted({'numpy', 'sortedcontainers', 'hashlib', 'mmap', 'struct', 'threading', 'json'} & set(sys.modules)))"
+        completed = subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(completed.stdout.strip(), "[]")
+
+    def test_cluster_matches_single_server(self):
+        for test_data in [self.test_data_1, self.test_data_2, self.test_data_3, self.test_data_4]:
+            cluster = FileCluster(Server(name=f"server{i}") for i in range(4))
+            self.assertEqual(simulate_coding_framework(test_data, file_management_system=cluster), simulate_coding_framework(test_data))
+        # untimed commands between timed ones: every server follows the newest timestamp
+        mix = {"FILE_UPLOAD_AT": 30, "FILE_UPLOAD": 5, "FILE_GET_AT": 15, "FILE_COPY_AT": 10, "FILE_COPY": 5, "FILE_SEARCH_AT": 10, "FILE_SEARCH": 15}
+        trace = workload.generate_trace(3000, seed=6, mix=mix, prefix_count=2, ttls={None: 30, 10: 40, 600: 30})
+        cluster = FileCluster(Server(name=f"server{i}") for i in range(4))
+        self.assertEqual(simulate_coding_framework(trace, file_management_system=cluster), simulate_coding_framework(trace))
+        cluster = FileCluster(Server(name=f"server{i}") for i in range(4))
+        cluster.file_upload_at("2021-07-01T12:00:00", "f0", "1kb", 10)
+        other = next(f"g{i}" for i in itertools.count() if cluster.owner(f"g{i}") is not cluster.owner("f0"))
+        cluster.file_get_at("2021-07-01T13:00:00", other)
+        self.assertEqual((cluster.file_search("f"), cluster.file_get("f0")), ("found []", None))
+
+    def test_cluster_search_merges_per_server_results(self):
+        rng = random.Random(11)
+        file_management_system = FileManagementSystem(Server())
+        cluster = FileCluster(Server(name=f"server{i}") for i in range(5))
+        for i in range(1000):
+            args = 1625140800 + rng.randrange(3600), f"{rng.choice('abc')}{i:04}.txt", f"{rng.randrange(20)}kb", rng.choice([None, 60, 600])
+            file_management_system.file_upload_at(*args)
+            cluster.file_upload_at(*args)
+        self.assertGreater(min(len(system.files) + len(system.expired) for system in cluster.systems.values()), 0)
+        for timestamp in [1625140800 + 300, 1625140800 + 7200]:
+            for prefix in ["", "a", "b1", "c12", "z"]:
+                self.assertEqual(cluster.file_search_at(timestamp, prefix), file_management_system.file_search_at(timestamp, prefix))
+        self.assertEqual(cluster.space_at(1625140800 + 7200), file_management_system.space_at(1625140800 + 7200))
+        self.assertEqual(cluster.dir_list(""), file_management_system.dir_list(""))
+        self.assertEqual(cluster.file_expiring_between(1625140800 + 600, 1625140800 + 1200), file_management_system.file_expiring_between(1625140800 + 600, 1625140800 + 1200))
+        self.assertEqual(cluster.usage_at(1625140800 + 1800), file_management_system.usage_at(1625140800 + 1800))
+
+    def test_cluster_copies_across_servers(self):
+        cluster = FileCluster([Server(name="server1"), Server(name="server2")])
+        source = "file-1.zip"
+        dest = next(f"copy-{i}.zip" for i in itertools.count() if cluster.owner(f"copy-{i}.zip") is not cluster.owner(source))
+        cluster.file_upload_at("2021-07-01T12:00:00", source, "4kb", 60)
+        self.assertEqual(cluster.file_copy_at("2021-07-01T12:00:30", source, dest), f"copied at {source} to {dest}")
+        self.assertEqual(cluster.file_get_at("2021-07-01T12:05:00", source)[1], "file not found")
+        self.assertEqual(cluster.file_get_at("2021-07-01T12:05:00", dest)[0].size, 4000)
+        with self.assertRaises(RuntimeError):
+            cluster.file_copy_at("2021-07-01T12:05:00", source, dest)
+
+    def test_adding_a_server_moves_about_1_over_n_files(self):
+        cluster = FileCluster(Server(name=f"server{i}") for i in range(9))
+        for i in range(5000):
+            cluster.file_upload(f"file-{i}.txt", "1kb")
+        moved = cluster.add_server(Server(name="server9"))
+        self.assertLess(abs(moved - 500), 200)
+        self.assertEqual(len(cluster.systems["server9"].files), moved)
+        self.assertTrue(all(cluster.file_get(f"file-{i}.txt") is not None for i in range(5000)))
+        self.assertEqual(cluster.dir_size(""), "/ has 5000 files, 5000000 bytes")
+        with self.assertRaises(RuntimeError):
+            cluster.add_server(Server(name="server9"))
+
+    def test_rollback_after_adding_a_server(self):
+        # moved files bring the files they replaced and their undo log entries along
+        cluster = FileCluster(Server(name=f"server{i}") for i in range(3))
+        file_management_system = FileManagementSystem(Server())
+        for system in [cluster, file_management_system]:
+            for i in range(40):
+                system.file_upload_at("2021-07-01T12:00:00", f"f{i}", f"{i + 1}kb")
+            for i in range(1, 40):
+                system.file_copy_at("2021-07-01T12:30:00", "f0", f"f{i}")
+        self.assertGreater(cluster.add_server(Server(name="server3")), 0)
+        for system in [cluster, file_management_system]:
+            system.rollback("2021-07-01T12:10:00")
+        for i in range(40):
+            self.assertEqual(cluster.file_get_at("2021-07-01T12:40:00", f"f{i}")[0].size, (i + 1) * 1000)
+        self.assertEqual(cluster.file_search_at("2021-07-01T12:40:00", "f"), file_management_system.file_search_at("2021-07-01T12:40:00", "f"))
+        self.assertEqual(cluster.usage_at("2021-07-01T12:20:00"), file_management_system.usage_at("2021-07-01T12:20:00"))
+        trace = workload.generate_trace(4000, seed=8, rollback_rate=0.05)
+        cluster = FileCluster(Server(name=f"server{i}") for i in range(3))
+        output = simulate_coding_framework(trace[:2000], file_management_system=cluster)
+        cluster.add_server(Server(name="server3"))
+        output += simulate_coding_framework(trace[2000:], file_management_system=cluster)
+        self.assertEqual(output, simulate_coding_framework(trace))
+
+if __name__ == '__main__':
+    unittest.main()
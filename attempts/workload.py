@@ -0,0 +1,117 @@
+"""
+Seeded synthetic command traces for benchmarking the simulate_coding_framework implementations.
+
+Usage: python workload.py N [seed] > trace.jsonl   (replay with: python simulation.py trace.jsonl)
+
+Every generated command is valid for the trace so far: uploads and copy destinations use fresh
+names, copies only read files alive at their timestamp, so implementations that raise on
+conflicts can run any trace. Timestamps only move forward; ROLLBACK goes back at most
+rollback_depth seconds and the generator forgets the files it removed.
+"""
+import json
+import random
+import sys
+from datetime import datetime, timedelta
+
+START = 1625140800
+# relative weights of each command; ROLLBACK is controlled by rollback_rate instead
+DEFAULT_MIX = {"FILE_UPLOAD_AT": 40, "FILE_GET_AT": 25, "FILE_COPY_AT": 10, "FILE_SEARCH_AT": 25}
+# ttl in seconds -> weight; None never expires
+DEFAULT_TTLS = {None: 50, 60: 15, 600: 15, 3600: 20}
+
+def _format(moment: int) -> str:
+    return (datetime(1970, 1, 1) + timedelta(seconds=moment)).strftime("%Y-%m-%dT%H:%M:%S")
+
+def generate_trace(command_count: int, seed: int = 0, mix: dict[str, float] | None = None, prefix_count: int = 16, prefix_skew: float = 1.0, ttls: dict[int | None, float] | None = None, rollback_rate: float = 0.01, rollback_depth: int = 600, max_step: int = 5, namespace: str = "") -> list[list]:
+    """
+    Generates command_count commands.
+
+    Parameters:
+    command_count (int): Number of commands.
+    seed (int): Seed; the same arguments always give the same trace.
+    mix (dict[str, float] | None): Command name -> weight. Untimed commands (FILE_UPLOAD, ...)
+        are allowed too, but most implementations do not mix them with timed ones.
+    prefix_count (int): Number of folder prefixes ("p00/", "p01/", ...) names are spread over.
+    prefix_skew (float): Zipf exponent over the prefixes; 0 is uniform, larger piles files and
+        searches onto the first few prefixes.
+    ttls (dict[int | None, float] | None): Ttl -> weight for uploads.
+    rollback_rate (float): Probability that a command is a ROLLBACK.
+    rollback_depth (int): Largest number of seconds a ROLLBACK goes back.
+    max_step (int): Largest number of seconds between two commands.
+    namespace (str): Put in front of every name, so traces for different clients never collide.
+    """
+    rng = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    ttls = ttls or DEFAULT_TTLS
+    operations, operation_weights = list(mix), list(mix.values())
+    ttl_values, ttl_weights = list(ttls), list(ttls.values())
+    prefixes = [f"{namespace}p{i:02}/" for i in range(prefix_count)]
+    prefix_weights = [1 / (rank + 1) ** prefix_skew for rank in range(prefix_count)]
+
+    moment = START
+    # name -> (uploaded_at, expires_at) of the files the trace has created, and the names in a list for sampling
+    files: dict[str, tuple[int, float]] = {}
+    names: list[str] = []
+    counter = 0
+
+    def fresh_name() -> str:
+        nonlocal counter
+        counter += 1
+        return f"{rng.choices(prefixes, prefix_weights)[0]}file-{counter:08}.txt"
+
+    def add(file_name: str, expires_at: float) -> None:
+        files[file_name] = (moment, expires_at)
+        names.append(file_name)
+
+    def alive_name() -> str | None:
+        for _ in range(8):
+            file_name = rng.choice(names) if names else None
+            if file_name is not None and files[file_name][1] > moment:
+                return file_name
+        return None
+
+    trace = []
+    for _ in range(command_count):
+        moment += rng.randrange(max_step + 1)
+        timestamp = _format(moment)
+        if rng.random() < rollback_rate:
+            target = max(START, moment - rng.randrange(1, rollback_depth + 1))
+            trace.append(["ROLLBACK", _format(target)])
+            for file_name in [file_name for file_name, (uploaded_at, _) in files.items() if uploaded_at > target]:
+                del files[file_name]
+            names = list(files)
+            continue
+        operation = rng.choices(operations, operation_weights)[0]
+        source = alive_name() if operation in ("FILE_COPY", "FILE_COPY_AT") else None
+        if operation in ("FILE_COPY", "FILE_COPY_AT") and source is None or operation == "FILE_GET" and not names:
+            # nothing to copy or get yet
+            operation = "FILE_UPLOAD" if operation in ("FILE_COPY", "FILE_GET") else "FILE_UPLOAD_AT"
+        if operation == "FILE_UPLOAD":
+            file_name = fresh_name()
+            trace.append([operation, file_name, f"{rng.randrange(1, 1000)}kb"])
+            add(file_name, float("inf"))
+        elif operation == "FILE_UPLOAD_AT":
+            file_name, ttl = fresh_name(), rng.choices(ttl_values, ttl_weights)[0]
+            trace.append([operation, timestamp, file_name, f"{rng.randrange(1, 1000)}kb"] + ([ttl] if ttl is not None else []))
+            add(file_name, moment + ttl if ttl is not None else float("inf"))
+        elif operation in ("FILE_GET", "FILE_GET_AT"):
+            # mostly names the trace created, some misses; FILE_GET has no "not found" answer
+            file_name = rng.choice(names) if names and (operation == "FILE_GET" or rng.random() < 0.9) else fresh_name()
+            trace.append([operation, file_name] if operation == "FILE_GET" else [operation, timestamp, file_name])
+        elif operation in ("FILE_COPY", "FILE_COPY_AT"):
+            dest = fresh_name()
+            trace.append([operation, source, dest] if operation == "FILE_COPY" else [operation, timestamp, source, dest])
+            # implementations disagree on whether a copy keeps the source's ttl; assume it does,
+            # so the copy is never picked as a source after either reading of it expired
+            add(dest, files[source][1])
+        elif operation in ("FILE_SEARCH", "FILE_SEARCH_AT"):
+            # a whole folder, or a folder plus the start of a file number
+            prefix = rng.choices(prefixes, prefix_weights)[0] + rng.choice(["", "file-", "file-0000"])
+            trace.append([operation, prefix] if operation == "FILE_SEARCH" else [operation, timestamp, prefix])
+        else:
+            raise RuntimeError(f"unsupported command {operation}")
+    return trace
+
+if __name__ == "__main__":
+    for command in generate_trace(int(sys.argv[1]), int(sys.argv[2]) if len(sys.argv) > 2 else 0):
+        print(json.dumps(command))
@@ -0,0 +1,149 @@
+"""
+WriteAheadLog: durability for a FileManagementSystem, as a JSON checkpoint plus log segments of
+the mutating commands run since, replayed on recovery.
+"""
+import json
+import os
+from typing import IO
+
+from simulation import FileManagementSystem, command_handlers
+
+# log record that moves the clock, for reads that advanced it between two mutations
+WAL_CLOCK = -1
+WAL_GROUP_SIZE = 256
+WAL_CHECKPOINT_EVERY = 100_000
+
+class WriteAheadLog():
+    """
+    Durable state for a FileManagementSystem in a local directory: a JSON checkpoint plus an
+    append-only log of the mutating commands run since it. Records are buffered and written with
+    a single fsync per group of group_size (group commit); every checkpoint_every records the
+    state is checkpointed and a fresh log segment started, so recovery replays only that tail.
+
+    Files: checkpoint.json holds the state and the generation of the log segment wal-{generation}.log
+    that continues it. A torn last line left by a crash is ignored on recovery.
+    """
+    def __init__(self, directory: str, group_size: int = WAL_GROUP_SIZE, checkpoint_every: int = WAL_CHECKPOINT_EVERY):
+        self.directory: str = directory
+        self.group_size: int = group_size
+        self.checkpoint_every: int = checkpoint_every
+        self.generation: int = 0
+        self.buffer: list[str] = []
+        # records written to the current segment
+        self.logged: int = 0
+        # clock the log replays to so far, to know when a clock record is needed
+        self.clock: int | None = None
+        self.file_management_system: FileManagementSystem | None = None
+        self.segment: IO[str] | None = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, file_name: str) -> str:
+        return os.path.join(self.directory, file_name)
+
+    def _open_segment(self) -> None:
+        self.segment = open(self._path(f"wal-{self.generation}.log"), "a", encoding="utf-8")
+
+    def recover(self, file_management_system: FileManagementSystem) -> int:
+        """
+        Loads the last checkpoint and replays the log tail into an empty file_management_system,
+        which the log then records. Returns the number of log records replayed.
+        """
+
+        self.file_management_system = file_management_system
+        try:
+            with open(self._path("checkpoint.json"), encoding="utf-8") as checkpoint:
+                state = json.load(checkpoint)
+        except FileNotFoundError:
+            state = None
+        if state is not None:
+            self.generation = state["generation"]
+            file_management_system._import_state(state)
+        handlers = command_handlers(file_management_system)
+        replayed = 0
+        # a line without its newline was cut short by a crash and was never committed
+        good_bytes = 0
+        try:
+            with open(self._path(f"wal-{self.generation}.log"), encoding="utf-8", newline="\n") as segment:
+                for line in segment:
+                    if not line.endswith("\n"):
+                        break
+                    opcode, *args = json.loads(line)
+                    if opcode == WAL_CLOCK:
+                        file_management_system._advance(args[0])
+                    else:
+                        handlers[opcode](*args)
+                    replayed += 1
+                    good_bytes += len(line.encode())
+        except FileNotFoundError:
+            pass
+        self._open_segment()
+        self.segment.truncate(good_bytes)
+        self.logged = replayed
+        self.clock = file_management_system.clock
+        return replayed
+
+    def execute(self, handler, opcode: int, args: tuple):
+        """
+        Runs one compiled mutating command and buffers its log record. Commands that raise are not
+        logged, so replay never meets them.
+        """
+
+        clock = self.file_management_system.clock
+        result = handler(*args)
+        if clock != self.clock:
+            self.buffer.append(json.dumps([WAL_CLOCK, clock]))
+        self.buffer.append(json.dumps([opcode, *args]))
+        self.clock = self.file_management_system.clock
+        if len(self.buffer) >= self.group_size:
+            self.commit()
+        return result
+
+    def _write(self) -> None:
+        # group commit: one write and one fsync for every record buffered so far
+        if self.buffer:
+            self.segment.write("\n".join(self.buffer) + "\n")
+            self.segment.flush()
+            os.fsync(self.segment.fileno())
+            self.logged += len(self.buffer)
+            self.buffer.clear()
+
+    def commit(self) -> None:
+        # reads since the last mutation may have moved the clock; log that too
+        if self.file_management_system.clock != self.clock:
+
+            self.clock = self.file_management_system.clock
+            self.buffer.append(json.dumps([WAL_CLOCK, self.clock]))
+        self._write()
+        if self.logged >= self.checkpoint_every:
+            self.checkpoint()
+
+    def checkpoint(self) -> None:
+        """
+        Writes the current state atomically and starts a new, empty log segment.
+        """
+
+        self._write()
+        state = self.file_management_system._export_state()
+        state["generation"] = self.generation + 1
+        # the new segment exists before the checkpoint that points at it
+        open(self._path(f"wal-{self.generation + 1}.log"), "w").close()
+        temporary = self._path("checkpoint.json.tmp")
+        with open(temporary, "w", encoding="utf-8") as checkpoint:
+            json.dump(state, checkpoint)
+            checkpoint.flush()
+            os.fsync(checkpoint.fileno())
+        os.replace(temporary, self._path("checkpoint.json"))
+        directory = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+        self.segment.close()
+        os.remove(self._path(f"wal-{self.generation}.log"))
+        self.generation += 1
+        self.logged = 0
+        self._open_segment()
+
+    def close(self) -> None:
+        self.commit()
+        self.segment.close()